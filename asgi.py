@@ -0,0 +1,145 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from config import Config
+from dispatch import Request, bootstrap, handle, record_request, shutdown, stop_streams
+from events import EventStream
+
+# controllers and psycopg2 are blocking, run them off the event loop
+executor = ThreadPoolExecutor(max_workers=Config.HTTP_WORKERS, thread_name_prefix="asgi-worker")
+
+
+def executor_stats() -> dict:
+    return {
+        "workers": executor._max_workers,
+        "queued": executor._work_queue.qsize(),
+    }
+
+
+async def lifespan(receive, send) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await loop.run_in_executor(executor, bootstrap)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            stop_streams()
+            executor.shutdown(wait=True)  # finish in-flight requests
+            shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def app(scope, receive, send) -> None:
+    """
+    ASGI application serving the same API as `main.RequestHandler`.
+    """
+
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    if scope["query_string"]:
+        path += "?" + scope["query_string"].decode("latin-1")
+
+    body = await read_body(receive)
+    started = time.perf_counter()
+    request = Request(
+        method=scope["method"],
+        path=path,
+        headers={name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]},
+        body=body,
+    )
+
+    loop = asyncio.get_running_loop()
+    response = await loop.run_in_executor(executor, handle, request, executor_stats)
+    handled = time.perf_counter()
+    try:
+        if isinstance(response.body, EventStream):
+            await send_events(send, receive, loop, response)
+        else:
+            await send_response(send, loop, response)
+    finally:
+        record_request(request, response, started, handled)
+
+
+async def send_response(send, loop, response) -> None:
+    """
+    Send a response of `dispatch.handle`, streamed bodies in chunks.
+    """
+
+    headers = [
+        (name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in response.headers.items()
+    ]
+    if not response.streaming:
+        if response.status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):  # no body is allowed
+            headers.append((b"content-length", str(len(response.body)).encode()))
+        await send({"type": "http.response.start", "status": int(response.status), "headers": headers})
+        await send({"type": "http.response.body", "body": response.body})
+        return
+
+    # server chunks the body; each chunk is produced by blocking db reads, so off the loop
+    await send({"type": "http.response.start", "status": int(response.status), "headers": headers})
+    chunks = iter(response.body)
+    try:
+        while (chunk := await loop.run_in_executor(executor, next, chunks, None)) is not None:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            await loop.run_in_executor(executor, close)  # release db cursor and connection held by the stream
+
+
+async def send_events(send, receive, loop, response) -> None:
+    """
+    Send an event stream until it ends or the client disconnects, on the loop: a subscriber holds no executor thread.
+    """
+
+    headers = [
+        (name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in response.headers.items()
+    ]
+    stream = response.body
+    ready = asyncio.Event()
+    stream.on_ready(lambda: loop.call_soon_threadsafe(ready.set))
+    disconnected = asyncio.ensure_future(receive())  # the body is read already, the next message is a disconnect
+    try:
+        await send({"type": "http.response.start", "status": int(response.status), "headers": headers})
+        while not disconnected.done():
+            ready.clear()
+            data = stream.read()
+            if data is None:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if data:
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            woken = asyncio.ensure_future(ready.wait())
+            timeout = max(stream.wait_until() - time.monotonic(), 0)
+            await asyncio.wait((woken, disconnected), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+    finally:
+        disconnected.cancel()
+        stream.close()
@@ -0,0 +1,62 @@
+"""
+Rows per second of creating resources by batch size: one INSERT per object vs a single bulk transaction.
+
+Usage:
+    DB_HOST=127.0.0.1 python benchmarks/bulk_create.py --batch-sizes 1 10 100 1000 10000 100000
+"""
+
+import argparse
+import itertools
+import json
+import time
+
+from common import BENCH_PREFIX, drop_seeded, get_bench_adapter, seed_resources
+
+from db.models import Resource
+
+_batch_ids = itertools.count()
+
+
+def make_resources(type_id: int, batch_size: int) -> list:
+    batch_id = next(_batch_ids)
+    return [
+        Resource(name=f"{BENCH_PREFIX}{type_id}-{batch_id}-{i}", resource_type_id=type_id, current_speed=i % 100)
+        for i in range(batch_size)
+    ]
+
+
+def rows_per_second(func, rows: int) -> float:
+    started = time.perf_counter()
+    func()
+    return round(rows / (time.perf_counter() - started), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument(
+        "--max-single", type=int, default=10000, help="skip one INSERT per object for larger batches, it is slow"
+    )
+    args = parser.parse_args()
+
+    adapter = get_bench_adapter()
+    try:
+        type_id = seed_resources(adapter.db, 0)
+        for batch_size in args.batch_sizes:
+            result = {"batch_size": batch_size}
+
+            if batch_size <= args.max_single:
+                objs = make_resources(type_id, batch_size)
+                result["single_rows_per_s"] = rows_per_second(
+                    lambda: [adapter.create(obj, "resource") for obj in objs], batch_size
+                )
+
+            objs = make_resources(type_id, batch_size)
+            result["bulk_rows_per_s"] = rows_per_second(lambda: adapter.create_many(objs, "resource"), batch_size)
+            print(json.dumps(result))
+    finally:
+        drop_seeded(adapter.db)
+
+
+if __name__ == "__main__":
+    main()
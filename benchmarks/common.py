@@ -0,0 +1,127 @@
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from db.db_access import DatabaseAccess  # noqa: E402
+from db.db_adapter import DBAdapter  # noqa: E402
+from db.models import ResourceWithType  # noqa: E402
+
+BENCH_PREFIX = "bench-"
+
+
+def get_db() -> DatabaseAccess:
+    """
+    Return access to the database benchmarks run against, `DB_HOST` is used as is.
+    """
+
+    return DatabaseAccess(
+        db_name=Config.DB_NAME,
+        username=Config.DB_USERNAME,
+        password=Config.DB_PASSWORD,
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        pool_min_size=1,
+        pool_max_size=Config.DB_POOL_MAX_SIZE,
+    )
+
+
+def get_bench_adapter() -> DBAdapter:
+    adapter = DBAdapter(db=get_db())
+    adapter.init_tables()
+    return adapter
+
+
+def seed_resources(db: DatabaseAccess, rows: int, max_speed: int = 50) -> int:
+    """
+    Insert a benchmark resource type with `rows` resources.
+
+    :return: resource type id
+    """
+
+    from psycopg2.extras import execute_values
+
+    with db.connect() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO resource_type (name, max_speed) VALUES (%s, %s) RETURNING id;",
+            (f"{BENCH_PREFIX}{time.time_ns()}", max_speed),
+        )
+        type_id = cur.fetchone()[0]
+        execute_values(
+            cur,
+            "INSERT INTO resource (name, resource_type_id, current_speed) VALUES %s;",
+            ((f"{BENCH_PREFIX}{type_id}-{i}", type_id, i % (max_speed * 2)) for i in range(rows)),
+            page_size=10000,
+        )
+        conn.commit()
+        cur.close()
+    return type_id
+
+
+def make_resources(rows: int) -> list:
+    """
+    Return resources as retrieved with their types, built in memory.
+    """
+
+    created_at = datetime.datetime(2023, 10, 5)
+    return [
+        ResourceWithType(
+            id=i,
+            name=f"resource-{i}",
+            resource_type_id=i % 5 + 1,
+            current_speed=i % 100,
+            created_at=created_at + datetime.timedelta(seconds=i),
+            resource_type_name=f"type-{i % 5 + 1}",
+            max_speed=50,
+            speed_exceeding=max(i % 100 * 100 // 50 - 100, 0),
+        )
+        for i in range(1, rows + 1)
+    ]
+
+
+def drop_seeded(db: DatabaseAccess) -> None:
+    # resources are removed by ON DELETE CASCADE
+    with db.connect() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM resource_type WHERE name LIKE %s;", (f"{BENCH_PREFIX}%",))
+        conn.commit()
+        cur.close()
+
+
+def measure(func, repeat: int = 5) -> dict:
+    """
+    Call `func` `repeat` times.
+
+    :return: timings in milliseconds
+    """
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+
+def cpu_ms(func, repeat: int) -> tuple:
+    """
+    Call `func` `repeat` times.
+
+    :return: min CPU time of a call in milliseconds, and its result
+    """
+
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        result = func()
+        timings.append((time.process_time() - started) * 1000)
+    return round(min(timings), 3), result
@@ -0,0 +1,95 @@
+"""
+Throughput of PooledHTTPServer by number of workers, with a handler that simulates a slow db query.
+
+Usage:
+    python benchmarks/concurrency.py --workers 1 2 4 8 16 --clients 32 --delay 0.02
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import PooledHTTPServer  # noqa: E402
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    delay = 0.02
+
+    def do_GET(self):
+        time.sleep(self.delay)  # waiting for db releases GIL just like a real query
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_clients(port: int, clients: int, duration: float) -> int:
+    done = []
+    deadline = time.monotonic() + duration
+
+    def client():
+        requests = 0
+        while time.monotonic() < deadline:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            conn.request("GET", "/resources")
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status == 200:
+                requests += 1
+        done.append(requests)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds spent by handler per request")
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+
+    SlowHandler.delay = args.delay
+    for workers in args.workers:
+        server = PooledHTTPServer(("127.0.0.1", 0), SlowHandler, workers=workers, queue_size=args.clients * 2)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        requests = run_clients(server.server_address[1], args.clients, args.duration)
+
+        server.shutdown()
+        server.drain(5)
+        server.server_close()
+        print(
+            json.dumps(
+                {
+                    "workers": workers,
+                    "clients": args.clients,
+                    "requests": requests,
+                    "rps": round(requests / args.duration, 1),
+                    "ideal_rps": round(min(workers, args.clients) / args.delay, 1),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Bytes on the wire and CPU per request of /resources responses by gzip level, for whole and streamed bodies.
+
+Rows are generated in memory, no database is needed.
+
+Usage:
+    python benchmarks/gzip_responses.py --rows 100 10000 --levels 1 3 6 9
+"""
+
+import argparse
+import gzip
+import json
+
+from common import cpu_ms, make_resources
+
+from response_compression import gzip_stream
+from views import ResourceView
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 3, 6, 9])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        objs = make_resources(rows)
+        serialize_ms, body = cpu_ms(lambda: ResourceView(objs).serialize(), args.repeat)
+        print(json.dumps({"rows": rows, "level": None, "bytes": len(body), "serialize_cpu_ms": serialize_ms}))
+
+        for level in args.levels:
+            whole_ms, compressed = cpu_ms(lambda: gzip.compress(body, compresslevel=level, mtime=0), args.repeat)
+            streamed_ms, streamed = cpu_ms(
+                lambda: b"".join(gzip_stream(ResourceView(objs).stream("json"), level)), args.repeat
+            )
+            result = {
+                "rows": rows,
+                "level": level,
+                "bytes": len(compressed),
+                "ratio": round(len(body) / len(compressed), 2),
+                "gzip_cpu_ms": whole_ms,
+                "streamed_bytes": len(streamed),
+                "streamed_cpu_ms": streamed_ms,  # serialization included
+            }
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Cost of metrics collection: time per observation, per request as instrumented, and of rendering /metrics.
+
+No database is needed.
+
+Usage:
+    python benchmarks/instrumentation.py --observations 200000 --threads 1 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+QUERY = "\n                SELECT\n                  resource.id"
+
+
+def observe_request() -> None:
+    # what a GET with two queries records
+    metrics.start_request()
+    metrics.observe_acquire(0.0001)
+    metrics.observe_query(QUERY, 0.0008)
+    metrics.observe_acquire(0.0001)
+    metrics.observe_query(QUERY, 0.0012)
+    metrics.observe_phase("/resources", "query", metrics.request_query_seconds())
+    metrics.observe_phase("/resources", "serialize", 0.0004)
+    metrics.observe_phase("/resources", "compress", 0.0002)
+    metrics.observe_phase("/resources", "write", 0.0001)
+    metrics.observe_request("/resources", "GET", 200, 0.003)
+
+
+def run(threads: int, requests: int) -> float:
+    # wall seconds for every thread to record `requests` requests
+    def work():
+        for _ in range(requests):
+            observe_request()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--observations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for _ in range(args.observations):
+        metrics.observe_request("/resources", "GET", 200, 0.003)
+    observation_ns = (time.perf_counter() - started) / args.observations * 1e9
+    print(json.dumps({"case": "observation", "ns": round(observation_ns)}))
+
+    requests = args.observations // 10
+    for threads in args.threads:
+        seconds = run(threads, requests)
+        print(json.dumps({"case": "request", "threads": threads, "us": round(seconds / requests / threads * 1e6, 2)}))
+
+    started = time.perf_counter()
+    body = metrics.render()
+    render_ms = (time.perf_counter() - started) * 1000
+    print(json.dumps({"case": "render", "bytes": len(body), "ms": round(render_ms, 3)}))
+
+
+if __name__ == "__main__":
+    main()
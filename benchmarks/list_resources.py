@@ -0,0 +1,62 @@
+"""
+Latency of listing resources by row count: per-row resource_type lookups vs a single joined query.
+
+Usage:
+    DB_HOST=127.0.0.1 python benchmarks/list_resources.py --rows 10 100 1000 10000
+"""
+
+import argparse
+import dataclasses
+import json
+
+from common import drop_seeded, get_bench_adapter, measure, seed_resources
+
+from db.models import Resource, ResourceType
+from views import ResourceView
+
+
+def list_per_row(adapter, type_id: int) -> str:
+    # serialization as it was done before: one resource_type query per resource
+    resources = adapter.retrieve(Resource, "resource", None, {"type_id": (type_id,)})
+    json_list = []
+    for obj in resources:
+        data = dataclasses.asdict(obj)
+        res_type = adapter.retrieve(ResourceType, "resource_type", obj.resource_type_id, None)[0]
+        max_speed = res_type.max_speed
+        data["speed_exceeding"] = int((obj.current_speed / max_speed - 1) * 100) if obj.current_speed > max_speed else 0
+        data.pop("resource_type_id")
+        data["resource_type"] = res_type.name
+        json_list.append(data)
+    return json.dumps(json_list, default=str)
+
+
+def list_joined(adapter, type_id: int) -> str:
+    resources = adapter.retrieve_resources(None, {"type_id": (type_id,)})
+    return ResourceView(resources).serialize()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    adapter = get_bench_adapter()
+    results = []
+    try:
+        for rows in args.rows:
+            type_id = seed_resources(adapter.db, rows)
+            results.append(
+                {
+                    "rows": rows,
+                    "per_row": measure(lambda: list_per_row(adapter, type_id), args.repeat),
+                    "joined": measure(lambda: list_joined(adapter, type_id), args.repeat),
+                }
+            )
+            print(json.dumps(results[-1]))
+    finally:
+        drop_seeded(adapter.db)
+
+
+if __name__ == "__main__":
+    main()
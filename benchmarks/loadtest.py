@@ -0,0 +1,479 @@
+"""
+Load test of the whole service: a throwaway database is created and seeded, the server is started against it,
+and clients send a mixed GET, POST, PATCH and DELETE workload at fixed concurrency.
+
+Throughput, errors and p50/p95/p99 latency are reported per endpoint as a json document. Given a baseline saved
+by an earlier run, endpoints that got slower or lost throughput beyond the tolerance are reported and the exit
+code is 1.
+
+The database is a temporary postgres cluster if `initdb` and `pg_ctl` are found, otherwise a temporary database
+on the server set by DB_* variables; either is removed afterwards. Runs with the same --seed send the same
+requests in the same order per client.
+
+Results go to stdout, progress to stderr.
+
+Usage:
+    python benchmarks/loadtest.py --resources 100000 --concurrency 16 --duration 30 --output results.json
+    python benchmarks/loadtest.py --baseline results.json --tolerance 0.1
+    python benchmarks/loadtest.py --mix get_list=1 --env RESPONSE_CACHE_ENABLED=false
+"""
+
+import argparse
+import contextlib
+import glob
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+from common import BENCH_PREFIX
+
+from config import Config
+from db.db_access import DatabaseAccess
+from db.fixtures import FixtureSpec, load_fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# operation -> endpoint it is reported by
+ENDPOINTS = {
+    "get_list": "GET /resources",
+    "get_one": "GET /resources/{id}",
+    "get_types": "GET /resource_types",
+    "post": "POST /resources",
+    "patch": "PATCH /resources/{id}",
+    "delete": "DELETE /resources",
+}
+DEFAULT_MIX = "get_list=40,get_one=30,get_types=5,post=10,patch=10,delete=5"
+MAX_SPEED = FixtureSpec.max_max_speed
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def find_postgres_binary(name: str) -> str | None:
+    if path := shutil.which(name):
+        return path
+    found = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))  # debian keeps server binaries out of PATH
+    return found[-1] if found else None
+
+
+@contextlib.contextmanager
+def temp_cluster(work_dir: str):
+    """
+    Run a postgres cluster in `work_dir` for the duration of the block.
+
+    :return: DB_* variables to reach it
+    """
+
+    data_dir = os.path.join(work_dir, "pgdata")
+    port = free_port()
+    subprocess.run(
+        [find_postgres_binary("initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    pg_ctl = find_postgres_binary("pg_ctl")
+    options = f"-p {port} -k {work_dir} -c listen_addresses=127.0.0.1"
+    log = os.path.join(work_dir, "postgres.log")
+    subprocess.run(
+        [pg_ctl, "-D", data_dir, "-l", log, "-o", options, "-w", "start"], check=True, stdout=subprocess.DEVNULL
+    )
+    try:
+        yield {"DB_HOST": "127.0.0.1", "DB_PORT": str(port), "DB_NAME": "postgres", "DB_USERNAME": "postgres"}
+    finally:
+        subprocess.run([pg_ctl, "-D", data_dir, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+
+
+@contextlib.contextmanager
+def temp_database():
+    """
+    Create a database on the server set by DB_* variables for the duration of the block.
+
+    :return: DB_* variables to reach it
+    """
+
+    name = f"bench_{os.getpid()}_{int(time.time())}"
+    params = dict(user=Config.DB_USERNAME, password=Config.DB_PASSWORD, host=Config.DB_HOST, port=Config.DB_PORT)
+    connection = psycopg2.connect(dbname="postgres", **params)
+    connection.autocommit = True  # CREATE DATABASE can't run in a transaction
+    try:
+        connection.cursor().execute(f"CREATE DATABASE {name};")
+        try:
+            yield {"DB_NAME": name}
+        finally:
+            # FORCE ends sessions left behind; a failed cleanup must not hide an error of the block
+            try:
+                connection.cursor().execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE);")
+            except psycopg2.Error as e:
+                print(f"WARNING: can't drop database {name}: {e}".strip(), file=sys.stderr)
+    finally:
+        connection.close()
+
+
+def seed(db_env: dict, spec: FixtureSpec) -> dict:
+    """
+    Load generated resource types and resources, see `db.fixtures`.
+
+    :return: ids of seeded resource types and resources
+    """
+
+    env = {**os.environ, **db_env}
+    db = DatabaseAccess(
+        db_name=env.get("DB_NAME", Config.DB_NAME),
+        username=env.get("DB_USERNAME", Config.DB_USERNAME),
+        password=env.get("DB_PASSWORD", Config.DB_PASSWORD),
+        host=env.get("DB_HOST", Config.DB_HOST),
+        port=env.get("DB_PORT", Config.DB_PORT),
+    )
+    try:
+        load_fixtures(db, spec)
+
+        with db.connect() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM resource_type WHERE name LIKE %s ORDER BY id;", (f"{spec.prefix}%",))
+            type_ids = [row[0] for row in cur.fetchall()]
+            # resources are copied in a single statement, their ids are consecutive
+            cur.execute("SELECT min(id), max(id) FROM resource WHERE name LIKE %s;", (f"{spec.prefix}%",))
+            first_id, last_id = cur.fetchone()
+            cur.close()
+    finally:
+        db.pool.closeall()  # idle connections of the process-wide pool would keep the database from being dropped
+    return {"type_ids": type_ids, "resource_ids": range(first_id, last_id + 1)}
+
+
+@contextlib.contextmanager
+def run_server(server: str, db_env: dict, extra_env: dict, log_path: str):
+    """
+    Start the service in a subprocess and wait until it answers.
+
+    :param server: 'threaded' for main.py, 'asgi' for uvicorn
+    :return: port the service listens on
+    """
+
+    port = free_port()
+    env = {**os.environ, **db_env, "HTTP_HOST": "127.0.0.1", "HTTP_PORT": str(port), **extra_env}
+    if server == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)]
+    else:
+        command = [sys.executable, "main.py"]
+
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.monotonic() + 60
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"server exited with code {process.returncode}, see {log_path}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"server didn't start in time, see {log_path}")
+                try:
+                    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                    connection.request("GET", "/stats")
+                    if connection.getresponse().status == 200:
+                        break
+                except OSError:
+                    pass
+                finally:
+                    connection.close()
+                time.sleep(0.2)
+            yield port
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class Client:
+    """
+    Sends requests of the mix over a persistent connection and records latencies by endpoint.
+    """
+
+    def __init__(self, port: int, mix: dict, seeded: dict, rng: random.Random, prefix: str):
+        self.port = port
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.seeded = seeded
+        self.rng = rng
+        self.prefix = prefix  # names of created resources are unique per client
+        self.created = []  # ids this client may delete, so that clients don't delete each other's resources
+        self.counter = 0
+        self.connection: http.client.HTTPConnection | None = None
+
+        self.latencies = defaultdict(list)  # endpoint -> seconds
+        self.errors = defaultdict(int)  # endpoint -> failed requests
+
+    def next_request(self) -> tuple:
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        if operation == "delete" and not self.created:
+            operation = "post"  # nothing to delete yet
+
+        resource_id = self.rng.choice(self.seeded["resource_ids"])
+        type_id = self.rng.choice(self.seeded["type_ids"])
+        if operation == "get_list":
+            return operation, "GET", f"/resources?type={type_id}&limit=100", None
+        if operation == "get_one":
+            return operation, "GET", f"/resources/{resource_id}", None
+        if operation == "get_types":
+            return operation, "GET", "/resource_types", None
+        if operation == "patch":
+            body = {"current_speed": self.rng.randint(0, MAX_SPEED * 2)}
+            return operation, "PATCH", f"/resources/{resource_id}", body
+        if operation == "delete":
+            return operation, "DELETE", f"/resources?id={self.created.pop()}", None
+
+        self.counter += 1
+        body = {"name": f"{self.prefix}-{self.counter}", "resource_type_id": type_id, "current_speed": 0}
+        return operation, "POST", "/resources", body
+
+    def send(self, method: str, path: str, body: dict | None) -> tuple:
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if data else {}
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None, b""
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        return response.status, payload
+
+    def run(self, measure_from: float, deadline: float) -> None:
+        while (started := time.perf_counter()) < deadline:
+            operation, method, path, body = self.next_request()
+            status, payload = self.send(method, path, body)
+            latency = time.perf_counter() - started
+
+            if operation == "post" and status == 201:
+                self.created.append(json.loads(payload)["id"])
+            if started < measure_from:  # warming up
+                continue
+            endpoint = ENDPOINTS[operation]
+            self.latencies[endpoint].append(latency)
+            if status is None or status >= 400:
+                self.errors[endpoint] += 1
+
+        if self.connection is not None:
+            self.connection.close()
+
+
+def percentile(latencies: list, q: float) -> float:
+    # nearest rank of sorted latencies
+    return latencies[max(math.ceil(q * len(latencies)) - 1, 0)]
+
+
+def summarize(latencies: list, errors: int, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"requests": 0, "errors": errors, "rps": 0.0}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def drive(port: int, args, mix: dict, seeded: dict) -> dict:
+    """
+    Run `args.concurrency` clients for warmup and duration seconds.
+
+    :return: summary by endpoint and in total
+    """
+
+    clients = [
+        Client(port, mix, seeded, random.Random(f"{args.seed}-{index}"), f"{BENCH_PREFIX}c{index}")
+        for index in range(args.concurrency)
+    ]
+    measure_from = time.perf_counter() + args.warmup
+    deadline = measure_from + args.duration
+    threads = [threading.Thread(target=client.run, args=(measure_from, deadline)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for client in clients:
+        for endpoint, values in client.latencies.items():
+            latencies[endpoint].extend(values)
+            errors[endpoint] += client.errors[endpoint]
+
+    endpoints = {
+        endpoint: summarize(latencies[endpoint], errors[endpoint], args.duration)
+        for endpoint in ENDPOINTS.values()
+        if endpoint in latencies
+    }
+    every = [value for values in latencies.values() for value in values]
+    total = summarize(every, sum(errors.values()), args.duration)
+    return {"total": total, "endpoints": endpoints}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Find endpoints slower or with lower throughput than in the baseline by more than `tolerance`.
+
+    :param tolerance: allowed relative change, e.g. 0.1 for 10%
+    :return: regressions
+    """
+
+    regressions = []
+    current = {"total": results["total"], **results["endpoints"]}
+    previous = {"total": baseline["total"], **baseline["endpoints"]}
+    for endpoint, stats in current.items():
+        base = previous.get(endpoint)
+        if not base or not base.get("requests") or not stats.get("requests"):
+            continue
+
+        # metric, current value, baseline value, regressed
+        checks = [
+            (key, stats[key], base[key], stats[key] > base[key] * (1 + tolerance))
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        ]
+        checks.append(("rps", stats["rps"], base["rps"], stats["rps"] < base["rps"] * (1 - tolerance)))
+        error_rate = round(stats["errors"] / stats["requests"], 4)
+        base_error_rate = round(base["errors"] / base["requests"], 4)
+        checks.append(("error_rate", error_rate, base_error_rate, error_rate > base_error_rate + 0.001))
+
+        for metric, value, base_value, regressed in checks:
+            if regressed:
+                change = round(value / base_value - 1, 4) if base_value else None
+                regressions.append(
+                    {"endpoint": endpoint, "metric": metric, "baseline": base_value, "current": value, "change": change}
+                )
+    return regressions
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(raw: str) -> dict:
+    mix = {}
+    for item in raw.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation}, awaiting one of: {', '.join(ENDPOINTS)}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", type=int, default=100)
+    parser.add_argument("--resources", type=int, default=100000)
+    parser.add_argument("--fleet-skew", type=float, default=FixtureSpec.fleet_skew)
+    parser.add_argument("--speeding-share", type=float, default=FixtureSpec.speeding_share)
+    parser.add_argument("--concurrency", type=int, default=16, help="clients, each waits for its response")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"default: {DEFAULT_MIX}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server", choices=("threaded", "asgi"), default="threaded")
+    parser.add_argument("--database", choices=("auto", "cluster", "database"), default="auto")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for the server, e.g. HTTP_WORKERS=8")
+    parser.add_argument("--server-log", help="file to save server output to, kept only on failure by default")
+    parser.add_argument("--output", help="file to save results to, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    database = args.database
+    if database == "auto":
+        database = "cluster" if find_postgres_binary("initdb") and find_postgres_binary("pg_ctl") else "database"
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as work_dir:
+        with temp_cluster(work_dir) if database == "cluster" else temp_database() as db_env:
+            log_path = args.server_log or os.path.join(tempfile.gettempdir(), f"loadtest-server-{os.getpid()}.log")
+            with run_server(args.server, db_env, extra_env, log_path) as port:
+                started = time.perf_counter()
+                spec = FixtureSpec(
+                    types=args.types,
+                    resources=args.resources,
+                    fleet_skew=args.fleet_skew,
+                    speeding_share=args.speeding_share,
+                    seed=args.seed,
+                    prefix=BENCH_PREFIX,
+                )
+                seeded = seed(db_env, spec)
+                seed_seconds = time.perf_counter() - started
+                seeded_info = f"{args.types} types and {args.resources} resources in {seed_seconds:.1f} s"
+                print(f"INFO: seeded {seeded_info}", file=sys.stderr)
+
+                result = drive(port, args, args.mix, seeded)
+            if not args.server_log:
+                os.remove(log_path)
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "server": args.server,
+            "database": database,
+            "types": args.types,
+            "resources": args.resources,
+            "fleet_skew": args.fleet_skew,
+            "speeding_share": args.speeding_share,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": args.mix,
+            "seed": args.seed,
+            "env": extra_env,
+        },
+        **result,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["meta"]["mix"] != results["meta"]["mix"]:
+            print("WARNING: baseline was run with another mix, results are hardly comparable", file=sys.stderr)
+        results["baseline"] = {"revision": baseline["meta"]["revision"], "tolerance": args.tolerance}
+        results["regressions"] = compare(results, baseline, args.tolerance)
+        exit_code = 1 if results["regressions"] else 0
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Throughput of prefork mode by number of worker processes, on the CPU-bound part of GET /resources.
+
+Every worker serializes in-memory resources with ResourceView, no database is needed. Clients run in their own
+processes over keep-alive connections, so that they don't share the GIL with each other. Throughput can only scale
+up to the number of cores, clients included: compare `cores` in the output.
+
+Usage:
+    python benchmarks/prefork.py --workers 1 2 4 8 --rows 100 --client-processes 8 --connections 2 --duration 5
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from http.server import BaseHTTPRequestHandler
+
+from common import make_resources
+
+import views
+from prefork import Supervisor, WorkerContext
+from server import PooledHTTPServer, serve
+
+READY_TIMEOUT = 30
+
+
+class ResourcesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    resources: list = []
+
+    def do_GET(self):
+        body = views.ResourceView(self.resources).serialize()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Worker-Pid", str(os.getpid()))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_supervisor(port: int, workers: int, threads: int) -> None:
+    def target(context: WorkerContext) -> None:
+        server = PooledHTTPServer(("127.0.0.1", port), ResourcesHandler, workers=threads, reuse_port=True)
+        context.notify_ready()
+        serve(server, shutdown_timeout=5)
+
+    with contextlib.redirect_stdout(sys.stderr):  # logs of the supervisor and workers, results go to stdout
+        Supervisor(target, workers, stop_timeout=5).run()
+
+
+def wait_ready(port: int, workers: int) -> None:
+    # new connections are spread by a hash of their addresses, every worker answers some of them sooner or later
+    pids = set()
+    deadline = time.monotonic() + READY_TIMEOUT
+    while len(pids) < workers:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"only {len(pids)} of {workers} workers answered in {READY_TIMEOUT} s")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/resources")
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            pids.add(response.getheader("X-Worker-Pid"))
+        except OSError:
+            time.sleep(0.05)
+
+
+def run_client(port: int, connections: int, duration: float, results) -> None:
+    # one process, `connections` keep-alive connections driven in turn
+    conns = [http.client.HTTPConnection("127.0.0.1", port, timeout=10) for _ in range(connections)]
+    requests = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for conn in conns:
+            try:
+                conn.request("GET", "/resources")
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    requests += 1
+                else:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+    for conn in conns:
+        conn.close()
+    results.put((requests, errors))
+
+
+def measure(port: int, processes: int, connections: int, duration: float) -> tuple:
+    results = multiprocessing.Queue()
+    clients = [
+        multiprocessing.Process(target=run_client, args=(port, connections, duration, results))
+        for _ in range(processes)
+    ]
+    for client in clients:
+        client.start()
+    counts = [results.get() for _ in clients]
+    for client in clients:
+        client.join()
+    return sum(requests for requests, _ in counts), sum(errors for _, errors in counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    # a keep-alive connection holds a thread, so clients never wait for one: processes * connections <= threads
+    parser.add_argument("--threads", type=int, default=16, help="threads per worker process")
+    parser.add_argument("--rows", type=int, default=100, help="resources per response")
+    parser.add_argument("--client-processes", type=int, default=8)
+    parser.add_argument("--connections", type=int, default=2, help="per client process")
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    ResourcesHandler.resources = make_resources(args.rows)
+    base_rps = None
+    for workers in args.workers:
+        port = free_port()
+        supervisor = multiprocessing.Process(target=run_supervisor, args=(port, workers, args.threads))
+        supervisor.start()
+        try:
+            wait_ready(port, workers)
+            requests, errors = measure(port, args.client_processes, args.connections, args.duration)
+        finally:
+            supervisor.terminate()  # SIGTERM, workers drain and stop
+            supervisor.join()
+
+        rps = requests / args.duration
+        base_rps = base_rps or rps / workers
+        print(
+            json.dumps(
+                {
+                    "workers": workers,
+                    "cores": os.cpu_count(),
+                    "rows": args.rows,
+                    "requests": requests,
+                    "errors": errors,
+                    "rps": round(rps, 1),
+                    "speedup": round(rps / base_rps, 2),
+                    "efficiency": round(rps / base_rps / workers, 2),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
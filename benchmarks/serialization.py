@@ -0,0 +1,66 @@
+"""
+CPU time of serializing /resources responses by row count: the former asdict path against both json backends.
+
+Rows are generated in memory, no database is needed. orjson is skipped if it is not installed.
+
+Usage:
+    python benchmarks/serialization.py --rows 1 1000 100000
+"""
+
+import argparse
+import dataclasses
+import json
+
+from common import cpu_ms, make_resources
+
+import json_backend
+import views
+
+
+def legacy_serialize(objs: list) -> bytes:
+    # the path before views built dicts themselves
+    json_list = []
+    for obj in objs:
+        data = dataclasses.asdict(obj)
+        data["created_at"] = obj.created_at.isoformat()
+        type_name = data.pop("resource_type_name")
+        data.pop("max_speed")
+        data.pop("resource_type_id")
+        data["speed_exceeding"] = data.pop("speed_exceeding") or 0
+        data["resource_type"] = type_name
+        json_list.append(data)
+    return json.dumps(json_list[0] if len(json_list) == 1 else json_list).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = {"json": json_backend._dumps_json}
+    if json_backend.orjson is not None:
+        backends["orjson"] = json_backend._dumps_orjson
+
+    for rows in args.rows:
+        objs = make_resources(rows)
+        legacy_ms, body = cpu_ms(lambda: legacy_serialize(objs), args.repeat)
+        print(json.dumps({"rows": rows, "path": "asdict", "bytes": len(body), "serialize_cpu_ms": legacy_ms}))
+
+        for name, dumps in backends.items():
+            views.dumps = dumps
+            serialize_ms, body = cpu_ms(lambda: views.ResourceView(objs).serialize(), args.repeat)
+            stream_ms, _ = cpu_ms(lambda: b"".join(views.ResourceView(objs).stream("json")), args.repeat)
+            result = {
+                "rows": rows,
+                "path": name,
+                "bytes": len(body),
+                "serialize_cpu_ms": serialize_ms,
+                "stream_cpu_ms": stream_ms,
+                "speedup": round(legacy_ms / serialize_ms, 2) if serialize_ms else None,
+            }
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 import dotenv
 
@@ -11,3 +12,80 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD", default="postgres")
     DB_HOST = os.getenv("DB_HOST", default="localhost")
     DB_PORT = os.getenv("DB_PORT", default=5432)
+
+    # http server
+    HTTP_HOST = os.getenv("HTTP_HOST", default="0.0.0.0")
+    HTTP_PORT = int(os.getenv("HTTP_PORT", default=8000))
+    HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", default=16))  # threads handling connections
+    HTTP_QUEUE_SIZE = int(os.getenv("HTTP_QUEUE_SIZE", default=64))  # accepted connections waiting for a worker
+    HTTP_BACKLOG = int(os.getenv("HTTP_BACKLOG", default=128))  # listen() backlog
+    HTTP_SHUTDOWN_TIMEOUT = float(os.getenv("HTTP_SHUTDOWN_TIMEOUT", default=30))  # seconds to drain requests
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", default=5))  # idle connection timeout, seconds
+    HTTP_KEEPALIVE_MAX_REQUESTS = int(os.getenv("HTTP_KEEPALIVE_MAX_REQUESTS", default=100))  # per connection
+
+    # prefork: processes sharing the port with SO_REUSEPORT, each with own threads and db pool; 0 for a single one
+    PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", default=0))
+    PREFORK_READY_TIMEOUT = float(os.getenv("PREFORK_READY_TIMEOUT", default=60))  # seconds for a worker to start
+    PREFORK_RESTART_DELAY = float(os.getenv("PREFORK_RESTART_DELAY", default=1))  # doubled for crash loops
+
+    # connection pool, by default every http worker can hold a connection
+    DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", default=1))
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", default=HTTP_WORKERS))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", default=5))  # seconds to wait for a free connection
+    DB_POOL_VALIDATE_IDLE = float(os.getenv("DB_POOL_VALIDATE_IDLE", default=30))  # ping if idle longer, 0 always
+    DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", default=3600))  # recycle older, seconds
+
+    # caching
+    # seconds writes of other processes may go unnoticed; prefork workers check on every read, so that a client
+    # reading after its own write never gets the old data from another worker
+    TABLE_VERSION_CHECK_INTERVAL = float(
+        os.getenv("TABLE_VERSION_CHECK_INTERVAL", default=0 if PREFORK_WORKERS > 1 else 1)
+    )
+    RESOURCE_TYPE_CACHE_TTL = float(os.getenv("RESOURCE_TYPE_CACHE_TTL", default=60))  # seconds
+
+    # pagination
+    PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", default=0)) or None  # rows per page, 0 for all rows
+    PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", default=10000))
+
+    # streaming
+    STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", default=2000))  # rows fetched from db at once
+    STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", default=64 * 1024))  # bytes per written chunk
+
+    # bulk operations
+    BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", default=100000))  # objects per request
+    BULK_UPDATE_MAX_ITEMS = int(os.getenv("BULK_UPDATE_MAX_ITEMS", default=10000))  # patches per request, one statement
+    BULK_PAGE_SIZE = int(os.getenv("BULK_PAGE_SIZE", default=1000))  # rows per INSERT statement
+
+    # write-behind of current_speed from bulk updates, off by default
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", default="false").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_MAX_SIZE = int(os.getenv("WRITE_BEHIND_MAX_SIZE", default=10000))  # buffered resources to flush
+    WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", default=1))  # max seconds before a flush
+
+    # server-sent events of resource changes, written by one thread or the event loop, not a worker per subscriber
+    SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", default=1000))  # each takes a socket and its queue
+    SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", default=1000))  # undelivered events to drop a slow client
+    SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", default=1000))  # recent events kept for resuming clients
+    SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", default=15))  # seconds between comments
+
+    # serialized GET responses, served while table versions are unchanged
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", default="true").lower() in ("1", "true", "yes")
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", default=32 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", default=60))  # seconds
+
+    # gzip for clients sending 'Accept-Encoding: gzip'
+    COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", default="true").lower() in ("1", "true", "yes")
+    COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", default=6))  # 1 (fastest) - 9 (smallest)
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", default=1024))  # smaller bodies are sent as is
+
+    # 'auto' uses orjson if it is installed, 'json' forces the standard library
+    JSON_BACKEND = os.getenv("JSON_BACKEND", default="auto").lower()
+
+    # latency histograms and query counters on GET /metrics, cheap enough to stay on
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", default="true").lower() in ("1", "true", "yes")
+    METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", default=1))  # seconds, prefork workers
+
+    # diagnostics, off by default
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", default=0))  # log statements slower than that, 0 for none
+    SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", default="false").lower() in ("1", "true", "yes")
+    PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", default="off").lower()  # off, header ('X-Profile: 1') or all
+    PROFILE_DIR = os.getenv("PROFILE_DIR", default=os.path.join(tempfile.gettempdir(), "profiles"))  # cProfile dumps
@@ -1,12 +1,16 @@
 import http
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterator, List, Tuple
 
 import exceptions
-from db.db_adapter import DBAdapter
+from config import Config
+from db.db_adapter import get_adapter
 from db.models import Resource, ResourceType
+from db.pagination import Page, parse_page
 from exceptions import HTTPException
 
+STREAM_FORMATS = ("json", "ndjson")
+
 
 class BaseDBController(ABC):
     def __init__(
@@ -18,11 +22,135 @@ class BaseDBController(ABC):
         self.url = url
         self.request_json = request_json
         self.url_params = url_params
+        self.page: Page | None = None  # set by retrieve for lists
+        self.stream_format: str | None = None  # set by retrieve for streamed lists
+        self.errors: List[dict] | None = None  # per item errors, set by bulk operations
 
     @abstractmethod
     def create(self):
         pass
 
+    @abstractmethod
+    def validate(self, item: dict):
+        pass
+
+    def create_many(self, table_name: str) -> List:
+        """
+        Validate and create every object of request json array in a single transaction.
+
+        Invalid and already existing objects are skipped and reported in 'errors' by their index.
+
+        :param table_name:
+        :return: created objects
+        """
+
+        items = self.request_json
+        if len(items) > Config.BULK_MAX_ITEMS:
+            raise exceptions.BadRequest(detail=f"too many objects, up to {Config.BULK_MAX_ITEMS} allowed")
+
+        self.errors = []
+        objs = []
+        indexes = []
+        names = set()
+        for index, item in enumerate(items):
+            try:
+                obj = self.validate(item)
+                if obj.name in names:
+                    raise exceptions.BadRequest(detail=f"name {obj.name} is repeated in request")
+            except exceptions.HTTPException as e:
+                self.errors.append({"index": index, "detail": e.detail})
+                continue
+            names.add(obj.name)
+            objs.append(obj)
+            indexes.append(index)
+
+        adapter = get_adapter()
+        inserted = adapter.create_many(objs, table_name) if objs else []
+
+        created = []
+        for index, obj in zip(indexes, inserted):
+            if obj is not None:
+                created.append(obj)
+            else:
+                self.errors.append({"index": index, "detail": f"object already exists"})
+        self.errors.sort(key=lambda error: error["index"])
+
+        return created
+
+    @staticmethod
+    def require_int(item: dict, attribute: str) -> int:
+        # bool is int for python, but not for the api
+        if (value := item.get(attribute)) is None:
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, f"you have to specify {attribute}")
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, f"{attribute} has to be int")
+        return value
+
+    def validate_patch(self, item: dict) -> dict:
+        """
+        Check a patch of bulk update against 'patch_attributes' of the controller.
+
+        :param item: 'id' and attributes to change
+        :return: patch without unknown and unset attributes
+        """
+
+        if not isinstance(item, dict):
+            raise exceptions.BadRequest(detail="patch has to be json object")
+
+        obj_id = item.get("id")
+        if not isinstance(obj_id, int) or isinstance(obj_id, bool) or obj_id < 1:
+            raise exceptions.BadRequest(detail="you have to specify id as positive int")
+
+        patch = {"id": obj_id}
+        for attribute, attribute_type in self.patch_attributes.items():
+            if (value := item.get(attribute)) is None:
+                continue
+            if not isinstance(value, attribute_type) or isinstance(value, bool):
+                raise exceptions.BadRequest(detail=f"{attribute} has to be {attribute_type.__name__}")
+            patch[attribute] = value
+
+        if len(patch) == 1:
+            raise exceptions.BadRequest(detail="at least one attribute to change have to be specified")
+        return patch
+
+    def update_many(self, table_name: str) -> dict:
+        """
+        Validate patches of request json array and apply them in a single statement.
+
+        Invalid patches are skipped and reported in 'errors' by their index.
+
+        :param table_name:
+        :return: updated ids, buffered ids and ids of objects that don't exist
+        """
+
+        items = self.request_json
+        if len(items) > Config.BULK_UPDATE_MAX_ITEMS:
+            raise exceptions.BadRequest(detail=f"too many patches, up to {Config.BULK_UPDATE_MAX_ITEMS} allowed")
+
+        self.errors = []
+        patches = []
+        ids = set()
+        for index, item in enumerate(items):
+            try:
+                patch = self.validate_patch(item)
+                if patch["id"] in ids:
+                    raise exceptions.BadRequest(detail=f"id {patch['id']} is repeated in request")
+            except exceptions.HTTPException as e:
+                self.errors.append({"index": index, "detail": e.detail})
+                continue
+            ids.add(patch["id"])
+            patches.append(patch)
+
+        adapter = get_adapter()
+        updated, buffered = adapter.update_many(table_name, patches) if patches else (set(), set())
+
+        return {
+            "updated": [patch["id"] for patch in patches if patch["id"] in updated],
+            # written later by write-behind, existence is not checked
+            "buffered": [patch["id"] for patch in patches if patch["id"] in buffered],
+            "missing": [patch["id"] for patch in patches if patch["id"] not in updated and patch["id"] not in buffered],
+        }
+
     @abstractmethod
     def retrieve(self):
         pass
@@ -38,8 +166,19 @@ class BaseDBController(ABC):
     def url_as_list(self):
         return self.url.path.strip("/").split("/")
 
+    def parse_stream_format(self) -> str | None:
+        # '?stream=json' or '?stream=ndjson' to stream a list instead of building it in memory
+        raw_stream = (self.url_params or {}).get("stream")
+        if not raw_stream:
+            return None
+        if raw_stream[0] not in STREAM_FORMATS:
+            raise exceptions.BadRequest(detail=f"wrong stream url parameter, awaiting one of: json, ndjson")
+        return raw_stream[0]
+
 
 class ResourceTypeController(BaseDBController):
+    patch_attributes = {"name": str, "max_speed": int}  # attributes changed by bulk update
+
     def create(self) -> List[ResourceType] | None:
         url = self.url_as_list()
         if len(url) > 1:
@@ -49,19 +188,29 @@ class ResourceTypeController(BaseDBController):
         if not self.request_json:
             raise HTTPException(http.HTTPStatus.BAD_REQUEST, "request body contains no data")
 
-        if (name := self.request_json.get("name")) is None:
-            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify name")
-        if (max_speed := self.request_json.get("max_speed")) is None:
-            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify max_speed")
+        if isinstance(self.request_json, list):  # bulk creation
+            return self.create_many("resource_type")
 
-        # create ResourceType object and send its data to db adapter
-        resource_type = ResourceType(name=name, max_speed=max_speed)
+        resource_type = self.validate(self.request_json)
 
-        adapter = DBAdapter()
+        adapter = get_adapter()
         result = adapter.create(resource_type, "resource_type")
 
         return [result]
 
+    def validate(self, item: dict) -> ResourceType:
+        if not isinstance(item, dict):
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "object has to be json object")
+
+        if (name := item.get("name")) is None:
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify name")
+        if not isinstance(name, str):
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "name has to be string")
+        max_speed = self.require_int(item, "max_speed")
+
+        # create ResourceType object to send its data to db adapter
+        return ResourceType(name=name, max_speed=max_speed)
+
     def retrieve(self) -> List[ResourceType]:
         url = self.url_as_list()
 
@@ -76,14 +225,22 @@ class ResourceTypeController(BaseDBController):
         # create filtering data
         filtering_data = {}
 
-        adapter = DBAdapter()
-        resource_types = adapter.retrieve(ResourceType, "resource_type", resource_type_id, filtering_data)
+        if resource_type_id is None:
+            self.stream_format = self.parse_stream_format()
+            url_params = self.url_params or {}
+            self.page = parse_page("resource_type", url_params, Config.PAGE_DEFAULT_LIMIT, Config.PAGE_MAX_LIMIT)
+
+        adapter = get_adapter()
+        resource_types = adapter.retrieve(ResourceType, "resource_type", resource_type_id, filtering_data, self.page)
 
         return resource_types
 
-    def update(self) -> List[ResourceType]:
+    def update(self) -> List[ResourceType] | dict:
         url = self.url_as_list()
 
+        if len(url) == 1 and isinstance(self.request_json, list) and self.request_json:  # bulk update
+            return self.update_many("resource_type")
+
         # parse resource_type id
         if len(url) > 1:
             resource_type_id = url[1]
@@ -103,21 +260,15 @@ class ResourceTypeController(BaseDBController):
         if all((name is None, max_speed is None)):
             raise exceptions.BadRequest("at least one attribute to change have to be specified")
 
-        # create filtering data
-        filtering_data = {}
-
-        adapter = DBAdapter()
-
-        # retrieve existing ResourceType object
-        resource_type = adapter.retrieve(ResourceType, "resource_type", resource_type_id, filtering_data)[0]
-
-        # update and send object data to db connection
+        # send changed attributes only
+        changes = {}
         if name is not None:
-            resource_type.name = name
+            changes["name"] = name
         if max_speed is not None:
-            resource_type.max_speed = max_speed
+            changes["max_speed"] = max_speed
 
-        adapter.update(resource_type, "resource_type", resource_type_id)
+        adapter = get_adapter()
+        resource_type = adapter.update(ResourceType, "resource_type", resource_type_id, changes)
 
         return [resource_type]
 
@@ -138,13 +289,16 @@ class ResourceTypeController(BaseDBController):
         except ValueError:
             raise exceptions.BadRequest(detail=f"wrong id parameters, awaiting ints")
 
-        adapter = DBAdapter()
+        adapter = get_adapter()
 
         adapter.delete("resource_type", resource_type_ids)
         return
 
 
 class ResourceController(BaseDBController):
+    resource_type_ids: set | None = None  # existing resource types, for bulk creation
+    patch_attributes = {"name": str, "resource_type_id": int, "current_speed": int}  # attributes changed by bulk update
+
     def create(self) -> List[Resource] | None:
         url = self.url_as_list()
         if len(url) > 1:
@@ -154,22 +308,60 @@ class ResourceController(BaseDBController):
         if not self.request_json:
             raise HTTPException(http.HTTPStatus.BAD_REQUEST, "request body contains no data")
 
-        if (name := self.request_json.get("name")) is None:
-            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify name")
-        if (resource_type_id := self.request_json.get("resource_type_id")) is None:
-            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify resource_type_id")
-        if (current_speed := self.request_json.get("current_speed")) is None:
-            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify current_speed")
+        if isinstance(self.request_json, list):  # bulk creation
+            self.load_resource_type_ids()
+            return self.create_many("resource")
 
-        # create Resource object and send its data to db adapter
-        resource = Resource(name=name, resource_type_id=resource_type_id, current_speed=current_speed)
+        resource = self.validate(self.request_json)
 
-        adapter = DBAdapter()
+        adapter = get_adapter()
         result = adapter.create(resource, "resource")
 
         return [result]
 
-    def retrieve(self) -> List[Resource]:
+    def parse_type_ids(self) -> Tuple[int, ...] | None:
+        # '?type=1,2' to filter by resource_type ids
+        raw_type_ids = self.url_params.get("type")
+        if not raw_type_ids:
+            return None
+
+        type_ids = raw_type_ids[0].split(",")
+        try:
+            return tuple(map(int, type_ids))
+        except ValueError:
+            raise exceptions.BadRequest(detail=f"wrong type url parameters")
+
+    def load_resource_type_ids(self) -> None:
+        # check resource types of a bulk operation up front, a missing one would fail the whole statement
+        type_ids = {item.get("resource_type_id") for item in self.request_json if isinstance(item, dict)}
+        type_ids = tuple(type_id for type_id in type_ids if isinstance(type_id, int))
+        self.resource_type_ids = set(get_adapter().retrieve_resource_types_by_id(type_ids)) if type_ids else set()
+
+    def validate_patch(self, item: dict) -> dict:
+        patch = super().validate_patch(item)
+        if "resource_type_id" in patch and patch["resource_type_id"] not in self.resource_type_ids:
+            raise exceptions.BadRequest(detail=f"can't find an object with given id")
+        return patch
+
+    def validate(self, item: dict) -> Resource:
+        if not isinstance(item, dict):
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "object has to be json object")
+
+        if (name := item.get("name")) is None:
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "you have to specify name")
+        if not isinstance(name, str):
+            raise HTTPException(http.HTTPStatus.BAD_REQUEST, "name has to be string")
+        resource_type_id = self.require_int(item, "resource_type_id")
+        current_speed = self.require_int(item, "current_speed")
+
+        # known resource types are set for bulk creation only
+        if self.resource_type_ids is not None and resource_type_id not in self.resource_type_ids:
+            raise exceptions.BadRequest(detail=f"can't find an object with given id")
+
+        # create Resource object to send its data to db adapter
+        return Resource(name=name, resource_type_id=resource_type_id, current_speed=current_speed)
+
+    def retrieve(self) -> List[Resource] | Iterator[Resource]:
         url = self.url_as_list()
 
         # parse resource id
@@ -180,28 +372,44 @@ class ResourceController(BaseDBController):
                 raise exceptions.NotFound(detail=f"resource id has to be int")
             resource_id = int(resource_id)
 
-        # parse filtering params
-        raw_type_ids = self.url_params.get("type")
-
         # create filtering data
         filtering_data = {}
-        if raw_type_ids:
-            type_ids = raw_type_ids[0].split(",")
-            try:
-                type_ids = tuple(map(int, type_ids))
-            except ValueError:
-                raise exceptions.BadRequest(detail=f"wrong type url parameters")
-            else:
-                filtering_data["type_id"] = type_ids
+        if type_ids := self.parse_type_ids():
+            filtering_data["type_id"] = type_ids
+
+        raw_speeding = self.url_params.get("speeding")
+        if raw_speeding:
+            speeding = raw_speeding[0].lower()
+            if speeding not in ("true", "false", "1", "0"):
+                raise exceptions.BadRequest(detail=f"wrong speeding url parameter, awaiting true or false")
+            filtering_data["speeding"] = speeding in ("true", "1")
+
+        raw_min_exceeding = self.url_params.get("min_exceeding")
+        if raw_min_exceeding:
+            if not raw_min_exceeding[0].isdecimal():
+                raise exceptions.BadRequest(detail=f"wrong min_exceeding url parameter, awaiting non-negative int")
+            if min_exceeding := int(raw_min_exceeding[0]):  # every resource exceeds by at least 0%
+                filtering_data["min_exceeding"] = min_exceeding
+
+        if resource_id is None:
+            self.stream_format = self.parse_stream_format()
+            self.page = parse_page("resource", self.url_params, Config.PAGE_DEFAULT_LIMIT, Config.PAGE_MAX_LIMIT)
+
+        adapter = get_adapter()
+        if self.stream_format and resource_id is None:  # rows are read lazily while the response is written
+            return adapter.stream_resources(filtering_data, self.page)
 
-        adapter = DBAdapter()
-        resources = adapter.retrieve(Resource, "resource", resource_id, filtering_data)
+        resources = adapter.retrieve_resources(resource_id, filtering_data, self.page)
 
         return resources
 
-    def update(self) -> List[Resource]:
+    def update(self) -> List[Resource] | dict:
         url = self.url_as_list()
 
+        if len(url) == 1 and isinstance(self.request_json, list) and self.request_json:  # bulk update
+            self.load_resource_type_ids()
+            return self.update_many("resource")
+
         # parse resource id
         if len(url) > 1:
             resource_id = url[1]
@@ -222,23 +430,17 @@ class ResourceController(BaseDBController):
         if all((name is None, resource_type_id is None, current_speed is None)):
             raise exceptions.BadRequest("at least one attribute to change have to be specified")
 
-        # create filtering data
-        filtering_data = {}
-
-        adapter = DBAdapter()
-
-        # retrieve existing Resource object
-        resource = adapter.retrieve(Resource, "resource", resource_id, filtering_data)[0]
-
-        # update and send object data to db connection
+        # send changed attributes only
+        changes = {}
         if name is not None:
-            resource.name = name
+            changes["name"] = name
         if resource_type_id is not None:
-            resource.resource_type_id = resource_type_id
+            changes["resource_type_id"] = resource_type_id
         if current_speed is not None:
-            resource.current_speed = current_speed
+            changes["current_speed"] = current_speed
 
-        adapter.update(resource, "resource", resource_id)
+        adapter = get_adapter()
+        resource = adapter.update(Resource, "resource", resource_id, changes)
 
         return [resource]
 
@@ -259,7 +461,7 @@ class ResourceController(BaseDBController):
         except ValueError:
             raise exceptions.BadRequest(detail=f"wrong id parameters, awaiting ints")
 
-        adapter = DBAdapter()
+        adapter = get_adapter()
 
         adapter.delete("resource", resource_ids)
         return
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from .db_access import DatabaseAccess
+from .versions import TableVersions
+
+
+class ResourceTypeCache:
+    """
+    In-memory copy of resource_type table.
+
+    The copy is dropped after `ttl` seconds, after writes through the adapter and when the table version
+    in db changes, e.g. after writes made by another process.
+    """
+
+    table_name = "resource_type"
+
+    def __init__(self, db: DatabaseAccess, versions: TableVersions, ttl: float = 60.0):
+        self.db = db
+        self.versions = versions
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._rows: dict | None = None  # id -> db row
+        self._version = None
+        self._loaded_at = 0.0
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def load(self) -> dict:
+        # read version first: concurrent write makes the loaded copy outdated and it is reloaded on next access
+        version = self.versions.get(self.table_name)
+        rows = {row[0]: row for row in self.db.retrieve_records(self.table_name, None, None)}
+        with self._lock:
+            self._rows = rows
+            self._version = version
+            self._loaded_at = time.monotonic()
+        return rows
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._rows = None
+            self.invalidations += 1
+        self.versions.invalidate()
+
+    def rows(self) -> dict:
+        """
+        Return resource_type rows by id, reload them if outdated.
+        """
+
+        with self._lock:
+            rows, version, loaded_at = self._rows, self._version, self._loaded_at
+
+        fresh = rows is not None and time.monotonic() - loaded_at < self.ttl
+        if fresh and self.versions.get(self.table_name) == version:
+            with self._lock:
+                self.hits += 1
+            return rows
+
+        with self._lock:
+            self.misses += 1
+        return self.load()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._rows) if self._rows is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests else None,
+                "invalidations": self.invalidations,
+                "version_checks": self.versions.checks,
+                "version_check_interval": self.versions.check_interval,
+            }
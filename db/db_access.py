@@ -1,10 +1,42 @@
-import random
+import itertools
+import math
+import time
 from contextlib import contextmanager
-from typing import Tuple
+from typing import Iterator, List, Tuple
 
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
 
 import exceptions
+import metrics
+from config import Config
+
+from .pagination import Page
+from .pool import ConnectionPool, get_pool
+from .slow_queries import get_slow_query_log
+
+_cursor_ids = itertools.count()
+SLOW_QUERY_SECONDS = Config.SLOW_QUERY_MS / 1000 if Config.SLOW_QUERY_MS > 0 else math.inf
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor reporting execution time of every statement, execute_values included, and logging slow ones.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.observe_query(query, seconds, failed)
+            if seconds >= SLOW_QUERY_SECONDS and not failed:
+                get_slow_query_log().record(self, query, vars, metrics.statement_kind(query), seconds)
 
 
 class DatabaseAccess:
@@ -15,6 +47,11 @@ class DatabaseAccess:
         password: str = "postgres",
         host: str = "127.0.0.1",
         port: int = 5432,
+        pool_min_size: int = 1,
+        pool_max_size: int = 10,
+        pool_timeout: float = 5.0,
+        pool_validate_idle: float = 30.0,
+        pool_max_lifetime: float = 3600.0,
     ):
         self.db_name = db_name
         self.username = username
@@ -22,11 +59,26 @@ class DatabaseAccess:
         self.host = host
         self.port = port
 
+        # connections are shared by all DatabaseAccess instances with the same parameters
+        self.pool: ConnectionPool = get_pool(
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            validate_idle=pool_validate_idle,
+            max_lifetime=pool_max_lifetime,
+            database=self.db_name,
+            user=self.username,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            cursor_factory=TimedCursor,  # every cursor of pooled connections
+        )
+
     @contextmanager
     def connect(self) -> None:
-        connection = psycopg2.connect(
-            database=self.db_name, user=self.username, password=self.password, host=self.host, port=self.port
-        )
+        started = time.perf_counter()
+        connection = self.pool.getconn()
+        metrics.observe_acquire(time.perf_counter() - started)
         try:
             yield connection
 
@@ -46,13 +98,20 @@ class DatabaseAccess:
             print(f"ERROR: can't connect to database: {e}")
 
         finally:
-            connection.close()
+            self.pool.putconn(connection)  # rolls back unfinished transactions, recycles broken connections
+
+    def create_record(self, table_name: str, data: dict) -> tuple:
+        """
+        Insert a row.
+
+        :return: inserted row with columns generated by db
+        """
 
-    def create_record(self, table_name: str, data: dict):
         columns = ", ".join(x for x in data)
         values = tuple(data.values())
         placeholders = ", ".join("%s" for x in data)
 
+        row = None
         with self.connect() as conn:
             cur = conn.cursor()
             cur.execute(
@@ -60,19 +119,119 @@ class DatabaseAccess:
                 INSERT INTO
                   {table_name} ({columns})
                 VALUES
-                  ({placeholders});
+                  ({placeholders})
+                RETURNING *;
+""",
+                values,
+            )
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+        return row
+
+    def create_records(self, table_name: str, data: List[dict], page_size: int = 1000) -> List[tuple]:
+        """
+        Insert rows with multi-row INSERT statements in a single transaction, skip rows with existing names.
+
+        :param table_name:
+        :param data: rows with the same columns
+        :param page_size: rows per statement
+        :return: inserted rows with columns generated by db
+        """
+
+        columns = ", ".join(x for x in data[0])
+        values = [tuple(row.values()) for row in data]
+
+        with self.connect() as conn:
+            cur = conn.cursor()
+            inserted = execute_values(
+                cur,
+                f"""
+                INSERT INTO
+                  {table_name} ({columns})
+                VALUES
+                  %s
+                ON CONFLICT (name) DO NOTHING
+                RETURNING *;
 """,
                 values,
+                page_size=page_size,
+                fetch=True,
             )
             conn.commit()
             cur.close()
+        return inserted
+
+    # types of columns that can be changed by bulk updates, to cast values list
+    UPDATE_COLUMN_TYPES = {
+        "resource_type": {"name": "varchar", "max_speed": "int"},
+        "resource": {"name": "varchar", "resource_type_id": "int", "current_speed": "int"},
+    }
+
+    def update_records(self, table_name: str, patches: List[dict]) -> set:
+        """
+        Apply patches to rows by their ids with a single UPDATE ... FROM (VALUES ...) statement.
+
+        A column missing in some of the patches keeps its value in those rows.
+
+        :param table_name:
+        :param patches: dicts with 'id' and columns to change
+        :return: ids of updated rows
+        """
+
+        column_types = self.UPDATE_COLUMN_TYPES[table_name]
+        columns = [column for column in column_types if any(column in patch for patch in patches)]
+
+        set_placeholders = ", ".join(
+            (
+                f"{column} = patch.{column}"
+                if all(column in patch for patch in patches)
+                else f"{column} = COALESCE(patch.{column}, {table_name}.{column})"
+            )
+            for column in columns
+        )
+        patch_columns = ", ".join(("id", *columns))
+        template = "(" + ", ".join(("%s::int", *(f"%s::{column_types[column]}" for column in columns))) + ")"
+        values = [(patch["id"], *(patch.get(column) for column in columns)) for patch in patches]
+
+        with self.connect() as conn:
+            cur = conn.cursor()
+            updated = execute_values(
+                cur,
+                f"""
+                UPDATE
+                  {table_name}
+                SET
+                  {set_placeholders}
+                FROM
+                  (VALUES %s) AS patch ({patch_columns})
+                WHERE
+                  {table_name}.id = patch.id
+                RETURNING {table_name}.id;
+""",
+                values,
+                template=template,
+                page_size=len(values),  # all the patches in one statement
+                fetch=True,
+            )
+            conn.commit()
+            cur.close()
+        return {row[0] for row in updated}
+
+    def update_record(self, table_name: str, obj_id: int, data: dict) -> tuple | None:
+        """
+        Change given columns of a row.
+
+        :param data: changed columns only
+        :return: updated row, None if there is no row with given id
+        """
 
-    def update_record(self, table_name: str, obj_id: int, data: dict):
         values = tuple(data.values())
         values += (obj_id,)
         set_placeholders = [f"{column} = %s" for column in data]
         set_placeholders = ", ".join(set_placeholders)
 
+        row = None
         with self.connect() as conn:
             cur = conn.cursor()
             query = f"""
@@ -81,133 +240,240 @@ class DatabaseAccess:
             SET 
               {set_placeholders}
             WHERE 
-              id = %s;
+              id = %s
+            RETURNING *;
 """
             cur.execute(query, values)
+            row = cur.fetchone()
             conn.commit()
             cur.close()
+        return row
+
+    # filtering_dict keys -> filtered columns
+    FILTER_COLUMNS = {
+        "id": "id",
+        "type_id": "resource_type_id",
+    }
+
+    # percent of max_speed exceeded by current_speed, rounded down; 0 if not exceeded
+    SPEED_EXCEEDING = """
+                  CASE
+                    WHEN resource.current_speed > resource_type.max_speed AND resource_type.max_speed > 0
+                    THEN resource.current_speed * 100 / resource_type.max_speed - 100
+                    ELSE 0
+                  END"""
 
-    def retrieve_records(self, table_name: str, obj_id: int | None, filtering_dict: dict | None):
+    # conditions on joined resource_type, written as ranges on resource.current_speed
+    # so that they can be answered by (resource_type_id, current_speed) index
+    SPEED_FILTERS = {
+        "speeding": lambda speeding: (
+            "resource.current_speed > resource_type.max_speed"
+            if speeding
+            else "(resource.current_speed <= resource_type.max_speed OR resource.current_speed IS NULL)"
+        ),
+        # speed_exceeding >= n  <=>  current_speed * 100 >= max_speed * (100 + n)
+        "min_exceeding": lambda _: (
+            "resource.current_speed >= (resource_type.max_speed * (100 + %s) + 99) / 100 "
+            "AND resource.current_speed > resource_type.max_speed AND resource_type.max_speed > 0"
+        ),
+    }
+
+    # columns of rows returned by retrieve methods
+    RECORD_COLUMNS = {
+        "resource_type": ("id", "name", "max_speed", "created_at"),
+        "resource": ("id", "name", "resource_type_id", "current_speed", "created_at"),
+    }
+    RESOURCE_WITH_TYPE_COLUMNS = (
+        "id",
+        "name",
+        "resource_type_id",
+        "current_speed",
+        "resource_type_name",
+        "max_speed",
+        "speed_exceeding",
+        "created_at",
+    )
+
+    def _build_where(
+        self, table_name: str, obj_id: int | None, filtering_dict: dict | None, page: Page | None = None
+    ) -> Tuple[str, list]:
+        conditions = []
+        params = []
+
+        # either resource_id or filtering
+        if obj_id:
+            conditions.append(f"{table_name}.id = %s")
+            params.append(obj_id)
+        elif filtering_dict:
+            for key, values in filtering_dict.items():
+                if key in self.SPEED_FILTERS:  # only for queries joined with resource_type
+                    conditions.append(self.SPEED_FILTERS[key](values))
+                    if key == "min_exceeding":
+                        params.append(values)
+                    continue
+                conditions.append(f"{table_name}.{self.FILTER_COLUMNS[key]} = ANY(%s)")
+                params.append(list(values))
+
+        # continue after the last row of previous page
+        if page and page.after:
+            sign = "<" if page.descending else ">"
+            value, after_id = page.after
+            if page.unique_order:
+                conditions.append(f"{table_name}.{page.order} {sign} %s")
+                params.append(value)
+            else:
+                conditions.append(f"({table_name}.{page.order}, {table_name}.id) {sign} (%s, %s)")
+                params.extend((value, after_id))
+
+        if not conditions:
+            return "", params
+
+        where = " AND ".join(conditions)
+        clause = f"""
+            WHERE
+              {where}
+            """
+        return clause, params
+
+    @staticmethod
+    def _build_order(table_name: str, page: Page | None, params: list) -> str:
+        if not page:
+            return ""
+
+        direction = " DESC" if page.descending else ""
+        order_by = f"{table_name}.{page.order}{direction}"
+        if not page.unique_order:
+            order_by += f", {table_name}.id{direction}"
+
+        query = f"""
+            ORDER BY
+              {order_by}
+            """
+        if page.limit is not None:
+            query += "LIMIT %s"
+            params.append(page.limit)
+        return query
+
+    def retrieve_records(
+        self, table_name: str, obj_id: int | None, filtering_dict: dict | None, page: Page | None = None
+    ):
         query = f"""
                 SELECT 
                   * 
                 FROM 
                   {table_name} 
 """
+        where, params = self._build_where(table_name, obj_id, filtering_dict, page)
+        query += where + self._build_order(table_name, page, params) + ";"
 
-        # either resource_id or filtering
-        if obj_id:
-            query += """
-            WHERE
-              id = (%s)
-            """
-        elif filtering_dict:
-            filtering_args = filtering_dict["type_id"]
-            if len(filtering_args) == 1:  # add bracket for single object
-                filtering_args = f"({filtering_args[0]})"
-            query += f"""
-            WHERE
-              resource_type_id IN {filtering_args}
-            """
+        with self.connect() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+
+            res = cur.fetchall()
+            cur.close()
+        return res
+
+    def _resources_query(self, obj_id: int | None, filtering_dict: dict | None, page: Page | None) -> Tuple[str, list]:
+        query = f"""
+                SELECT
+                  resource.id,
+                  resource.name,
+                  resource.resource_type_id,
+                  resource.current_speed,
+                  resource_type.name,
+                  resource_type.max_speed,
+                  {self.SPEED_EXCEEDING},
+                  resource.created_at
+                FROM
+                  resource
+                  LEFT JOIN resource_type ON resource_type.id = resource.resource_type_id
+"""
+        where, params = self._build_where("resource", obj_id, filtering_dict, page)
+        query += where + self._build_order("resource", page, params) + ";"
+        return query, params
+
+    def retrieve_resources(self, obj_id: int | None, filtering_dict: dict | None, page: Page | None = None):
+        """
+        Retrieve resources joined with name and max_speed of their resource types in a single query.
+
+        :param obj_id: resource id
+        :param filtering_dict: filtering data as for `retrieve_records`, also 'speeding' and 'min_exceeding'
+        :param page: ordering, limit and keyset position
+        :return: rows with RESOURCE_WITH_TYPE_COLUMNS
+        """
 
-        query += ";"
+        query, params = self._resources_query(obj_id, filtering_dict, page)
 
         with self.connect() as conn:
             cur = conn.cursor()
-            cur.execute(query, (obj_id,))
+            cur.execute(query, params)
 
             res = cur.fetchall()
             cur.close()
         return res
 
+    def stream_resources(
+        self, filtering_dict: dict | None, page: Page | None = None, batch_size: int = 2000
+    ) -> Iterator[tuple]:
+        """
+        Yield rows of `retrieve_resources` read from a server-side cursor, `batch_size` rows per round trip.
+
+        The connection is held until the generator is exhausted or closed.
+
+        :param filtering_dict: filtering data as for `retrieve_resources`
+        :param page: ordering, limit and keyset position
+        :param batch_size: rows fetched at once
+        :return:
+        """
+
+        query, params = self._resources_query(None, filtering_dict, page)
+
+        with self.connect() as conn:
+            cur = conn.cursor(name=f"stream_resources_{next(_cursor_ids)}")  # named cursor lives on the server
+            cur.itersize = batch_size
+            try:
+                cur.execute(query, params)
+                yield from cur
+            finally:
+                if not conn.closed:
+                    cur.close()
+
     def delete_records(self, table_name: str, obj_ids: Tuple[int]):
-        if len(obj_ids) == 1:  # create string for single object in the tuple
-            obj_ids = f"({obj_ids[0]})"
         query = f"""
                 DELETE
                 FROM 
                   {table_name}
                 WHERE
-                  id IN {obj_ids};
+                  id = ANY(%s);
 """
         with self.connect() as conn:
             cur = conn.cursor()
             cur.execute(
                 query,
-                (obj_ids,),
+                (list(obj_ids),),
             )
 
             conn.commit()
             cur.close()
         return
 
-    def _create_tables(self) -> None:
+    def retrieve_table_versions(self) -> dict:
         with self.connect() as conn:
             cur = conn.cursor()
-            query = """
-            CREATE TABLE resource_type (
-              id serial PRIMARY KEY, name varchar NOT NULL UNIQUE, 
-              max_speed int NOT NULL, created_at timestamp DEFAULT NOW()
-            );
-            CREATE TABLE resource (
-              id serial PRIMARY KEY, 
-              name varchar NOT NULL UNIQUE, 
-              resource_type_id int REFERENCES resource_type(id) ON DELETE CASCADE, 
-              current_speed int, 
-              created_at timestamp DEFAULT NOW()
-            );
-             """
-            cur.execute(query)
-
-            conn.commit()
+            cur.execute(
+                "SELECT 'resource_type', last_value FROM resource_type_version "
+                "UNION ALL SELECT 'resource', last_value FROM resource_version;"
+            )
+            res = dict(cur.fetchall())
             cur.close()
+        return res
 
-    def _insert_fixtures(self) -> None:
-        types = [
-            {"name": "loader", "max_speed": 50},
-            {"name": "excavator", "max_speed": 40},
-            {"name": "rig", "max_speed": 70},
-            {"name": "truck", "max_speed": 80},
-            {"name": "grader", "max_speed": 40},
-        ]
+    def bump_table_version(self, table_name: str) -> None:
+        # nextval isn't rolled back and is seen before commit: a version read in between may be cached
+        # with the old rows, bumping once more after commit makes it outdated
         with self.connect() as conn:
             cur = conn.cursor()
-
-            # create five resource_types
-            for data in types:
-                columns = ", ".join(x for x in data)
-                values = tuple(data.values())
-                placeholders = ", ".join("%s" for x in data)
-                query = f""" INSERT INTO
-                      resource_type ({columns})
-                    VALUES
-                      ({placeholders});
-                """
-                cur.execute(query, values)
-
-            # create 5 x 5 resources
-            for i in range(1, 6):
-                types = {
-                    1: "L",
-                    2: "E",
-                    3: "R",
-                    4: "T",
-                    5: "G",
-                }
-
-                names = random.sample(range(100), 5)
-                for name in names:
-                    name = types[i] + str(name)
-                    print(f"name = {name}")
-                    data = {"name": name, "resource_type_id": i, "current_speed": random.randint(0, 100)}
-                    columns = ", ".join(x for x in data)
-                    values = tuple(data.values())
-                    placeholders = ", ".join("%s" for x in data)
-                    query = f""" INSERT INTO
-                          resource ({columns})
-                        VALUES
-                          ({placeholders});
-                    """
-                    cur.execute(query, values)
+            cur.execute("SELECT nextval(%s::regclass);", (f"{table_name}_version",))
             conn.commit()
             cur.close()
@@ -1,47 +1,62 @@
 import dataclasses
+import threading
 from abc import ABC, abstractmethod
-from typing import Tuple
+from contextlib import nullcontext
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 import exceptions
 from config import Config
 
+from .cache import ResourceTypeCache
 from .db_access import DatabaseAccess
+from .migrations import migrate
+from .models import GENERATED_FIELDS, Resource, ResourceType, ResourceWithType, speed_exceeding
+from .pagination import Page, last_key, paginate_rows
+from .versions import TableVersions
+from .write_behind import SpeedBuffer
+
+_adapter = None
+_adapter_lock = threading.Lock()
 
 
 class BaseDBAdapter(ABC):
-    def __init__(self):
-        self.db = DatabaseAccess(
+    def __init__(self, db: DatabaseAccess | None = None):
+        self.db = db or DatabaseAccess(
             db_name=Config.DB_NAME,
             username=Config.DB_USERNAME,
             password=Config.DB_PASSWORD,
-            # host=Config.DB_HOST,
-            host="db",
+            host=Config.DB_HOST,
             port=Config.DB_PORT,
+            pool_min_size=Config.DB_POOL_MIN_SIZE,
+            pool_max_size=Config.DB_POOL_MAX_SIZE,
+            pool_timeout=Config.DB_POOL_TIMEOUT,
+            pool_validate_idle=Config.DB_POOL_VALIDATE_IDLE,
+            pool_max_lifetime=Config.DB_POOL_MAX_LIFETIME,
         )
 
-        # check if db tables exist; init and populate if not
-        self.init_tables()
-
-    def init_tables(self) -> None:
-        with self.db.connect() as conn:
-            cur = conn.cursor()
-            query = """
-            SELECT 
-              EXISTS (
-                SELECT 
-                FROM 
-                  information_schema.tables 
-                WHERE 
-                  table_name = 'resource_type'
-              );
-               """
-            cur.execute(query)  # check if tables in db already exist
-            exists = cur.fetchone()[0]
-            cur.close()
-
-        if not exists:  # create and populate tables if not exist
-            self.db._create_tables()
-            self.db._insert_fixtures()
+        self.bootstrap_report: dict | None = None
+
+        self.versions = TableVersions(self.db, check_interval=Config.TABLE_VERSION_CHECK_INTERVAL)
+        self.resource_type_cache = ResourceTypeCache(self.db, self.versions, ttl=Config.RESOURCE_TYPE_CACHE_TTL)
+
+        self.speed_buffer: SpeedBuffer | None = None
+        if Config.WRITE_BEHIND_ENABLED:
+            self.speed_buffer = SpeedBuffer(
+                self.db,
+                max_size=Config.WRITE_BEHIND_MAX_SIZE,
+                interval=Config.WRITE_BEHIND_INTERVAL,
+                on_flush=lambda: self.written(SpeedBuffer.table_name),
+            )
+
+    def init_tables(self) -> dict:
+        """
+        Create and populate db tables if needed, run once at process startup.
+
+        :return: bootstrap report
+        """
+
+        self.bootstrap_report = migrate(self.db)
+        return self.bootstrap_report
 
     @abstractmethod
     def create(self, obj, table_name: str):
@@ -52,7 +67,7 @@ class BaseDBAdapter(ABC):
         pass
 
     @abstractmethod
-    def update(self, obj, table_name: str, obj_id: int | None):
+    def update(self, obj_class, table_name: str, obj_id: int, changes: dict):
         pass
 
     @abstractmethod
@@ -62,32 +77,195 @@ class BaseDBAdapter(ABC):
 
 class DBAdapter(BaseDBAdapter):
     def create(self, obj, table_name: str):
-        self.db.create_record(table_name, dataclasses.asdict(obj))
-        return obj
+        record = self.db.create_record(table_name, self._to_record(obj))
+        self.written(table_name)
+        return self._to_objects(type(obj), [record], self.db.RECORD_COLUMNS[table_name])[0]
 
-    def retrieve(self, obj_class, table_name: str, obj_id: int | None, filtering_data: dict | None):
-        db_data = self.db.retrieve_records(table_name, obj_id, filtering_data)
-        objs = []
+    def create_many(self, objs: list, table_name: str) -> list:
+        """
+        Create objects in a single transaction.
+
+        :return: for every object, created object or None if an object with its name already exists
+        """
+
+        columns = self.db.RECORD_COLUMNS[table_name]
+        db_data = self.db.create_records(
+            table_name, [self._to_record(obj) for obj in objs], page_size=Config.BULK_PAGE_SIZE
+        )
+        self.written(table_name)
+
+        created = {obj.name: obj for obj in self._to_objects(type(objs[0]), db_data, columns)}
+        return [created.get(obj.name) for obj in objs]
+
+    def written(self, table_name: str) -> None:
+        """
+        Drop cached data of a table changed by this process, call after commit.
+
+        :param table_name:
+        :return:
+        """
+
+        self.db.bump_table_version(table_name)
+        if table_name == ResourceTypeCache.table_name:
+            self.resource_type_cache.invalidate()
+        else:
+            self.versions.invalidate()
+
+    def retrieve_cached_records(
+        self, table_name: str, obj_id: int | None, filtering_data: dict | None, page: Page | None = None
+    ):
+        if table_name != ResourceTypeCache.table_name:
+            return self.db.retrieve_records(table_name, obj_id, filtering_data, page)
+
+        rows = self.resource_type_cache.rows()
+        if obj_id:
+            return [rows[obj_id]] if obj_id in rows else []
+        if filtering_data and "id" in filtering_data:
+            records = [rows[type_id] for type_id in filtering_data["id"] if type_id in rows]
+        else:
+            records = list(rows.values())
+        if page:
+            records = paginate_rows(records, self.db.RECORD_COLUMNS[table_name], page)
+        return records
+
+    def retrieve(
+        self, obj_class, table_name: str, obj_id: int | None, filtering_data: dict | None, page: Page | None = None
+    ):
+        db_data = self.retrieve_cached_records(table_name, obj_id, filtering_data, page)
+
+        if obj_id and not db_data:  # single instance not found
+            raise exceptions.NotFound(detail=f"object with id = {obj_id} not found")
+
+        if page:
+            page.set_next_cursor(len(db_data), last_key(db_data, self.db.RECORD_COLUMNS[table_name], page))
+
+        objs = self._to_objects(obj_class, db_data, self.db.RECORD_COLUMNS[table_name])
+        if table_name == SpeedBuffer.table_name:
+            self._apply_buffered_speeds(objs)
+        return objs
+
+    def retrieve_resources(
+        self, obj_id: int | None, filtering_data: dict | None, page: Page | None = None
+    ) -> List[ResourceWithType]:
+        db_data = self.db.retrieve_resources(obj_id, filtering_data, page)
 
         if obj_id and not db_data:  # single instance not found
             raise exceptions.NotFound(detail=f"object with id = {obj_id} not found")
 
-        attrs_num = len(obj_class.__annotations__)
-        for record in db_data:
-            attrs = []
-            # parse attrs for any dataclass
-            for i in range(1, attrs_num + 1):
-                attrs.append(record[i])
+        if page:
+            page.set_next_cursor(len(db_data), last_key(db_data, self.db.RESOURCE_WITH_TYPE_COLUMNS, page))
+
+        objs = self._to_objects(ResourceWithType, db_data, self.db.RESOURCE_WITH_TYPE_COLUMNS)
+        return self._apply_buffered_speeds(objs)
+
+    def stream_resources(self, filtering_data: dict | None, page: Page | None = None) -> Iterator[ResourceWithType]:
+        columns = self.db.RESOURCE_WITH_TYPE_COLUMNS
+        for record in self.db.stream_resources(filtering_data, page, batch_size=Config.STREAM_BATCH_SIZE):
+            obj = ResourceWithType(**dict(zip(columns, record)))
+            if self.speed_buffer is not None:
+                self._apply_buffered_speeds([obj])
+            yield obj
+
+    def _apply_buffered_speeds(self, objs: List[Resource]) -> List[Resource]:
+        """
+        Replace current_speed of resources with values not flushed yet, so that reads see buffered writes.
+
+        Filtering and ordering by speed are done by db and use flushed values.
+        """
 
-            obj = obj_class(*attrs)
-            objs.append(obj)
+        if self.speed_buffer is None:
+            return objs
 
+        for obj in objs:
+            speed = self.speed_buffer.get(obj.id)
+            if speed is None:
+                continue
+            obj.current_speed = speed
+            if isinstance(obj, ResourceWithType):
+                obj.speed_exceeding = speed_exceeding(speed, obj.max_speed)
         return objs
 
-    def update(self, obj, table_name: str, obj_id: int):
-        self.db.update_record(table_name, obj_id, dataclasses.asdict(obj))
+    def _writing_speeds(self, table_name: str, resource_ids: Iterable[int]):
+        # writes of current_speed that bypass the buffer must not be overwritten by buffered values
+        if self.speed_buffer is None or table_name != SpeedBuffer.table_name:
+            return nullcontext()
+        return self.speed_buffer.write_through(resource_ids)
+
+    def retrieve_resource_types_by_id(self, type_ids: Tuple[int]) -> Dict[int, ResourceType]:
+        db_data = self.retrieve_cached_records("resource_type", None, {"id": type_ids})
+        objs = self._to_objects(ResourceType, db_data, self.db.RECORD_COLUMNS["resource_type"])
+        return {obj.id: obj for obj in objs}
+
+    @staticmethod
+    def _to_objects(obj_class, db_data, columns: Tuple[str, ...]) -> list:
+        # parse attrs for any dataclass by column names of db rows
+        return [obj_class(**dict(zip(columns, record))) for record in db_data]
+
+    @staticmethod
+    def _to_record(obj) -> dict:
+        # columns to write, generated ones are left to db
+        return {key: value for key, value in dataclasses.asdict(obj).items() if key not in GENERATED_FIELDS}
+
+    def update(self, obj_class, table_name: str, obj_id: int, changes: dict):
+        """
+        Change given attributes of an object in a single statement.
+
+        :param changes: changed attributes only
+        :return: updated object
+        """
 
-        return obj
+        with self._writing_speeds(table_name, (obj_id,) if "current_speed" in changes else ()):
+            record = self.db.update_record(table_name, obj_id, changes)
+        if record is None:
+            raise exceptions.NotFound(detail=f"object with id = {obj_id} not found")
+        self.written(table_name)
+
+        objs = self._to_objects(obj_class, [record], self.db.RECORD_COLUMNS[table_name])
+        return self._apply_buffered_speeds(objs)[0]
+
+    def update_many(self, table_name: str, patches: List[dict]) -> Tuple[set, set]:
+        """
+        Change objects by their ids in a single statement.
+
+        With write-behind, patches of current_speed only are buffered instead.
+
+        :param patches: dicts with 'id' and attributes to change
+        :return: ids of updated objects, ids of objects with buffered changes
+        """
+
+        buffered = set()
+        if self.speed_buffer is not None and table_name == SpeedBuffer.table_name:
+            speeds = {
+                patch["id"]: patch["current_speed"] for patch in patches if patch.keys() == {"id", "current_speed"}
+            }
+            if speeds:
+                self.speed_buffer.put(speeds)
+                buffered = set(speeds)
+                patches = [patch for patch in patches if patch["id"] not in speeds]
+
+        updated = set()
+        if patches:
+            with self._writing_speeds(table_name, [patch["id"] for patch in patches if "current_speed" in patch]):
+                updated = self.db.update_records(table_name, patches)
+            self.written(table_name)
+        return updated, buffered
 
     def delete(self, table_name: str, obj_ids: Tuple[int]):
-        self.db.delete_records(table_name, obj_ids)
+        with self._writing_speeds(table_name, obj_ids):
+            self.db.delete_records(table_name, obj_ids)
+        self.written(table_name)
+
+
+def get_adapter() -> DBAdapter:
+    """
+    Return the adapter shared by the whole process.
+
+    :return:
+    """
+
+    global _adapter
+    if _adapter is None:
+        with _adapter_lock:
+            if _adapter is None:
+                _adapter = DBAdapter()
+    return _adapter
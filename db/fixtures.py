@@ -0,0 +1,221 @@
+"""
+Seeded generator of resource types and resources at production scale, loaded with COPY.
+
+Usage:
+    python -m db.fixtures --types 1000 --resources 1000000 --fleet-skew 1.1 --speeding-share 0.1 --seed 1
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import random
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterator, List, Tuple
+
+from psycopg2.extras import execute_values
+
+from config import Config
+
+from .db_access import DatabaseAccess
+from .migrations import migrate
+
+EPOCH = datetime.datetime(2023, 10, 5)  # created_at of the last generated resource
+
+
+@dataclass
+class FixtureSpec:
+    types: int = 1000
+    resources: int = 1000000
+    fleet_skew: float = 1.0  # resources per type follow 1 / rank ** skew, 0 for fleets of equal size
+    min_max_speed: int = 20  # max_speed of types is uniform in this range
+    max_max_speed: int = 120
+    speed_spread: float = 0.25  # relative deviation of current_speed from max_speed
+    speeding_share: float = 0.1  # resources above max_speed of their type
+    days: int = 365  # created_at of resources is spread over that many days before EPOCH
+    seed: int = 0
+    prefix: str = "fx-"  # of names, generated rows can be told from others
+
+    def __post_init__(self):
+        if self.types < 1 or self.resources < 0:
+            raise ValueError(f"invalid fixture size: types={self.types}, resources={self.resources}")
+        if not 0 <= self.speeding_share <= 1:
+            raise ValueError(f"speeding_share has to be within 0 and 1, got {self.speeding_share}")
+        if not 0 <= self.min_max_speed <= self.max_max_speed:
+            raise ValueError(f"invalid max_speed range: {self.min_max_speed} - {self.max_max_speed}")
+
+
+class _ChunksReader:
+    """
+    File-like object over an iterator of text chunks, COPY input is never built in memory as a whole.
+    """
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._buffer = b""
+        self._offset = 0  # of unread data in the buffer
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) - self._offset < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer = self._buffer[self._offset :] + chunk.encode()
+            self._offset = 0
+
+        end = len(self._buffer) if size < 0 else min(self._offset + size, len(self._buffer))
+        data = self._buffer[self._offset : end]
+        self._offset = end
+        return data
+
+
+def generate_types(spec: FixtureSpec, rng: random.Random) -> List[Tuple[str, int]]:
+    """
+    :return: name and max_speed of every type
+    """
+
+    return [(f"{spec.prefix}type-{i}", rng.randint(spec.min_max_speed, spec.max_max_speed)) for i in range(spec.types)]
+
+
+def draw_speed(max_speed: int, spec: FixtureSpec, rng: random.Random) -> int:
+    deviation = abs(rng.gauss(0, spec.speed_spread)) * max_speed
+    if rng.random() < spec.speeding_share:
+        return max_speed + 1 + int(deviation)  # strictly above, so that the share is exact
+    return max(int(max_speed - deviation), 0)
+
+
+def generate_resources(
+    spec: FixtureSpec, types: List[Tuple[int, int]], rng: random.Random, chunk_rows: int = 10000
+) -> Iterator[str]:
+    """
+    Yield resources as COPY text input, `chunk_rows` rows per chunk.
+
+    :param types: id and max_speed of every type, in the order they were generated
+    :return:
+    """
+
+    # the first types get the largest fleets
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** spec.fleet_skew for rank in range(len(types))))
+    step = datetime.timedelta(days=spec.days) / max(spec.resources, 1)
+    started_at = EPOCH - step * spec.resources
+
+    for start in range(0, spec.resources, chunk_rows):
+        count = min(chunk_rows, spec.resources - start)
+        lines = []
+        for offset, type_index in enumerate(rng.choices(range(len(types)), cum_weights=cum_weights, k=count)):
+            index = start + offset
+            type_id, max_speed = types[type_index]
+            created_at = (started_at + step * (index + 1)).isoformat(sep=" ")
+            speed = draw_speed(max_speed, spec, rng)
+            lines.append(f"{spec.prefix}{type_index}-{index}\t{type_id}\t{speed}\t{created_at}\n")
+        yield "".join(lines)
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _prefix_loaded(db: DatabaseAccess, pattern: str) -> bool:
+    with db.connect() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT EXISTS (SELECT FROM resource_type WHERE name LIKE %s)"
+            " OR EXISTS (SELECT FROM resource WHERE name LIKE %s);",
+            (pattern, pattern),
+        )
+        loaded = cur.fetchone()[0]
+        cur.close()
+    return loaded
+
+
+def load_fixtures(db: DatabaseAccess, spec: FixtureSpec, notify: bool = False, replace: bool = False) -> dict:
+    """
+    Insert generated types with a multi-row INSERT and resources with COPY, in a single transaction.
+
+    The same spec always gives the same rows, ids aside. Names are unique, so rows with `spec.prefix` that are already
+    in db fail the load, unless `replace` deletes them first in the same transaction.
+
+    Without `notify`, triggers are off for the COPY with session_replication_role, that takes a superuser
+    or a role granted SET on it.
+
+    :param db: database access object, tables have to exist
+    :param spec: sizes and distributions
+    :param notify: send change notifications of inserted resources to subscribers, slow for millions of rows
+    :param replace: delete previously loaded rows with the same prefix
+    :return: load report
+    """
+
+    pattern = _like_prefix(spec.prefix)
+    if not replace and _prefix_loaded(db, pattern):
+        raise ValueError(f"fixtures with prefix {spec.prefix!r} are already loaded, replace them or change prefix")
+
+    rng = random.Random(spec.seed)
+    started = time.perf_counter()
+
+    with db.connect() as conn:
+        cur = conn.cursor()
+        if replace:
+            # resources are removed by ON DELETE CASCADE
+            cur.execute("DELETE FROM resource_type WHERE name LIKE %s;", (pattern,))
+            cur.execute("DELETE FROM resource WHERE name LIKE %s;", (pattern,))
+
+        type_rows = execute_values(
+            cur,
+            "INSERT INTO resource_type (name, max_speed) VALUES %s RETURNING id, max_speed;",
+            generate_types(spec, rng),
+            page_size=10000,
+            fetch=True,
+        )
+        types_ms = (time.perf_counter() - started) * 1000
+
+        if not notify:
+            # ALTER TABLE ... DISABLE TRIGGER would lock out readers of the table until commit; this skips triggers
+            # of this transaction only, foreign keys included: type ids come from the INSERT above
+            cur.execute("SET LOCAL session_replication_role = replica;")
+        reader = _ChunksReader(generate_resources(spec, type_rows, rng))
+        cur.copy_expert(
+            "COPY resource (name, resource_type_id, current_speed, created_at) FROM STDIN;", reader, size=64 * 1024
+        )
+        conn.commit()
+
+        cur.execute("ANALYZE resource_type, resource;")  # plans for the new sizes right away
+        conn.commit()
+        cur.close()
+
+    for table_name in ("resource_type", "resource"):
+        db.bump_table_version(table_name)  # versions read during the load are outdated
+
+    duration = time.perf_counter() - started
+    return {
+        "spec": asdict(spec),
+        "types_ms": round(types_ms, 3),
+        "duration_ms": round(duration * 1000, 3),
+        "resources_per_second": round(spec.resources / duration),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    defaults = FixtureSpec()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--notify", action="store_true", help="notify subscribers of inserted resources")
+    parser.add_argument("--replace", action="store_true", help="delete rows loaded before with the same prefix")
+    args = vars(parser.parse_args())
+    notify = args.pop("notify")
+    replace = args.pop("replace")
+
+    db = DatabaseAccess(
+        db_name=Config.DB_NAME,
+        username=Config.DB_USERNAME,
+        password=Config.DB_PASSWORD,
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+    )
+    migrate(db)
+    print(json.dumps(load_fixtures(db, FixtureSpec(**args), notify=notify, replace=replace)))
+
+
+if __name__ == "__main__":
+    main()
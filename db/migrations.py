@@ -0,0 +1,286 @@
+import random
+import time
+
+from .db_access import DatabaseAccess
+
+MIGRATIONS_LOCK_ID = 20231005  # advisory lock, serializes bootstrap of concurrently starting processes
+
+
+def _create_tables(cur) -> None:
+    # 'IF NOT EXISTS' adopts databases created before the migrations table existed
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resource_type (
+          id serial PRIMARY KEY, name varchar NOT NULL UNIQUE,
+          max_speed int NOT NULL, created_at timestamp DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS resource (
+          id serial PRIMARY KEY,
+          name varchar NOT NULL UNIQUE,
+          resource_type_id int REFERENCES resource_type(id) ON DELETE CASCADE,
+          current_speed int,
+          created_at timestamp DEFAULT NOW()
+        );
+         """)
+
+
+def _insert_fixtures(cur) -> None:
+    cur.execute("SELECT EXISTS (SELECT FROM resource_type);")
+    if cur.fetchone()[0]:  # database already has data
+        return
+
+    types = [
+        {"name": "loader", "max_speed": 50},
+        {"name": "excavator", "max_speed": 40},
+        {"name": "rig", "max_speed": 70},
+        {"name": "truck", "max_speed": 80},
+        {"name": "grader", "max_speed": 40},
+    ]
+
+    # create five resource_types
+    for data in types:
+        columns = ", ".join(x for x in data)
+        values = tuple(data.values())
+        placeholders = ", ".join("%s" for x in data)
+        query = f""" INSERT INTO
+              resource_type ({columns})
+            VALUES
+              ({placeholders})
+            RETURNING id;
+        """
+        cur.execute(query, values)
+        data["id"] = cur.fetchone()[0]
+
+    # create 5 x 5 resources
+    for resource_type in types:
+        prefix = resource_type["name"][0].upper()
+
+        names = random.sample(range(100), 5)
+        for name in names:
+            name = prefix + str(name)
+            data = {"name": name, "resource_type_id": resource_type["id"], "current_speed": random.randint(0, 100)}
+            columns = ", ".join(x for x in data)
+            values = tuple(data.values())
+            placeholders = ", ".join("%s" for x in data)
+            query = f""" INSERT INTO
+                  resource ({columns})
+                VALUES
+                  ({placeholders});
+            """
+            cur.execute(query, values)
+
+
+def _create_speed_index(cur) -> None:
+    # lets speed filters scan only resources above max_speed of each type
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS resource_type_id_current_speed_idx
+          ON resource (resource_type_id, current_speed);
+        """)
+
+
+def _create_table_versions(cur) -> None:
+    # statement level triggers bump a counter in the same transaction as the change itself,
+    # so in-process caches of every worker can tell that their copy is outdated
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+          table_name varchar PRIMARY KEY,
+          version bigint NOT NULL DEFAULT 0
+        );
+        INSERT INTO table_versions (table_name) VALUES ('resource_type'), ('resource') ON CONFLICT DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+          UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS resource_type_version ON resource_type;
+        CREATE TRIGGER resource_type_version
+          AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON resource_type
+          FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+        DROP TRIGGER IF EXISTS resource_version ON resource;
+        CREATE TRIGGER resource_version
+          AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON resource
+          FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+        """)
+
+
+def _create_order_indexes(cur) -> None:
+    # keyset pagination compares (column, id) pairs, nulls would drop rows out of every page
+    cur.execute("""
+        UPDATE resource SET current_speed = 0 WHERE current_speed IS NULL;
+        ALTER TABLE resource ALTER COLUMN current_speed SET NOT NULL;
+        UPDATE resource SET created_at = NOW() WHERE created_at IS NULL;
+        ALTER TABLE resource ALTER COLUMN created_at SET NOT NULL;
+        UPDATE resource_type SET created_at = NOW() WHERE created_at IS NULL;
+        ALTER TABLE resource_type ALTER COLUMN created_at SET NOT NULL;
+
+        CREATE INDEX IF NOT EXISTS resource_current_speed_id_idx ON resource (current_speed, id);
+        CREATE INDEX IF NOT EXISTS resource_created_at_id_idx ON resource (created_at, id);
+        CREATE INDEX IF NOT EXISTS resource_type_created_at_id_idx ON resource_type (created_at, id);
+        """)
+
+
+def _create_change_notifications(cur) -> None:
+    # one notification per statement and up to 200 rows, payload has to stay under 8000 bytes;
+    # ids and resource_type ids only, listeners read the rows themselves
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION notify_resource_changes() RETURNS trigger AS $$
+        BEGIN
+          IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify(
+              'resource_changes',
+              json_build_object('op', 'delete', 'rows', json_agg(json_build_array(id, resource_type_id)))::text
+            )
+            FROM (SELECT id, resource_type_id, row_number() OVER () / 200 AS chunk FROM old_rows) AS changed
+            GROUP BY chunk;
+          ELSE
+            PERFORM pg_notify(
+              'resource_changes',
+              json_build_object('op', lower(TG_OP), 'rows', json_agg(json_build_array(id, resource_type_id)))::text
+            )
+            FROM (SELECT id, resource_type_id, row_number() OVER () / 200 AS chunk FROM new_rows) AS changed
+            GROUP BY chunk;
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS resource_insert_notify ON resource;
+        CREATE TRIGGER resource_insert_notify
+          AFTER INSERT ON resource REFERENCING NEW TABLE AS new_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION notify_resource_changes();
+
+        DROP TRIGGER IF EXISTS resource_update_notify ON resource;
+        CREATE TRIGGER resource_update_notify
+          AFTER UPDATE ON resource REFERENCING NEW TABLE AS new_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION notify_resource_changes();
+
+        DROP TRIGGER IF EXISTS resource_delete_notify ON resource;
+        CREATE TRIGGER resource_delete_notify
+          AFTER DELETE ON resource REFERENCING OLD TABLE AS old_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION notify_resource_changes();
+        """)
+
+
+def _count_table_versions_with_sequences(cur) -> None:
+    # updating one row per table held its lock until commit, so every writer of a table waited for the previous one;
+    # nextval takes no lock that lasts, sequences start past the old counters so versions never go back
+    cur.execute("""
+        CREATE SEQUENCE IF NOT EXISTS resource_type_version;
+        CREATE SEQUENCE IF NOT EXISTS resource_version;
+        SELECT setval('resource_type_version', COALESCE(
+          (SELECT version FROM table_versions WHERE table_name = 'resource_type'), 0) + 1);
+        SELECT setval('resource_version', COALESCE(
+          (SELECT version FROM table_versions WHERE table_name = 'resource'), 0) + 1);
+
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+          PERFORM nextval(format('%I_version', TG_TABLE_NAME)::regclass);
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TABLE table_versions;
+        """)
+
+
+def _notify_only_listened_changes(cur) -> None:
+    # change hubs register their LISTEN connections while they have subscribers (see events.ChangeHub);
+    # without any, writes skip building and sending the payload, transition tables are still filled
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS change_listeners (
+          pid int PRIMARY KEY,
+          registered_at timestamp NOT NULL DEFAULT NOW()
+        );
+
+        CREATE OR REPLACE FUNCTION notify_resource_changes() RETURNS trigger AS $$
+        BEGIN
+          IF NOT EXISTS (SELECT FROM change_listeners) THEN
+            RETURN NULL;
+          END IF;
+          IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify(
+              'resource_changes',
+              json_build_object('op', 'delete', 'rows', json_agg(json_build_array(id, resource_type_id)))::text
+            )
+            FROM (SELECT id, resource_type_id, row_number() OVER () / 200 AS chunk FROM old_rows) AS changed
+            GROUP BY chunk;
+          ELSE
+            PERFORM pg_notify(
+              'resource_changes',
+              json_build_object('op', lower(TG_OP), 'rows', json_agg(json_build_array(id, resource_type_id)))::text
+            )
+            FROM (SELECT id, resource_type_id, row_number() OVER () / 200 AS chunk FROM new_rows) AS changed
+            GROUP BY chunk;
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+
+
+# (version, description, function applying the migration with a cursor); append only
+MIGRATIONS = [
+    (1, "create resource tables", _create_tables),
+    (2, "insert fixtures", _insert_fixtures),
+    (3, "index resources by type and speed", _create_speed_index),
+    (4, "track table versions", _create_table_versions),
+    (5, "index resources for ordering", _create_order_indexes),
+    (6, "notify about resource changes", _create_change_notifications),
+    (7, "count table versions with sequences", _count_table_versions_with_sequences),
+    (8, "notify about resource changes only while listened", _notify_only_listened_changes),
+]
+
+
+def migrate(db: DatabaseAccess) -> dict:
+    """
+    Bring the database schema up to date, apply every migration at most once.
+
+    :param db: database access object
+    :return: bootstrap report
+    """
+
+    started = time.perf_counter()
+    applied = []
+
+    with db.connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATIONS_LOCK_ID,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+              version int PRIMARY KEY,
+              description varchar NOT NULL,
+              applied_at timestamp DEFAULT NOW()
+            );
+            """)
+        cur.execute("SELECT version FROM schema_migrations;")
+        done = {row[0] for row in cur.fetchall()}
+
+        for version, description, apply in MIGRATIONS:
+            if version in done:
+                continue
+
+            migration_started = time.perf_counter()
+            apply(cur)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                (version, description),
+            )
+            applied.append(
+                {
+                    "version": version,
+                    "description": description,
+                    "duration_ms": round((time.perf_counter() - migration_started) * 1000, 3),
+                }
+            )
+
+        conn.commit()  # all migrations and the advisory lock are released together
+        cur.close()
+
+    return {
+        "schema_version": max(version for version, _, _ in MIGRATIONS),
+        "applied": applied,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -1,10 +1,23 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime
+
+# attributes set by db on insert, never written by the service
+GENERATED_FIELDS = ("id", "created_at")
+
+
+def speed_exceeding(current_speed: int | None, max_speed: int | None) -> int:
+    # percent of max_speed exceeded by current_speed, rounded down like in db; 0 if not exceeded
+    if max_speed and current_speed is not None and current_speed > max_speed:
+        return current_speed * 100 // max_speed - 100
+    return 0
 
 
 @dataclass
 class ResourceType:
+    id: int | None = field(default=None, kw_only=True)
     name: str
     max_speed: int
+    created_at: datetime | None = field(default=None, kw_only=True)
 
     def __str__(self):
         return f"{self.name}"
@@ -12,9 +25,18 @@ class ResourceType:
 
 @dataclass
 class Resource:
+    id: int | None = field(default=None, kw_only=True)
     name: str
     resource_type_id: int
     current_speed: int
+    created_at: datetime | None = field(default=None, kw_only=True)
 
     def __str__(self):
         return f"{self.name}"
+
+
+@dataclass
+class ResourceWithType(Resource):
+    resource_type_name: str | None
+    max_speed: int | None
+    speed_exceeding: int | None
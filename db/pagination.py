@@ -0,0 +1,149 @@
+import base64
+import datetime
+import json
+from dataclasses import dataclass
+from typing import Any, Tuple
+
+import exceptions
+
+# columns available for ?order= by table; every one is backed by an index together with id
+ORDER_COLUMNS = {
+    "resource": ("id", "name", "current_speed", "created_at"),
+    "resource_type": ("id", "name", "created_at"),
+}
+UNIQUE_COLUMNS = ("id", "name")
+TEXT_COLUMNS = ("name",)
+TIMESTAMP_COLUMNS = ("created_at",)
+INT_RANGE = (-(2**31), 2**31 - 1)  # of int columns in db
+
+
+@dataclass
+class Page:
+    limit: int | None = None  # None for all rows
+    after: Tuple[Any, int] | None = None  # (order column value, id) of the last row of previous page
+    order: str = "id"
+    descending: bool = False
+    next_cursor: str | None = None  # set after retrieval if there may be more rows
+
+    @property
+    def order_param(self) -> str:
+        return f"-{self.order}" if self.descending else self.order
+
+    @property
+    def unique_order(self) -> bool:
+        return self.order in UNIQUE_COLUMNS  # no tie-breaking by id needed
+
+    def set_next_cursor(self, rows_count: int, last_key: Tuple[Any, int] | None) -> None:
+        if self.limit is None or rows_count < self.limit or last_key is None:
+            self.next_cursor = None
+        else:
+            self.next_cursor = encode_cursor(self, *last_key)
+
+
+def encode_cursor(page: Page, value, obj_id: int) -> str:
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([page.order_param, value, obj_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _is_int(value) -> bool:
+    return type(value) is int and INT_RANGE[0] <= value <= INT_RANGE[1]
+
+
+def _matches_column(column: str, value) -> bool:
+    # cursors come from clients, a value db can't compare with the column would fail the query
+    if column in TIMESTAMP_COLUMNS:
+        return isinstance(value, datetime.datetime) and value.tzinfo is None
+    if column in TEXT_COLUMNS:
+        return isinstance(value, str) and "\x00" not in value
+    return _is_int(value)
+
+
+def decode_cursor(page: Page, cursor: str) -> Tuple[Any, int]:
+    wrong_cursor = exceptions.BadRequest(detail="wrong after url parameter, pass cursor from previous response")
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_order, value, obj_id = json.loads(raw)
+        if page.order in TIMESTAMP_COLUMNS:
+            value = datetime.datetime.fromisoformat(value)
+    except Exception:
+        raise wrong_cursor
+
+    if cursor_order != page.order_param:
+        raise exceptions.BadRequest(detail=f"cursor was issued for order={cursor_order}")
+    if not _is_int(obj_id) or not _matches_column(page.order, value):
+        raise wrong_cursor
+    return value, obj_id
+
+
+def parse_page(table_name: str, url_params: dict, default_limit: int | None, max_limit: int) -> Page:
+    """
+    Create a page out of 'limit', 'after' and 'order' url params.
+
+    :param table_name:
+    :param url_params: parsed query string
+    :param default_limit: limit if not specified, None for all rows
+    :param max_limit: max rows on a page
+    :return:
+    """
+
+    page = Page(limit=default_limit)
+
+    raw_order = url_params.get("order")
+    if raw_order:
+        order = raw_order[0]
+        page.descending = order.startswith("-")
+        page.order = order[1:] if page.descending else order
+        if page.order not in ORDER_COLUMNS[table_name]:
+            allowed = ", ".join(ORDER_COLUMNS[table_name])
+            raise exceptions.BadRequest(detail=f"wrong order url parameter, awaiting one of: {allowed}")
+
+    raw_limit = url_params.get("limit")
+    if raw_limit:
+        if not raw_limit[0].isdecimal() or int(raw_limit[0]) < 1:
+            raise exceptions.BadRequest(detail=f"wrong limit url parameter, awaiting positive int")
+        page.limit = int(raw_limit[0])
+    if page.limit is not None:
+        page.limit = min(page.limit, max_limit)
+
+    raw_after = url_params.get("after")
+    if raw_after:
+        page.after = decode_cursor(page, raw_after[0])
+
+    return page
+
+
+def paginate_rows(rows: list, columns: Tuple[str, ...], page: Page) -> list:
+    """
+    Apply page to rows already in memory, same as it is done by db.
+
+    :param rows: db rows
+    :param columns: column names of rows
+    :return:
+    """
+
+    key_index = columns.index(page.order)
+    id_index = columns.index("id")
+
+    def key(row):
+        return row[key_index], row[id_index]
+
+    rows = sorted(rows, key=key, reverse=page.descending)
+    if page.after:
+        after = page.after
+        if page.unique_order:
+            after, key = after[0], lambda row: row[key_index]  # noqa: E731
+        if page.descending:
+            rows = [row for row in rows if key(row) < after]
+        else:
+            rows = [row for row in rows if key(row) > after]
+    if page.limit is not None:
+        rows = rows[: page.limit]
+    return rows
+
+
+def last_key(rows: list, columns: Tuple[str, ...], page: Page) -> Tuple[Any, int] | None:
+    if not rows:
+        return None
+    return rows[-1][columns.index(page.order)], rows[-1][columns.index("id")]
@@ -0,0 +1,258 @@
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import exceptions
+
+_pools: dict = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Bounded thread-safe pool of psycopg2 connections.
+
+    Connections are validated on every checkout and recycled when broken or older than `max_lifetime`: the socket
+    is polled without a round trip, and connections idle for longer than `validate_idle` are pinged as well.
+    """
+
+    def __init__(
+        self,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 5.0,
+        validate_idle: float = 30.0,
+        max_lifetime: float = 3600.0,
+        **connect_kwargs,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"invalid pool size: min_size={min_size}, max_size={max_size}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.validate_idle = validate_idle  # ping connections idle for longer than that, seconds, 0 to ping every time
+        self.max_lifetime = max_lifetime  # close connections older than that, seconds
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []  # LIFO stack of (connection, released_at)
+        self._opened_at = {}  # id(connection) -> monotonic time it was opened
+        self._size = 0  # opened connections + connections being opened
+        self._in_use = 0
+        self._waiting = 0
+        self._filled = False
+
+        # counters
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    def _open(self):
+        connection = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self._created += 1
+            self._opened_at[id(connection)] = time.monotonic()
+        return connection
+
+    def _fill(self) -> None:
+        # open min_size connections on first use
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+
+        for opened in range(missing):
+            try:
+                connection = self._open()
+            except psycopg2.Error as e:
+                with self._cond:
+                    self._size -= missing - opened  # release slots reserved for the rest
+                    self._filled = False  # try again on next checkout
+                    self._cond.notify_all()
+                print(f"WARNING: can't prefill connection pool: {e}")
+                return
+            with self._cond:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+
+    def _close(self, connection) -> None:
+        with self._cond:
+            self._opened_at.pop(id(connection), None)
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _has_input(connection) -> bool:
+        # an idle connection has nothing to read, unless the server sent an error and closed it
+        try:
+            readable, _, _ = select.select([connection.fileno()], [], [], 0)
+        except (OSError, ValueError, psycopg2.Error):
+            return True
+        return bool(readable)
+
+    def _is_usable(self, connection, released_at: float) -> bool:
+        if connection.closed:
+            return False
+
+        opened_at = self._opened_at.get(id(connection), 0.0)
+        now = time.monotonic()
+        if self.max_lifetime and now - opened_at > self.max_lifetime:
+            return False
+
+        idle_too_long = self.validate_idle is not None and now - released_at >= self.validate_idle
+        if idle_too_long or self._has_input(connection):
+            # connection might have been dropped by the server or a proxy while idle
+            try:
+                cur = connection.cursor()
+                cur.execute("SELECT 1;")
+                cur.close()
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def getconn(self):
+        """
+        Check out a connection, waiting up to `timeout` seconds for a free one.
+
+        :return: psycopg2 connection
+        """
+
+        if not self._filled:
+            self._fill()
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            connection = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise exceptions.ServiceUnavailable(detail="no free database connections")
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    connection, released_at = self._idle.pop()
+                else:
+                    self._size += 1  # reserve a slot, open the connection outside the lock
+
+            if connection is None:
+                try:
+                    connection = self._open()
+                except psycopg2.Error as e:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    print(f"ERROR: can't connect to database: {e}")
+                    raise exceptions.ServiceUnavailable(detail="can't connect to database") from e
+            elif not self._is_usable(connection, released_at):
+                self._close(connection)  # recycle and try again
+                continue
+
+            break
+
+        wait_time = time.monotonic() - started
+        with self._cond:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+        return connection
+
+    def putconn(self, connection, broken: bool = False) -> None:
+        """
+        Return a checked out connection to the pool.
+
+        :param connection: connection received from `getconn`
+        :param broken: close the connection instead of reusing it
+        """
+
+        with self._cond:
+            self._in_use -= 1
+
+        if not broken and not connection.closed:
+            # do not leave open transactions on pooled connections
+            status = connection.info.transaction_status
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    broken = True
+                else:
+                    status = connection.info.transaction_status
+                    broken = status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+        if broken or connection.closed:
+            self._close(connection)
+            return
+
+        with self._cond:
+            self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time, 6),
+                "wait_time_max": round(self._max_wait_time, 6),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+            }
+
+
+def get_pool(**kwargs) -> ConnectionPool:
+    """
+    Return the process-wide pool for given connection parameters, create it on first call.
+    """
+
+    key = tuple(sorted(kwargs.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(**kwargs)
+    return pool
+
+
+def all_pools() -> list:
+    with _pools_lock:
+        return list(_pools.values())
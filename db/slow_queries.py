@@ -0,0 +1,121 @@
+import collections
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from config import Config
+
+_log = None
+_log_lock = threading.Lock()
+
+# statements that are explained; writes without ANALYZE, it would run them once more
+EXPLAINED_KINDS = ("select", "insert", "update", "delete")
+MAX_SQL_LENGTH = 2000  # bulk statements have values inlined
+MAX_PARAMS_LENGTH = 500
+
+
+def _shorten(text: str, length: int) -> str:
+    return text if len(text) <= length else f"{text[:length]}... ({len(text)} chars)"
+
+
+class SlowQueryLog:
+    """
+    Statements slower than a threshold with their parameters, duration and optionally their plan.
+
+    Entries are printed and the most recent ones are kept for /stats.
+    """
+
+    def __init__(self, threshold_ms: float, explain: bool = False, recent_size: int = 20):
+        """
+        :param threshold_ms: statements that took longer are logged
+        :param explain: capture plans, with EXPLAIN (ANALYZE, BUFFERS) for selects
+        :param recent_size: entries kept for /stats
+        """
+
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+
+        self._lock = threading.Lock()
+        self._recent: collections.deque = collections.deque(maxlen=recent_size)
+
+        # counters
+        self.logged = 0
+        self.explain_errors = 0
+
+    def record(self, cursor, query: str | bytes, params, kind: str, seconds: float) -> None:
+        """
+        Log a slow statement executed with `cursor`, its results have to be fetched already.
+
+        :param kind: first word of the statement, lowercase
+        """
+
+        sql = query.decode(errors="replace") if isinstance(query, bytes) else query
+        entry = {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "duration_ms": round(seconds * 1000, 3),
+            "sql": _shorten(" ".join(sql.split()), MAX_SQL_LENGTH),
+            "params": _shorten(repr(params), MAX_PARAMS_LENGTH) if params is not None else None,
+            "plan": self._explain(cursor.connection, query, params, kind) if self.explain else None,
+        }
+        with self._lock:
+            self._recent.append(entry)
+            self.logged += 1
+
+        print(f"WARNING: slow query took {entry['duration_ms']} ms: {entry['sql']}, params: {entry['params']}")
+        if entry["plan"]:
+            print(entry["plan"])
+
+    def _explain(self, connection, query: str | bytes, params, kind: str) -> str | None:
+        if kind not in EXPLAINED_KINDS or connection.closed or connection.autocommit:
+            return None
+
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if kind == "select" else "EXPLAIN "
+        statement = prefix.encode() + query if isinstance(query, bytes) else prefix + query
+
+        # plain cursor, plans are neither timed nor explained; a savepoint keeps the transaction usable on errors
+        cur = connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+        try:
+            cur.execute("SAVEPOINT slow_query_explain;")
+            try:
+                cur.execute(statement, params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+            except psycopg2.Error:
+                cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain;")
+                raise
+            cur.execute("RELEASE SAVEPOINT slow_query_explain;")
+            return plan
+        except psycopg2.Error as e:
+            with self._lock:
+                self.explain_errors += 1
+            return f"can't explain: {e}".strip()
+        finally:
+            cur.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold_ms,
+                "explain": self.explain,
+                "logged": self.logged,
+                "explain_errors": self.explain_errors,
+                "recent": list(self._recent),
+            }
+
+
+def get_slow_query_log() -> SlowQueryLog | None:
+    """
+    Return the log shared by the whole process, None if it is disabled.
+
+    :return:
+    """
+
+    global _log
+    if Config.SLOW_QUERY_MS <= 0:
+        return None
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = SlowQueryLog(Config.SLOW_QUERY_MS, explain=Config.SLOW_QUERY_EXPLAIN)
+    return _log
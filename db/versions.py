@@ -0,0 +1,46 @@
+import threading
+import time
+
+from .db_access import DatabaseAccess
+
+
+class TableVersions:
+    """
+    Per-table change counters, sequences bumped by db triggers on every write and once more after commit
+    by the writing process.
+
+    Counters are re-read from db at most once per `check_interval` seconds, or on next access after `invalidate()`,
+    so writes made by other processes are noticed within `check_interval`.
+    """
+
+    def __init__(self, db: DatabaseAccess, check_interval: float = 1.0):
+        self.db = db
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._versions: dict = {}
+        self._checked_at = 0.0
+        self.checks = 0
+
+    def invalidate(self) -> None:
+        """
+        Force re-reading counters on next access, call after writes made by this process.
+        """
+
+        with self._lock:
+            self._checked_at = 0.0
+
+    def get(self, table_name: str) -> int:
+        return self.current().get(table_name, 0)
+
+    def current(self) -> dict:
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return self._versions
+
+        versions = self.db.retrieve_table_versions()
+        with self._lock:
+            self._versions = versions
+            self._checked_at = time.monotonic()
+            self.checks += 1
+        return versions
@@ -0,0 +1,172 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable
+
+from .db_access import DatabaseAccess
+
+
+class SpeedBuffer:
+    """
+    Latest current_speed by resource id, written to db in batches by a background thread.
+
+    Values are flushed every `interval` seconds or as soon as `max_size` resources are buffered. A value
+    overwritten before a flush costs nothing, which is the point for frequently updated telemetry.
+    """
+
+    table_name = "resource"
+
+    def __init__(
+        self,
+        db: DatabaseAccess,
+        max_size: int = 10000,
+        interval: float = 1.0,
+        on_flush: Callable[[], None] | None = None,
+    ):
+        """
+        :param db:
+        :param max_size: buffered resources that trigger a flush
+        :param interval: max seconds a value stays in the buffer
+        :param on_flush: called after values are written, e.g. to drop cached data
+        """
+
+        self.db = db
+        self.max_size = max_size
+        self.interval = interval
+        self.on_flush = on_flush
+
+        self._lock = threading.Lock()  # guards buffered values and counters
+        self._flush_lock = threading.Lock()  # one write of buffered values at a time
+        self._pending: Dict[int, int] = {}
+        self._flushing: Dict[int, int] = {}  # values being written, still visible to reads
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._instance = uuid.uuid4().hex[:8]  # buffers of other processes hold other values
+        self.generation = 0  # bumped by every put
+
+        # counters
+        self.received = 0  # values put
+        self.written = 0  # rows updated
+        self.dropped = 0  # values of resources that don't exist
+        self.flushes = 0
+        self.errors = 0
+        self.flush_ms_total = 0.0
+        self.flush_ms_max = 0.0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="speed-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def put(self, speeds: Dict[int, int]) -> None:
+        """
+        Buffer current_speed values by resource id, replacing values that are not flushed yet.
+        """
+
+        self.start()
+        with self._lock:
+            self._pending.update(speeds)
+            self.received += len(speeds)
+            self.generation += 1
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wakeup.set()
+
+    def tag(self) -> str:
+        # changes whenever reads may see other buffered values
+        return f"{self._instance}.{self.generation}"
+
+    def get(self, resource_id: int) -> int | None:
+        # dict lookups are atomic, reads don't wait for the lock
+        speed = self._pending.get(resource_id)
+        return speed if speed is not None else self._flushing.get(resource_id)
+
+    @contextmanager
+    def write_through(self, resource_ids: Iterable[int]):
+        """
+        Drop buffered values of resources written directly to db, so that a later flush doesn't overwrite them.
+
+        No flush runs until the block is done.
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                for resource_id in resource_ids:
+                    self._pending.pop(resource_id, None)
+            yield
+
+    def flush(self) -> None:
+        """
+        Write buffered values with a single statement, keep them for the next flush on failure.
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+
+            started = time.perf_counter()
+            try:
+                patches = [{"id": resource_id, "current_speed": speed} for resource_id, speed in batch.items()]
+                updated = self.db.update_records(self.table_name, patches)
+            except Exception as e:  # db errors come as HTTPException
+                print(f"ERROR: can't flush {len(batch)} buffered speeds: {e}")
+                with self._lock:
+                    self.errors += 1
+                    for resource_id, speed in batch.items():
+                        self._pending.setdefault(resource_id, speed)  # newer values win
+                    self._flushing = {}
+                return
+
+            flush_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._flushing = {}
+                self.flushes += 1
+                self.written += len(updated)
+                self.dropped += len(batch) - len(updated)
+                self.flush_ms_total += flush_ms
+                self.flush_ms_max = max(self.flush_ms_max, flush_ms)
+
+        if len(updated) < len(batch):
+            print(f"WARNING: dropped buffered speeds of {len(batch) - len(updated)} missing resources")
+        if self.on_flush:
+            self.on_flush()
+
+    def close(self) -> None:
+        """
+        Stop the background thread and write what is left.
+        """
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        print(f"INFO: speed buffer flushed, {self.written} rows written of {self.received} values received")
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self.written + self.dropped + len(self._pending)  # pending values take a row each
+            return {
+                "depth": len(self._pending),
+                "received": self.received,
+                "written": self.written,
+                "dropped": self.dropped,
+                # values received per row written, higher is better
+                "coalescing_ratio": round(self.received / rows, 4) if rows else None,
+                "flushes": self.flushes,
+                "errors": self.errors,
+                "flush_ms_avg": round(self.flush_ms_total / self.flushes, 3) if self.flushes else None,
+                "flush_ms_max": round(self.flush_ms_max, 3),
+            }
@@ -0,0 +1,578 @@
+import functools
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Callable, Iterator, List, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import exceptions
+import metrics
+import request_profiling
+from config import Config
+from controllers import ResourceController, ResourceTypeController
+from db.db_adapter import get_adapter
+from db.pool import all_pools
+from db.slow_queries import get_slow_query_log
+from events import EventStream, get_hub
+from json_backend import dumps, loads
+from response_cache import CachedResponse, ResponseCache, get_response_cache
+from response_compression import compress
+from singleflight import get_single_flight
+from views import ResourceTypeView, ResourceView
+
+URL_SCHEME = "scheme://path;parameters?query"
+# tables whose changes change responses of a path, the first one is written by the path
+PATH_TABLES = {
+    "/resources": ("resource", "resource_type"),
+    "/resource_types": ("resource_type",),
+}
+# paths with own metric labels, ids are replaced so that labels stay few
+ROUTES = ("/resources", "/resource_types", "/stats", "/metrics")
+STREAM_CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str  # raw path with query string
+    headers: dict = field(default_factory=dict)  # lowercase names
+    body: bytes = b""
+
+    def __post_init__(self):
+        # parse url params from raw 'self.path'
+        self.parsed_url = urlparse(self.path, scheme=URL_SCHEME)
+        self.url_params = parse_qs(self.parsed_url.query)
+        self.request_json: dict | list | None = None
+
+    @functools.cached_property
+    def route(self) -> str:
+        # path template, e.g. '/resources/{id}', as a metric label
+        parts = self.parsed_url.path.strip("/").split("/")
+        prefix = "/" + parts[0]
+        if prefix not in ROUTES or len(parts) > 2:
+            return "other"
+        if len(parts) == 1:
+            return prefix
+        return f"{prefix}/{parts[1]}" if parts[1] == "stream" else f"{prefix}/{{id}}"
+
+
+@dataclass
+class Response:
+    status: int
+    # iterator for responses streamed in chunks of unknown total size, EventStream for never ending ones
+    body: bytes | Iterator[bytes] | EventStream = b""
+    headers: dict = field(default_factory=lambda: {"Content-Type": "application/json"})
+    encoded: dict | None = None  # compressed bodies by encoding, shared with a cached response
+
+    @property
+    def streaming(self) -> bool:
+        return not isinstance(self.body, bytes)
+
+
+def respond_json(code: int, data: str | bytes) -> Response:
+    return Response(status=code, body=data if isinstance(data, bytes) else f"{data}".encode())
+
+
+def get_controller(request: Request):
+    """
+    Return a controller instance depending on requested path.
+
+    :return:
+    """
+
+    # /resources
+    if request.path.startswith("/resources"):
+        return ResourceController(
+            url=request.parsed_url,
+            request_json=request.request_json,
+            url_params=request.url_params,
+        )
+
+    # /resource_types
+    elif request.path.startswith("/resource_types"):
+        return ResourceTypeController(
+            url=request.parsed_url,
+            request_json=request.request_json,
+            url_params=request.url_params,
+        )
+
+    # not found
+    else:
+        return None
+
+
+def get_view(request: Request, data: List):
+    """
+    Return a serializer class depending on requested path.
+
+    :return:
+    """
+
+    # /resources
+    if request.path.startswith("/resources"):
+        return ResourceView(data)
+
+    # /resource_types
+    elif request.path.startswith("/resource_types"):
+        return ResourceTypeView(data)
+
+    # not found
+    else:
+        return None
+
+
+def serialize(request: Request, view) -> bytes:
+    started = time.perf_counter()
+    try:
+        return view.serialize()
+    finally:
+        metrics.observe_phase(request.route, "serialize", time.perf_counter() - started)
+
+
+def handle_subscribe(request: Request, controller) -> Response:
+    """
+    Stream changes of resources as server-sent events until the client disconnects.
+
+    :return:
+    """
+
+    hub = get_hub()
+    last_event_id = request.headers.get("last-event-id") or request.url_params.get("last_event_id", [None])[0]
+    subscription = hub.subscribe(controller.parse_type_ids(), last_event_id)
+
+    print(f"SUCCESS: subscribed to resource changes")
+    headers = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    stream = EventStream(hub, subscription, Config.SSE_HEARTBEAT_INTERVAL)  # written by the server, not a worker
+    return Response(status=HTTPStatus.OK, body=stream, headers=headers)
+
+
+def get_tables(request: Request) -> Tuple[str, ...]:
+    prefix = "/" + request.parsed_url.path.strip("/").split("/")[0]
+    return PATH_TABLES.get(prefix, ())
+
+
+def get_etag(request: Request) -> str | None:
+    """
+    Return a tag that changes whenever a response to the request may change, without reading the data itself.
+
+    It is made of change counters of the tables the path reads, bumped by db triggers on every write.
+
+    :return: weak ETag, None for paths that are not tracked
+    """
+
+    tables = get_tables(request)
+    if not tables:
+        return None
+
+    adapter = get_adapter()
+    versions = adapter.versions.current()
+    parts = [str(versions.get(table_name, 0)) for table_name in tables]
+    if adapter.speed_buffer is not None and adapter.speed_buffer.table_name in tables:
+        parts.append(adapter.speed_buffer.tag())  # buffered writes are not counted by db yet
+    return f'W/"{"-".join(parts)}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # weak comparison, as for GET
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+def handle_get(request: Request, controller) -> Response:
+    if isinstance(controller, ResourceController) and controller.url_as_list()[1:] == ["stream"]:
+        return handle_subscribe(request, controller)
+
+    # read versions before the data, so that the tag is never newer than the response
+    etag = get_etag(request)
+    revalidated = etag is not None and etag_matches(request.headers.get("if-none-match"), etag)
+
+    # the tag is per table: it tells that a list didn't change, but not that a single object still exists
+    if revalidated and len(controller.url_as_list()) == 1:
+        return not_modified(etag)
+
+    response = respond_get_cached(request, controller, etag)
+    if revalidated and response.status == HTTPStatus.OK and not response.streaming:
+        return not_modified(etag)
+    return response
+
+
+def not_modified(etag: str) -> Response:
+    print(f"SUCCESS: not modified")
+    return Response(status=HTTPStatus.NOT_MODIFIED, headers={"ETag": etag})
+
+
+def respond_get_cached(request: Request, controller, etag: str | None) -> Response:
+    """
+    Respond from the response cache, or share a single query with identical requests in flight.
+
+    :param etag: current tag of the path, None if it is not tracked
+    :return:
+    """
+
+    response_cache = get_response_cache()
+
+    # 'Cache-Control: no-cache' to skip the cache and coalescing, e.g. for debugging
+    if "no-cache" in request.headers.get("cache-control", ""):
+        response = respond_get(request, controller)
+        response.headers["ETag"] = etag
+        if response_cache:
+            response_cache.bypassed()
+            response.headers["X-Cache"] = "BYPASS"
+        return response
+
+    key = ResponseCache.key(request.parsed_url.path, request.url_params)
+    if response_cache and (cached := response_cache.get(key, etag)):
+        print(f"SUCCESS: sent cached response")
+        headers = {**cached.headers, "X-Cache": "HIT"}
+        return Response(status=cached.status, body=cached.body, headers=headers, encoded=cached.encoded)
+
+    def fetch() -> Response:
+        response = respond_get(request, controller)
+        response.headers["ETag"] = etag
+        if response_cache and response.status == HTTPStatus.OK and not response.streaming:
+            entry = CachedResponse(
+                status=response.status,
+                body=response.body,
+                headers=dict(response.headers),
+                etag=etag,
+                tables=get_tables(request),
+                stored_at=time.monotonic(),
+            )
+            response_cache.put(key, entry)
+            response.encoded = entry.encoded  # compressed once for every client
+        return response
+
+    if "stream" in request.url_params:  # a streamed body can be read only once
+        response = fetch()
+    else:
+        # identical requests in flight share a single query and serialization
+        shared = get_single_flight().do((key, etag), fetch)
+        response = Response(
+            status=shared.status, body=shared.body, headers=dict(shared.headers), encoded=shared.encoded
+        )
+
+    if response_cache:
+        response.headers["X-Cache"] = "MISS"
+    return response
+
+
+def respond_get(request: Request, controller) -> Response:
+    data = controller.retrieve()
+
+    view = get_view(request, data)
+
+    if controller.stream_format:
+        print(f"SUCCESS: streaming {controller.stream_format}")
+        content_type = STREAM_CONTENT_TYPES[controller.stream_format]
+        chunks = view.stream(controller.stream_format, chunk_size=Config.STREAM_CHUNK_SIZE)
+        return Response(status=HTTPStatus.OK, body=chunks, headers={"Content-Type": content_type})
+
+    response_string = serialize(request, view)
+
+    print(f"SUCCESS: sent {len(data)} objects")  # repr of every object costs more than serializing it
+    response = respond_json(code=HTTPStatus.OK, data=response_string)
+
+    # cursor of the next page, if there may be more rows
+    if controller.page and controller.page.next_cursor:
+        url_params = {**request.url_params, "after": [controller.page.next_cursor]}
+        next_url = f"{request.parsed_url.path}?{urlencode(url_params, doseq=True)}"
+        response.headers["X-Next-Cursor"] = controller.page.next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def respond_bulk(controller, result: dict, processed: int, failed: int, code: int) -> Response:
+    """
+    Respond to a bulk operation with its result and per item errors.
+
+    :param result: response data besides errors
+    :param processed: count of successfully processed items
+    :param failed: count of items that failed, including invalid ones
+    :param code: status if every item was processed
+    :return: 'code' if every item was processed, 207 if some of them, 400 if none
+    """
+
+    if failed and processed:
+        code = HTTPStatus.MULTI_STATUS
+    elif failed:
+        code = HTTPStatus.BAD_REQUEST
+    response_string = dumps({**result, "errors": controller.errors})
+
+    print(f"SUCCESS: {processed} processed, {failed} failed")
+    return respond_json(code=code, data=response_string)
+
+
+def handle_post(request: Request, controller) -> Response:
+    data = controller.create()
+
+    if controller.errors is not None:  # bulk creation
+        view = get_view(request, data)
+        if isinstance(view, ResourceView):
+            view.resource_types = view.get_resource_types()
+        result = {"created": [view.to_dict(obj) for obj in data]}
+        return respond_bulk(controller, result, len(data), len(controller.errors), HTTPStatus.CREATED)
+
+    view = get_view(request, data)
+    response_string = serialize(request, view)
+
+    print(f"SUCCESS: sent {data}")
+    return respond_json(code=HTTPStatus.CREATED, data=response_string)
+
+
+def handle_patch(request: Request, controller) -> Response:
+    data = controller.update()
+
+    if controller.errors is not None:  # bulk update
+        processed = len(data["updated"]) + len(data["buffered"])
+        failed = len(controller.errors) + len(data["missing"])
+        code = HTTPStatus.ACCEPTED if data["buffered"] else HTTPStatus.OK  # buffered changes are not written yet
+        return respond_bulk(controller, data, processed, failed, code)
+
+    view = get_view(request, data)
+    response_string = serialize(request, view)
+
+    print(f"SUCCESS: {data} updated")
+    return respond_json(code=HTTPStatus.CREATED, data=response_string)
+
+
+def handle_delete(request: Request, controller) -> Response:
+    controller.delete()
+
+    print(f"SUCCESS: deleted")
+    return respond_json(code=HTTPStatus.NO_CONTENT, data="")
+
+
+METHOD_HANDLERS = {
+    "GET": handle_get,
+    "POST": handle_post,
+    "PATCH": handle_patch,
+    "DELETE": handle_delete,
+}
+
+
+def handle(request: Request, server_stats: Callable[[], dict] | None = None) -> Response:
+    """
+    Process a request with a controller and a view matching its path, same for every server.
+
+    :param request:
+    :param server_stats: returns statistics of the server the request came to
+    :return:
+    """
+
+    if request_profiling.requested(request.headers):
+        # bodies streamed after this returns are not profiled
+        response, path = request_profiling.profile(
+            lambda: process(request, server_stats), f"{request.method} {request.route}"
+        )
+        response.headers["X-Profile-File"] = path
+        return response
+    return process(request, server_stats)
+
+
+def process(request: Request, server_stats: Callable[[], dict] | None = None) -> Response:
+    metrics.start_request()
+    response = route(request, server_stats)
+    metrics.observe_phase(request.route, "query", metrics.request_query_seconds())
+
+    if Config.COMPRESSION_ENABLED:
+        started = time.perf_counter()
+        response = compress(
+            response,
+            request.headers.get("accept-encoding"),
+            level=Config.COMPRESSION_LEVEL,
+            min_size=Config.COMPRESSION_MIN_SIZE,
+        )
+        if not response.streaming:  # streamed bodies are compressed while written
+            metrics.observe_phase(request.route, "compress", time.perf_counter() - started)
+    return response
+
+
+def record_request(request: Request, response: Response, started: float, handled: float) -> None:
+    """
+    Observe latency of a request once its response is written, same for every server.
+
+    :param started: perf_counter() when the request was parsed
+    :param handled: perf_counter() when `handle` returned
+    :return:
+    """
+
+    finished = time.perf_counter()
+    metrics.observe_phase(request.route, "write", finished - handled)
+    metrics.observe_request(request.route, request.method, response.status, finished - started)
+
+
+def route(request: Request, server_stats: Callable[[], dict] | None = None) -> Response:
+    print(f"{request.method} {request.path}")
+
+    if request.method == "GET" and request.parsed_url.path.rstrip("/") == "/stats":
+        return respond_json(code=HTTPStatus.OK, data=dumps(collect_stats(server_stats)))
+    if request.method == "GET" and request.route == "/metrics" and Config.METRICS_ENABLED:
+        return respond_metrics(server_stats)
+
+    # parse json from request body
+    if request.body:
+        started = time.perf_counter()
+        try:
+            request.request_json = loads(request.body)
+            metrics.observe_phase(request.route, "parse", time.perf_counter() - started)
+        except Exception as e:
+            print(f"ERROR: can't parse json from requests body: {e}")
+            return respond_json(code=HTTPStatus.BAD_REQUEST, data=f"can't parse json from requests body: {e}")
+
+    if request.method not in METHOD_HANDLERS:
+        return respond_json(code=HTTPStatus.METHOD_NOT_ALLOWED, data="method not allowed")
+
+    controller = get_controller(request)
+
+    if not controller:  # url not found
+        print(f"WARNING: 404 resource not found")
+        return respond_json(code=HTTPStatus.NOT_FOUND, data="resource not found")
+
+    try:  # call specific method handler
+        return METHOD_HANDLERS[request.method](request, controller)
+    except exceptions.HTTPException as e:
+        return respond_json(code=e.status_code, data=f"{e.detail}")
+    finally:
+        if request.method != "GET" and (response_cache := get_response_cache()):
+            # failed bulk writes may still have written some of the objects
+            response_cache.invalidate(get_tables(request)[:1])
+
+
+def collect_stats(server_stats: Callable[[], dict] | None = None) -> dict:
+    """
+    Return runtime statistics for tuning.
+
+    :param server_stats: returns statistics of the server the request came to
+    :return:
+    """
+
+    return {
+        "http_server": server_stats() if server_stats else None,
+        "bootstrap": get_adapter().bootstrap_report,
+        "db_pools": [pool.stats() for pool in all_pools()],
+        "resource_type_cache": get_adapter().resource_type_cache.stats(),
+        "write_behind": speed_buffer.stats() if (speed_buffer := get_adapter().speed_buffer) else None,
+        "change_stream": get_hub().stats(),
+        "response_cache": response_cache.stats() if (response_cache := get_response_cache()) else None,
+        "single_flight": get_single_flight().stats(),
+        "slow_queries": slow_query_log.stats() if (slow_query_log := get_slow_query_log()) else None,
+    }
+
+
+def metric_gauges(server_stats: Callable[[], dict] | None = None) -> List[tuple]:
+    """
+    Return current state of pools and caches as name, documentation, label names and samples of gauges.
+
+    :param server_stats: returns statistics of the server
+    :return:
+    """
+
+    stats = collect_stats(server_stats)
+    pools = dict(enumerate(stats["db_pools"]))
+    server = stats["http_server"] or {}
+    gauges = [
+        (
+            "db_pool_connections",
+            "Connections of db pools by state.",
+            ("pool", "state"),
+            {(index, state): pool[state] for index, pool in pools.items() for state in ("in_use", "idle")},
+        ),
+        (
+            "db_pool_waiting",
+            "Threads waiting for a free connection.",
+            ("pool",),
+            {(index,): pool["waiting"] for index, pool in pools.items()},
+        ),
+        ("http_workers_busy", "Workers handling a request.", (), {(): server.get("busy")}),
+        ("http_queued", "Requests waiting for a free worker.", (), {(): server.get("queued")}),
+        (
+            "response_cache_bytes",
+            "Size of cached responses.",
+            (),
+            {(): (stats["response_cache"] or {}).get("size_bytes")},
+        ),
+        (
+            "write_behind_depth",
+            "Resources with buffered speeds.",
+            (),
+            {(): (stats["write_behind"] or {}).get("depth")},
+        ),
+        (
+            "sse_subscribers",
+            "Clients subscribed to resource changes.",
+            (),
+            {(): stats["change_stream"]["subscribers"]},
+        ),
+    ]
+    return gauges
+
+
+def respond_metrics(server_stats: Callable[[], dict] | None = None) -> Response:
+    """
+    Respond with collected metrics and current state of pools and caches in prometheus text format.
+
+    :param server_stats: returns statistics of the server the request came to
+    :return:
+    """
+
+    body = metrics.render(metric_gauges(server_stats))
+    return Response(status=HTTPStatus.OK, body=body, headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+def start_metrics_export(directory: str, server_stats: Callable[[], dict] | None = None) -> None:
+    """
+    Export metrics of this prefork worker to `directory`, /metrics of every worker then reports them all.
+
+    :param directory: shared by the supervisor and every worker
+    :param server_stats: returns statistics of the server of this worker
+    :return:
+    """
+
+    if Config.METRICS_ENABLED:
+        metrics.start_export(directory, Config.METRICS_EXPORT_INTERVAL, lambda: metric_gauges(server_stats))
+
+
+def bootstrap() -> None:
+    """
+    Prepare the database once before serving requests.
+
+    :return:
+    """
+
+    adapter = get_adapter()
+    report = adapter.init_tables()
+    adapter.resource_type_cache.load()
+    applied = ", ".join(str(migration["version"]) for migration in report["applied"]) or "none"
+    print(
+        f"INFO: database bootstrap took {report['duration_ms']} ms, "
+        f"schema version {report['schema_version']}, applied migrations: {applied}"
+    )
+
+
+def stop_streams() -> None:
+    """
+    End never ending responses, e.g. change streams, so that in-flight requests can finish.
+
+    :return:
+    """
+
+    get_hub().close()
+
+
+def shutdown() -> None:
+    """
+    Write data buffered by this process, after the server stopped taking requests.
+
+    :return:
+    """
+
+    adapter = get_adapter()
+    if adapter.speed_buffer is not None:
+        adapter.speed_buffer.close()
@@ -0,0 +1,449 @@
+import collections
+import select
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+import exceptions
+from config import Config
+from db.db_adapter import get_adapter
+from json_backend import dumps, loads
+from views import EventStreamView, ResourceView
+
+_hub = None
+_hub_lock = threading.Lock()
+REGISTER_TIMEOUT = 5  # seconds a new subscriber waits for triggers to start notifying
+
+
+@dataclass
+class Event:
+    token: str  # resume token, sent as SSE id
+    name: str  # insert, update, delete or reset
+    resource_type_id: int | None
+    data: str  # json
+
+
+class Subscription:
+    """
+    Events of resources with given types, queued for one client.
+
+    Nothing blocks on it: the server writing the events is woken up by `on_ready` and takes what is queued.
+    """
+
+    def __init__(self, type_ids: Tuple[int, ...] | None, queue_size: int):
+        self.type_ids = set(type_ids) if type_ids else None  # None for every type
+        self.queue_size = queue_size
+        self.overflowed = False
+        self.closed = False
+
+        self._lock = threading.Lock()
+        self._events: collections.deque = collections.deque()
+        self._wake: Callable[[], None] | None = None
+
+    def on_ready(self, wake: Callable[[], None]) -> None:
+        """
+        Call `wake` whenever events are queued or the subscription is closed, right away if they already are.
+
+        :param wake: called by the publishing thread, must not block
+        :return:
+        """
+
+        with self._lock:
+            self._wake = wake
+            ready = bool(self._events) or self.closed
+        if ready:
+            wake()
+
+    def offer(self, event: Event) -> bool:
+        """
+        Queue an event without blocking the publisher.
+
+        :return: False if the client is too slow and has to be dropped
+        """
+
+        if self.type_ids is not None and event.resource_type_id not in self.type_ids and event.name != "reset":
+            return True
+        with self._lock:
+            if self.closed:
+                return True
+            if len(self._events) >= self.queue_size:
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            wake = self._wake
+        if self.overflowed:
+            self.close()
+            return False
+        if wake:
+            wake()
+        return True
+
+    def close(self) -> None:
+        # queued events are lost anyway
+        with self._lock:
+            self._events.clear()
+            self.closed = True
+            wake = self._wake
+        if wake:
+            wake()
+
+    def take(self) -> List[Event] | None:
+        """
+        Return queued events, None once the subscription is closed.
+        """
+
+        with self._lock:
+            if self.closed:
+                return None
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+
+class EventStream:
+    """
+    Body of a change stream response: server-sent events of a subscription, read without blocking.
+
+    Servers write every stream of a process from one thread or event loop, instead of a worker per client: they
+    `read()` when woken up by `on_ready` or at `wait_until()`, when a heartbeat is due.
+    """
+
+    def __init__(self, hub: "ChangeHub", subscription: Subscription, heartbeat_interval: float):
+        """
+        :param hub: to unsubscribe from once the stream is closed
+        :param subscription:
+        :param heartbeat_interval: seconds without events to send a comment, it detects closed connections
+        """
+
+        self.hub = hub
+        self.subscription = subscription
+        self.heartbeat_interval = heartbeat_interval
+        self._pending = EventStreamView.preamble()
+        self._written_at = time.monotonic()
+
+    def on_ready(self, wake: Callable[[], None]) -> None:
+        self.subscription.on_ready(wake)
+
+    def read(self) -> bytes | None:
+        """
+        Return data to write, empty if there is nothing yet, None at the end of the stream.
+        """
+
+        events = self.subscription.take()
+        if events is None:
+            return None
+
+        data, self._pending = self._pending, b""
+        if events:
+            data += EventStreamView(events).serialize()
+        elif not data and time.monotonic() >= self.wait_until():
+            data = EventStreamView.heartbeat
+        if data:
+            self._written_at = time.monotonic()
+        return data
+
+    def wait_until(self) -> float:
+        """
+        Return monotonic time of the next heartbeat.
+        """
+
+        return self._written_at + self.heartbeat_interval
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self.subscription)
+
+
+class ChangeHub:
+    """
+    Fan-out of resource changes from a single LISTEN connection to every subscribed client.
+
+    Changed rows are read once per notification batch, not once per client. Recent events are kept so that
+    a reconnecting client can resume after the last event it got; older tokens get a 'reset' event instead.
+
+    Triggers notify only while some hub is registered in change_listeners, a hub stays registered while it has
+    subscribers and `idle_timeout` seconds after the last one left. Tokens issued before it unregistered
+    can't be resumed.
+    """
+
+    channel = "resource_changes"
+
+    def __init__(
+        self,
+        connect_kwargs: dict,
+        load: Callable[[List[int]], Dict[int, Tuple[int, str]]],
+        max_subscribers: int = 8,
+        queue_size: int = 1000,
+        replay_size: int = 1000,
+        reconnect_delay: float = 1.0,
+        idle_timeout: float = 60.0,
+    ):
+        """
+        :param connect_kwargs: psycopg2.connect arguments
+        :param load: returns resource_type id and json by id of existing resources
+        :param max_subscribers:
+        :param queue_size: undelivered events per subscriber
+        :param replay_size: recent events kept for resuming
+        :param reconnect_delay: seconds between attempts to listen after a failure
+        :param idle_timeout: seconds without subscribers to stop notifications
+        """
+
+        self.connect_kwargs = connect_kwargs
+        self.load = load
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.idle_timeout = idle_timeout
+
+        self.epoch = str(time.time_ns())  # tokens of another process or run can't be resumed
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._recent: collections.deque = collections.deque(maxlen=replay_size)
+        self._subscribers: set = set()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._registered = threading.Event()
+        self._idle_since: float | None = None  # monotonic time the last subscriber left
+        self._wakeup_r, self._wakeup_w = socket.socketpair()  # interrupts waiting for notifications
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+
+        # counters
+        self.events = 0
+        self.notifications = 0
+        self.dropped_subscribers = 0
+        self.reconnects = 0
+        self.listening = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="change-hub", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"ERROR: listening to {self.channel} failed: {e}")
+            self.listening = False
+            if self._stopped.wait(self.reconnect_delay):
+                return
+            with self._lock:
+                self.reconnects += 1
+            self._publish([self._next_event("reset", None, "{}")])  # changes may have been missed
+
+    def _listen(self) -> None:
+        connection = psycopg2.connect(**self.connect_kwargs)
+        try:
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = connection.cursor()
+            cur.execute(f"LISTEN {self.channel};")
+            self.listening = True
+
+            while not self._stopped.is_set():
+                self._register(cur)
+                readable, _, _ = select.select([connection, self._wakeup_r], [], [], 1.0)
+                if self._wakeup_r in readable:
+                    try:
+                        while self._wakeup_r.recv(512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                if connection not in readable:
+                    continue
+                connection.poll()
+                notifications = list(connection.notifies)
+                connection.notifies.clear()
+                if notifications:
+                    self._publish(self._to_events(notifications))
+            cur.execute("DELETE FROM change_listeners WHERE pid = pg_backend_pid();")
+        finally:
+            self._registered.clear()
+            connection.close()
+
+    def _register(self, cur) -> None:
+        # triggers build and send notifications only while a hub is registered, see migration 8
+        with self._lock:
+            if self._subscribers:
+                self._idle_since = None
+            elif self._idle_since is None:
+                self._idle_since = time.monotonic()
+            wanted = self._idle_since is None or time.monotonic() - self._idle_since < self.idle_timeout
+
+        if wanted and not self._registered.is_set():
+            # rows of crashed processes would keep notifications on
+            cur.execute("DELETE FROM change_listeners WHERE pid NOT IN (SELECT pid FROM pg_stat_activity);")
+            cur.execute("INSERT INTO change_listeners (pid) VALUES (pg_backend_pid()) ON CONFLICT DO NOTHING;")
+            self._registered.set()
+        elif not wanted and self._registered.is_set():
+            cur.execute("DELETE FROM change_listeners WHERE pid = pg_backend_pid();")
+            self._registered.clear()
+            with self._lock:
+                # changes are not followed from now on, tokens issued so far can't be resumed
+                self._recent.clear()
+                self._seq += 1
+
+    def _wake(self) -> None:
+        try:
+            self._wakeup_w.send(b"\0")
+        except BlockingIOError:
+            pass  # already woken up
+
+    def _to_events(self, notifications: list) -> List[Event]:
+        """
+        Turn a batch of notifications into events, a resource changed several times gets one event.
+        """
+
+        changes: Dict[int, Tuple[str, int]] = {}  # resource id -> (operation, resource_type id), in order
+        for notification in notifications:
+            payload = loads(notification.payload)
+            for resource_id, type_id in payload["rows"]:
+                changes.pop(resource_id, None)
+                changes[resource_id] = (payload["op"], type_id)
+        with self._lock:
+            self.notifications += len(notifications)
+
+        upserted = [resource_id for resource_id, (op, _) in changes.items() if op != "delete"]
+        rows = self.load(upserted) if upserted else {}
+
+        events = []
+        for resource_id, (op, type_id) in changes.items():
+            if op == "delete":
+                events.append(self._next_event(op, type_id, dumps({"id": resource_id}).decode()))
+            elif resource_id in rows:  # otherwise deleted since, its delete event follows
+                type_id, data = rows[resource_id]
+                events.append(self._next_event(op, type_id, data))
+        return events
+
+    def _next_event(self, name: str, type_id: int | None, data: str) -> Event:
+        with self._lock:
+            self._seq += 1
+            return Event(token=f"{self.epoch}-{self._seq}", name=name, resource_type_id=type_id, data=data)
+
+    def _publish(self, events: List[Event]) -> None:
+        with self._lock:
+            self._recent.extend(events)
+            self.events += len(events)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            for event in events:
+                if not subscription.offer(event):
+                    self.unsubscribe(subscription)
+                    with self._lock:
+                        self.dropped_subscribers += 1
+                    break
+
+    def _replay(self, last_event_id: str) -> List[Event] | None:
+        # events after the given token, None if they are not kept
+        epoch, _, seq = last_event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdecimal():
+            return None
+        seq = int(seq)
+        if seq > self._seq:
+            return None
+        recent = list(self._recent)
+        if seq < self._seq and (not recent or int(recent[0].token.rpartition("-")[2]) > seq + 1):
+            return None  # some of the events after the token are gone
+        return [event for event in recent if int(event.token.rpartition("-")[2]) > seq]
+
+    def subscribe(self, type_ids: Tuple[int, ...] | None, last_event_id: str | None = None) -> Subscription:
+        """
+        Start receiving events, after the event with `last_event_id` token if given.
+
+        :param type_ids: resource_type ids to receive events of, None for every type
+        :param last_event_id: token of the last event the client got
+        :return:
+        """
+
+        self.start()
+        subscription = Subscription(type_ids, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise exceptions.ServiceUnavailable(detail="too many subscribers")
+
+            if last_event_id:
+                replay = self._replay(last_event_id)
+                if replay is None or len(replay) >= self.queue_size:
+                    # the client has to reload resources and continue from now
+                    token = f"{self.epoch}-{self._seq}"
+                    replay = [Event(token=token, name="reset", resource_type_id=None, data="{}")]
+                for event in replay:
+                    subscription.offer(event)
+
+            self._subscribers.add(subscription)
+
+        # changes committed before triggers see the registration are not notified
+        self._wake()
+        if not self._registered.wait(REGISTER_TIMEOUT):
+            print(f"WARNING: changes are not notified yet, waited for {REGISTER_TIMEOUT} s")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def close(self) -> None:
+        """
+        End every subscription and stop listening.
+        """
+
+        self._stopped.set()
+        self._wake()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+        for subscription in subscribers:
+            subscription.close()
+        if self._thread is not None:
+            self._thread.join(timeout=self.reconnect_delay + 1)  # to unregister from change_listeners
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "listening": self.listening,
+                "notifying": self._registered.is_set(),
+                "subscribers": len(self._subscribers),
+                "events": self.events,
+                "notifications": self.notifications,
+                "dropped_subscribers": self.dropped_subscribers,
+                "reconnects": self.reconnects,
+            }
+
+
+def load_resources(resource_ids: List[int]) -> Dict[int, Tuple[int, str]]:
+    """
+    Read changed resources in a single query and serialize them once for every subscriber.
+
+    :return: resource_type id and json by resource id
+    """
+
+    objs = get_adapter().retrieve_resources(None, {"id": tuple(resource_ids)})
+    view = ResourceView(objs)
+    return {obj.id: (obj.resource_type_id, dumps(view.to_dict(obj)).decode()) for obj in objs}
+
+
+def get_hub() -> ChangeHub:
+    """
+    Return the hub shared by the whole process, it listens once a client subscribes.
+
+    :return:
+    """
+
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = ChangeHub(
+                    get_adapter().db.pool.connect_kwargs,
+                    load=load_resources,
+                    max_subscribers=Config.SSE_MAX_SUBSCRIBERS,
+                    queue_size=Config.SSE_QUEUE_SIZE,
+                    replay_size=Config.SSE_REPLAY_SIZE,
+                )
+    return _hub
@@ -23,3 +23,8 @@ class BadRequest(HTTPException):
 class InternalServerError(HTTPException):
     def __init__(self, detail: str = "internal server error"):
         super().__init__(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=detail)
+
+
+class ServiceUnavailable(HTTPException):
+    def __init__(self, detail: str = "service unavailable"):
+        super().__init__(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail=detail)
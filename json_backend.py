@@ -0,0 +1,49 @@
+import datetime
+import json
+from typing import Any
+
+from config import Config
+
+try:  # optional, several times faster than json
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    # datetimes are rendered by orjson the same way
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps_json(obj: Any) -> bytes:
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _dumps_orjson(obj: Any) -> bytes:
+    return orjson.dumps(obj)
+
+
+def _select_backend(name: str) -> str:
+    """
+    Return the backend to use: 'orjson' if it is installed, unless 'json' is asked for.
+
+    :param name: 'auto', 'orjson' or 'json'
+    :return:
+    """
+
+    if name == "json":
+        return "json"
+    if orjson is None:
+        if name == "orjson":
+            print("WARNING: orjson is not installed, falling back to json")
+        return "json"
+    return "orjson"
+
+
+BACKEND = _select_backend(Config.JSON_BACKEND)
+
+# compact utf-8 json, the same for both backends
+dumps = _dumps_orjson if BACKEND == "orjson" else _dumps_json
+loads = orjson.loads if BACKEND == "orjson" else json.loads
@@ -2,22 +2,26 @@
 # catch errors from db connection, add more details and pass it further to more specific http errors
 # add proper validation as models methods and use everywhere
 
-import asyncio
-import json
+import time
 from http import HTTPStatus
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import List
-from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler
 
-import exceptions
-from controllers import ResourceController, ResourceTypeController
-from views import ResourceTypeView, ResourceView
-
-URL_SCHEME = "scheme://path;parameters?query"
+import metrics
+from asgi import app  # noqa: F401, ASGI application for 'uvicorn main:app'
+from config import Config
+from dispatch import Request, Response, bootstrap, handle, record_request, shutdown, start_metrics_export, stop_streams
+from events import EventStream
+from prefork import Supervisor, WorkerContext
+from server import PooledHTTPServer, serve
 
 
 # server that sends all the request info to a specific controller
 class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # persistent connections
+    disable_nagle_algorithm = True  # headers and body are written separately, don't wait for delayed ACKs
+    timeout = Config.HTTP_KEEPALIVE_TIMEOUT  # close connections idle for longer
+    max_requests = Config.HTTP_KEEPALIVE_MAX_REQUESTS  # close connections after that many requests
+
     def __init__(self, *args, **kwargs):
         """
         Init additional parameters.
@@ -26,9 +30,8 @@ class RequestHandler(BaseHTTPRequestHandler):
         :param kwargs:
         """
 
-        self.parsed_url = None
-        self.url_params: dict = {}
-        self.request_json: dict | None = {}
+        self.request_body: bytes = b""
+        self.requests_count = 0
         super().__init__(*args, **kwargs)
 
     def parse_request(self, *args, **kwargs) -> bool:
@@ -43,161 +46,135 @@ class RequestHandler(BaseHTTPRequestHandler):
         if not super().parse_request():  # follow the parent method
             return False
 
-        # parse url params from raw 'self.path'
-        self.parsed_url = urlparse(self.path, scheme=URL_SCHEME)
-        self.url_params = parse_qs(self.parsed_url.query)
-
-        # parse json from request body
+        # read request body
         try:
-            body_len = int(self.headers.get("Content-Length"))
-            bytes_body = self.rfile.read(body_len)
-            self.request_json = json.loads(bytes_body.decode())
+            body_len = int(self.headers.get("Content-Length") or 0)  # no body, e.g. GET
+            self.request_body = self.rfile.read(body_len) if body_len else b""
         except Exception as e:
-            print(f"ERROR: can't parse json from requests body: {e}")
-            self.respond_json(code=HTTPStatus.BAD_REQUEST, data=f"can't parse json from requests body: {e}")
+            print(f"ERROR: can't read requests body: {e}")
+            self.close_connection = True  # the rest of the body can't be told from the next request
+            self.respond(Response(status=HTTPStatus.BAD_REQUEST, body=f"can't read requests body: {e}".encode()))
             return False  # follow the parent method
         else:
-            print(f"{self.command} {self.path}")
             return True  # follow the parent method
 
-    def respond_json(self, code: int, data: str) -> None:
+    def respond(self, response: Response) -> None:
         """
         Respond to a requesting client.
 
-        :param code:
-        :param data:
-        :return:
-        """
-
-        self.send_response(code=code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(f"{data}".encode())
-
-    def get_controller(self):
-        """
-        Return a controller instance depending on requested path.
-
+        :param response:
         :return:
         """
 
-        # /resources
-        if self.path.startswith("/resources"):
-            return ResourceController(
-                url=self.parsed_url,
-                request_json=self.request_json,
-                url_params=self.url_params,
-            )
-
-        # /resource_types
-        elif self.path.startswith("/resource_types"):
-            return ResourceTypeController(
-                url=self.parsed_url,
-                request_json=self.request_json,
-                url_params=self.url_params,
-            )
-
-        # not found
-        else:
-            return None
-
-    def get_view(self, data: List):
-        """
-        Return a serializer class depending on requested path.
-
-        :return:
-        """
-
-        # /resources
-        if self.path.startswith("/resources"):
-            return ResourceView(data)
-
-        # /resource_types
-        elif self.path.startswith("/resource_types"):
-            return ResourceTypeView(data)
-
-        # not found
-        else:
-            return None
-
-    def do_GET(self):
-        controller = self.get_controller()
-
-        if not controller:  # url not found
-            self.respond_json(code=HTTPStatus.NOT_FOUND, data="resource not found")
-            print(f"WARNING: 404 resource not found")
-
-        try:  # call specific method handler
-            data = controller.retrieve()
-        except exceptions.HTTPException as e:
-            self.respond_json(code=e.status_code, data=f"{e.detail}")
-            return
-
-        view = self.get_view(data)
-        response_string = view.serialize()
-
-        self.respond_json(code=HTTPStatus.OK, data=response_string)
-        print(f"SUCCESS: sent {data}")
+        self.requests_count += 1
+
+        self.send_response(code=response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+
+        chunked = response.streaming and self.request_version == "HTTP/1.1"
+        if response.streaming and not chunked:
+            self.close_connection = True  # body of unknown size ends with the connection for HTTP/1.0 clients
+        elif chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        # no body is allowed for 1xx, 204 and 304
+        elif response.status >= 200 and response.status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+            self.send_header("Content-Length", str(len(response.body)))
+
+        # the stream writer keeps an event stream until it ends, then closes the connection
+        handed_over = isinstance(response.body, EventStream)
+        # free the worker for waiting connections instead of holding it for an idle client
+        if handed_over or self.requests_count >= self.max_requests or self.server.has_waiting():
+            self.send_header("Connection", "close")  # also sets 'close_connection'
+        elif not self.close_connection:
+            keep_alive = f"timeout={int(self.timeout)}, max={self.max_requests - self.requests_count}"
+            self.send_header("Keep-Alive", keep_alive)
 
-    def do_POST(self):
-        controller = self.get_controller()
-
-        if not controller:  # url not found
-            self.respond_json(code=HTTPStatus.NOT_FOUND, data="resource not found")
-            print(f"WARNING: 404 resource not found")
-
-        try:  # call specific method handler
-            data = controller.create()
-        except exceptions.HTTPException as e:
-            self.respond_json(code=e.status_code, data=e.detail)
+        self.end_headers()
+        if handed_over:
+            self.server.hand_over(self.connection, response.body, chunked)
             return
-
-        view = self.get_view(data)
-        response_string = view.serialize()
-
-        self.respond_json(code=HTTPStatus.CREATED, data=response_string)
-        print(f"SUCCESS: sent {data}")
-
-    def do_PATCH(self):
-        controller = self.get_controller()
-
-        if not controller:  # url not found
-            self.respond_json(code=HTTPStatus.NOT_FOUND, data="resource not found")
-            print(f"WARNING: 404 resource not found")
-
-        try:  # call specific method handler
-            data = controller.update()
-        except exceptions.HTTPException as e:
-            self.respond_json(code=e.status_code, data=e.detail)
+        if self.command == "HEAD":
             return
-
-        view = self.get_view(data)
-        response_string = view.serialize()
-
-        self.respond_json(code=HTTPStatus.CREATED, data=response_string)
-        print(f"SUCCESS: {data} updated")
-
-    def do_DELETE(self):
-        controller = self.get_controller()
-
-        if not controller:  # url not found
-            self.respond_json(code=HTTPStatus.NOT_FOUND, data="resource not found")
-            print(f"WARNING: 404 resource not found")
-
-        try:  # call specific method handler
-            controller.delete()
-        except exceptions.HTTPException as e:
-            self.respond_json(code=e.status_code, data=e.detail)
+        if not response.streaming:
+            self.wfile.write(response.body)
             return
 
-        self.respond_json(code=HTTPStatus.NO_CONTENT, data="")
-        print(f"SUCCESS: deleted")
-
-
-def create_app():
-    return HTTPServer(("0.0.0.0", 8000), RequestHandler)
-
-
-app = create_app()
-loop = asyncio.get_event_loop()
-loop.run_until_complete(app.serve_forever())
+        try:
+            for chunk in response.body:
+                if not chunk:
+                    continue
+                if chunked:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                else:
+                    self.wfile.write(chunk)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except Exception as e:
+            # status is already sent, an unterminated body tells the client the response is broken
+            print(f"ERROR: streaming interrupted: {e}")
+            self.close_connection = True
+        finally:
+            close = getattr(response.body, "close", None)
+            if close:
+                close()  # release db cursor and connection held by the stream
+
+    def dispatch(self) -> None:
+        started = time.perf_counter()
+        request = Request(
+            method=self.command,
+            path=self.path,
+            headers={name.lower(): value for name, value in self.headers.items()},
+            body=self.request_body,
+        )
+        response = handle(request, server_stats=self.server.stats)
+        handled = time.perf_counter()
+        try:
+            self.respond(response)
+        finally:
+            record_request(request, response, started, handled)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = dispatch
+
+
+def create_app(reuse_port: bool = False):
+    return PooledHTTPServer(
+        (Config.HTTP_HOST, Config.HTTP_PORT),
+        RequestHandler,
+        workers=Config.HTTP_WORKERS,
+        queue_size=Config.HTTP_QUEUE_SIZE,
+        backlog=Config.HTTP_BACKLOG,
+        reuse_port=reuse_port,
+    )
+
+
+def run(context: WorkerContext | None = None) -> None:
+    """
+    Serve in this process, or as a prefork worker with `context`.
+
+    :param context: given by the supervisor
+    :return:
+    """
+
+    bootstrap()  # migrations are serialized with an advisory lock, workers run them one after another
+    server = create_app(reuse_port=context is not None)
+    if context:
+        if context.metrics_dir:
+            start_metrics_export(context.metrics_dir, server.stats)
+        context.notify_ready()
+    serve(server, shutdown_timeout=Config.HTTP_SHUTDOWN_TIMEOUT, on_stop=stop_streams)
+    metrics.flush_export()
+    shutdown()
+
+
+if __name__ == "__main__":
+    if Config.PREFORK_WORKERS > 0:
+        Supervisor(
+            run,
+            Config.PREFORK_WORKERS,
+            stop_timeout=Config.HTTP_SHUTDOWN_TIMEOUT,
+            ready_timeout=Config.PREFORK_READY_TIMEOUT,
+            restart_delay=Config.PREFORK_RESTART_DELAY,
+        ).run()
+    else:
+        run()
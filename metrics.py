@@ -0,0 +1,387 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Tuple
+
+from config import Config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # prometheus text format
+
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+ACQUIRE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# first word of a statement -> kind label, anything else is 'other'
+STATEMENT_KINDS = frozenset(("select", "insert", "update", "delete", "declare", "listen", "create", "alter", "drop"))
+
+_local = threading.local()  # query time of the request handled by the thread
+
+RETIRED_FILE = "retired.json"  # counts of exited prefork workers
+_export_dir = None  # set in prefork workers, /metrics then aggregates every process exporting there
+_export_gauges = None
+
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _sample(name: str, labels: str) -> str:
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Counts of observed values by upper bound, and their sum, for every set of label values.
+
+    An observation is a bisect and a few additions under a lock, buckets are made cumulative on rendering.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...], buckets: Iterable[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+
+        self._lock = threading.Lock()
+        self._series: dict = {}  # label values -> [count per bucket..., count above the last one, sum]
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)  # buckets are inclusive upper bounds
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self) -> dict:
+        with self._lock:
+            return {values: list(counts) for values, counts in self._series.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def add(counts: list, other: list) -> list:
+        return [a + b for a, b in zip(counts, other)]
+
+    def render(self, series: dict | None = None) -> List[str]:
+        """
+        :param series: counts by label values, collected ones by default
+        :return: lines of prometheus text format
+        """
+
+        series = sorted((self.collect() if series is None else series).items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, counts in series:
+            labels = _labels(self.label_names, label_values)
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_number(bound)}"}} {cumulative}')
+            lines.append(f"{_sample(self.name + '_sum', labels)} {_number(counts[-1])}")
+            lines.append(f"{_sample(self.name + '_count', labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+
+        self._lock = threading.Lock()
+        self._values: dict = {}  # label values -> count
+
+    def inc(self, *label_values, amount: int = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def add(value: int, other: int) -> int:
+        return value + other
+
+    def render(self, values: dict | None = None) -> List[str]:
+        values = sorted((self.collect() if values is None else values).items())
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in values:
+            lines.append(f"{_sample(self.name, _labels(self.label_names, label_values))} {_number(value)}")
+        return lines
+
+
+def render_gauge(name: str, documentation: str, label_names: Tuple[str, ...], samples: dict) -> List[str]:
+    """
+    Render current values, e.g. read from stats of pools and caches.
+
+    :param samples: value by label values
+    :return: lines of prometheus text format
+    """
+
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for label_values, value in samples.items():
+        if value is not None:
+            lines.append(f"{_sample(name, _labels(label_names, label_values))} {_number(value)}")
+    return lines
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from a parsed request to its last written byte.",
+    ("route", "method", "status"),
+    HTTP_BUCKETS,
+)
+REQUEST_PHASE_DURATION = Histogram(
+    "http_request_phase_seconds",
+    "Time spent by requests in parse, query, serialize, compress and write phases.",
+    ("route", "phase"),
+    HTTP_BUCKETS,
+)
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Execution time of sql statements, rows of server-side cursors are fetched later.",
+    ("kind",),
+    QUERY_BUCKETS,
+)
+QUERY_ERRORS = Counter("db_query_errors_total", "Sql statements that failed.", ("kind",))
+CONNECTION_ACQUIRE_DURATION = Histogram(
+    "db_connection_acquire_seconds",
+    "Time to check out a connection from the pool, waiting and reconnecting included.",
+    (),
+    ACQUIRE_BUCKETS,
+)
+
+PREFORK_RESTARTS = Counter("prefork_worker_restarts_total", "Worker processes restarted after they exited.", ())
+PREFORK_RELOADS = Counter("prefork_reloads_total", "Reloads of all worker processes by result.", ("result",))
+
+COLLECTED = (
+    REQUEST_DURATION,
+    REQUEST_PHASE_DURATION,
+    QUERY_DURATION,
+    QUERY_ERRORS,
+    CONNECTION_ACQUIRE_DURATION,
+    PREFORK_RESTARTS,
+    PREFORK_RELOADS,
+)
+
+
+def statement_kind(query: str | bytes) -> str:
+    head = query[:32]  # statements of execute_values come as bytes
+    if isinstance(head, bytes):
+        head = head.decode("ascii", "replace")
+    words = head.split(None, 1)
+    kind = words[0].lower() if words else ""
+    return kind if kind in STATEMENT_KINDS else "other"
+
+
+def observe_query(query: str | bytes, seconds: float, failed: bool = False) -> None:
+    if not Config.METRICS_ENABLED:
+        return
+
+    kind = statement_kind(query)
+    QUERY_DURATION.observe(seconds, kind)
+    if failed:
+        QUERY_ERRORS.inc(kind)
+    _local.query_seconds = getattr(_local, "query_seconds", 0.0) + seconds
+
+
+def observe_acquire(seconds: float) -> None:
+    if Config.METRICS_ENABLED:
+        CONNECTION_ACQUIRE_DURATION.observe(seconds)
+
+
+def start_request() -> None:
+    # query time is counted per thread, a request is handled by a single one
+    _local.query_seconds = 0.0
+
+
+def request_query_seconds() -> float:
+    return getattr(_local, "query_seconds", 0.0)
+
+
+def observe_phase(route: str, phase: str, seconds: float) -> None:
+    if Config.METRICS_ENABLED:
+        REQUEST_PHASE_DURATION.observe(seconds, route, phase)
+
+
+def observe_request(route: str, method: str, status: int, seconds: float) -> None:
+    if Config.METRICS_ENABLED:
+        REQUEST_DURATION.observe(seconds, route, method, str(int(status)))
+
+
+def reset() -> None:
+    """
+    Forget collected metrics, e.g. counts a forked process inherited from its parent.
+    """
+
+    for metric in COLLECTED:
+        metric.reset()
+
+
+def snapshot(gauges: Iterable[tuple] = ()) -> dict:
+    """
+    Return collected metrics of this process in a JSON serializable form.
+
+    :param gauges: name, documentation, label names and samples of every gauge
+    :return:
+    """
+
+    return {
+        "pid": os.getpid(),
+        "series": {metric.name: [[list(k), v] for k, v in metric.collect().items()] for metric in COLLECTED},
+        "gauges": [
+            [name, documentation, list(label_names), [[list(k), v] for k, v in samples.items() if v is not None]]
+            for name, documentation, label_names, samples in gauges
+        ],
+    }
+
+
+def _write(path: str, data: dict) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)  # readers never see a partial file
+
+
+def _read(path: str) -> dict | None:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def export(directory: str, gauges: Iterable[tuple] = ()) -> None:
+    """
+    Save a snapshot of this process for others to aggregate.
+    """
+
+    _write(os.path.join(directory, f"{os.getpid()}.json"), snapshot(gauges))
+
+
+def start_export(directory: str, interval: float, gauges: Callable[[], Iterable[tuple]]) -> None:
+    """
+    Export snapshots every `interval` seconds from a daemon thread and aggregate `directory` on rendering.
+
+    :param directory: shared by the supervisor and every worker
+    :param interval:
+    :param gauges: returns current gauges of this process
+    :return:
+    """
+
+    global _export_dir, _export_gauges
+    _export_dir, _export_gauges = directory, gauges
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                export(directory, gauges())
+            except Exception as e:
+                print(f"ERROR: can't export metrics: {e}")
+
+    threading.Thread(target=run, name="metrics-export", daemon=True).start()
+
+
+def flush_export() -> None:
+    """
+    Export the last counts of a worker that stops serving, if it exports at all.
+    """
+
+    if _export_dir is not None:
+        export(_export_dir, _export_gauges())
+
+
+def _merge_series(snapshots: List[dict]) -> dict:
+    merged = {metric.name: {} for metric in COLLECTED}
+    for data in snapshots:
+        for metric in COLLECTED:
+            series = merged[metric.name]
+            for label_values, value in data["series"].get(metric.name, ()):
+                key = tuple(label_values)
+                series[key] = metric.add(series[key], value) if key in series else value
+    return merged
+
+
+def _merge_gauges(snapshots: List[dict]) -> List[tuple]:
+    families = {}  # name -> name, documentation, label names, samples
+    for data in snapshots:
+        for name, documentation, label_names, samples in data["gauges"]:
+            family = families.setdefault(name, (name, documentation, tuple(label_names), {}))
+            for label_values, value in samples:
+                key = tuple(label_values)
+                family[3][key] = family[3].get(key, 0) + value
+    return list(families.values())
+
+
+def retire(directory: str, pid: int) -> None:
+    """
+    Fold counts of an exited process into the retired file, so that totals never go down; its gauges are dropped.
+
+    Called by the supervisor only, the retired file has a single writer.
+
+    :param directory:
+    :param pid:
+    :return:
+    """
+
+    path = os.path.join(directory, f"{pid}.json")
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    snapshots = [data for data in (_read(retired_path), _read(path)) if data]
+    if snapshots:
+        series = _merge_series(snapshots)
+        retired = {name: [[list(k), v] for k, v in values.items()] for name, values in series.items()}
+        _write(retired_path, {"pid": None, "series": retired, "gauges": []})
+    for stale_path in (path, f"{path}.tmp"):
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+def render(gauges: Iterable[tuple] = ()) -> bytes:
+    """
+    Return collected metrics in prometheus text format.
+
+    In prefork workers histograms and counters are summed over every process, exited ones included, and gauges over
+    running ones; other workers are as fresh as their last export.
+
+    :param gauges: name, documentation, label names and samples of every gauge
+    :return:
+    """
+
+    if _export_dir is None:
+        series = {metric.name: metric.collect() for metric in COLLECTED}
+    else:
+        export(_export_dir, gauges)
+        names = sorted(name for name in os.listdir(_export_dir) if name.endswith(".json"))
+        snapshots = [data for data in (_read(os.path.join(_export_dir, name)) for name in names) if data]
+        series = _merge_series(snapshots)
+        gauges = _merge_gauges(snapshots)
+
+    lines = []
+    for metric in COLLECTED:
+        lines.extend(metric.render(series[metric.name]))
+    for gauge in gauges:
+        lines.extend(render_gauge(*gauge))
+    return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,311 @@
+import os
+import select
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+import metrics
+from config import Config
+
+CRASH_LOOP_SECONDS = 10  # workers exiting sooner after start are restarted with a growing delay
+STOP_GRACE_SECONDS = 5  # on top of the shutdown timeout before workers are killed
+
+
+@dataclass
+class WorkerContext:
+    """
+    What a worker process gets from the supervisor.
+    """
+
+    slot: int
+    generation: int
+    metrics_dir: str | None  # to export metrics to, None if they are disabled
+    ready_fd: int
+
+    def notify_ready(self) -> None:
+        """
+        Tell the supervisor the worker listens, call once.
+        """
+
+        os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+
+@dataclass
+class Worker:
+    pid: int
+    slot: int
+    generation: int
+    started_at: float
+    ready_fd: int | None  # read end, None once the worker is ready or has closed it
+    ready: bool = False
+    stopping: bool = False
+
+
+class Supervisor:
+    """
+    Runs `workers` processes with `target` and keeps them running.
+
+    Every worker binds its own socket to the same port with SO_REUSEPORT and opens its own db pool after the fork,
+    the supervisor itself never connects to the database.
+
+    Workers that exit are restarted, with a growing delay for crash loops. SIGHUP reloads without downtime:
+    a new generation is started, and the old one gets SIGTERM once every new worker listens. SIGTERM and SIGINT
+    stop every worker and wait for them to drain.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[WorkerContext], None],
+        workers: int,
+        stop_timeout: float = 30,
+        ready_timeout: float = 60,
+        restart_delay: float = 1,
+        max_restart_delay: float = 30,
+    ):
+        """
+        :param target: runs in every worker until it stops serving
+        :param workers: number of processes
+        :param stop_timeout: seconds for workers to drain before they are killed, a grace period is added
+        :param ready_timeout: seconds for a new generation to listen before a reload is given up
+        :param restart_delay: before restarting a crashed worker, doubled up to `max_restart_delay` for crash loops
+        :param max_restart_delay:
+        """
+
+        self.target = target
+        self.workers = workers
+        self.stop_timeout = stop_timeout
+        self.ready_timeout = ready_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self.generation = 0
+        self.metrics_dir = None
+        self._workers: Dict[int, Worker] = {}  # by pid
+        self._restart_at: Dict[int, float] = {}  # slot -> monotonic time
+        self._delays: Dict[int, float] = {}  # slot -> current restart delay
+        self._reload_deadline = None  # of the reload in progress
+        self._stopping = False
+        self._reload_requested = False
+        self._wakeup_r, self._wakeup_w = -1, -1
+
+    def run(self) -> None:
+        """
+        Start workers and supervise them until SIGTERM or SIGINT.
+        """
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)  # signals interrupt select() below
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        if Config.METRICS_ENABLED:
+            self.metrics_dir = tempfile.mkdtemp(prefix="prefork-metrics-")
+        print(f"INFO: supervisor {os.getpid()} starting {self.workers} workers")
+        try:
+            while not self._stopping:
+                self._reap()
+                self._start_reload()
+                self._spawn_missing()
+                self._finish_reload()
+                self._export_metrics()
+                self._wait(1.0)
+        finally:
+            self._stop_all()
+            if self.metrics_dir:
+                shutil.rmtree(self.metrics_dir, ignore_errors=True)
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            print("INFO: supervisor stopped")
+
+    def _stop(self, signum, frame):
+        print(f"INFO: got signal {signum}, stopping workers")
+        self._stopping = True
+
+    def _reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _spawn(self, slot: int) -> None:
+        ready_r, ready_w = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(self._run_worker(WorkerContext(slot, self.generation, self.metrics_dir, ready_w), ready_r))
+
+        os.close(ready_w)
+        self._workers[pid] = Worker(pid, slot, self.generation, time.monotonic(), ready_r)
+        print(f"INFO: started worker {pid} in slot {slot}, generation {self.generation}")
+
+    def _run_worker(self, context: WorkerContext, ready_r: int) -> int:
+        code = 1
+        try:
+            # the worker installs its own handlers, and never sees pipes of the supervisor and its siblings
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            for fd in (ready_r, self._wakeup_r, self._wakeup_w):
+                os.close(fd)
+            for worker in self._workers.values():
+                if worker.ready_fd is not None:
+                    os.close(worker.ready_fd)
+            metrics.reset()  # counts of the supervisor are exported by the supervisor
+
+            self.target(context)
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        return code
+
+    def _current(self, slot: int) -> Worker | None:
+        for worker in self._workers.values():
+            if worker.slot == slot and worker.generation == self.generation and not worker.stopping:
+                return worker
+        return None
+
+    def _spawn_missing(self) -> None:
+        now = time.monotonic()
+        for slot in range(self.workers):
+            if self._current(slot) is None and now >= self._restart_at.get(slot, 0):
+                self._spawn(slot)
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            self._close_ready_fd(worker)
+            if self.metrics_dir:
+                metrics.retire(self.metrics_dir, pid)
+            if worker.stopping or self._stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            now = time.monotonic()
+            if now - worker.started_at < CRASH_LOOP_SECONDS:
+                delay = min(self._delays.get(worker.slot, self.restart_delay / 2) * 2, self.max_restart_delay)
+            else:
+                delay = self.restart_delay
+            self._delays[worker.slot] = delay
+            self._restart_at[worker.slot] = now + delay
+            metrics.PREFORK_RESTARTS.inc()
+            print(f"WARNING: worker {pid} exited with code {code}, restarting in {delay:g} s")
+
+    def _close_ready_fd(self, worker: Worker) -> None:
+        if worker.ready_fd is not None:
+            os.close(worker.ready_fd)
+            worker.ready_fd = None
+
+    def _wait(self, timeout: float) -> None:
+        # until a worker is ready, a signal comes or timeout
+        fds = [self._wakeup_r] + [worker.ready_fd for worker in self._workers.values() if worker.ready_fd is not None]
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+        except InterruptedError:
+            return
+
+        for worker in list(self._workers.values()):
+            if worker.ready_fd in readable:
+                worker.ready = os.read(worker.ready_fd, 1) == b"1"  # nothing if the worker died before
+                self._close_ready_fd(worker)
+        if self._wakeup_r in readable:
+            try:
+                while os.read(self._wakeup_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _start_reload(self) -> None:
+        if not self._reload_requested:
+            return
+        self._reload_requested = False
+        if self._reload_deadline is not None:
+            print("WARNING: reload is already in progress")
+            return
+
+        # old workers keep serving until every new one listens, `_spawn_missing` starts the new generation
+        self.generation += 1
+        self._reload_deadline = time.monotonic() + self.ready_timeout
+        self._restart_at.clear()
+        print(f"INFO: reloading workers, generation {self.generation}")
+
+    def _finish_reload(self) -> None:
+        if self._reload_deadline is None:
+            return
+
+        new = [self._current(slot) for slot in range(self.workers)]
+        if all(worker is not None and worker.ready for worker in new):
+            self._terminate(worker for worker in self._workers.values() if worker.generation < self.generation)
+            metrics.PREFORK_RELOADS.inc("ok")
+            print(f"INFO: generation {self.generation} is ready, stopping the previous one")
+        elif time.monotonic() > self._reload_deadline:
+            # the previous generation stays, workers of it that exited meanwhile are restarted
+            self._terminate(worker for worker in self._workers.values() if worker.generation == self.generation)
+            self.generation -= 1
+            self._restart_at.clear()
+            metrics.PREFORK_RELOADS.inc("failed")
+            print(f"ERROR: generation {self.generation + 1} didn't start in {self.ready_timeout:g} s, reload failed")
+        else:
+            return
+        self._reload_deadline = None
+
+    def _terminate(self, workers) -> None:
+        for worker in list(workers):
+            worker.stopping = True
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _stop_all(self) -> None:
+        self._terminate(self._workers.values())
+        deadline = time.monotonic() + self.stop_timeout + STOP_GRACE_SECONDS
+        while self._workers and time.monotonic() < deadline:
+            self._reap()
+            if self._workers:
+                self._wait(0.1)
+
+        for worker in self._workers.values():
+            print(f"WARNING: worker {worker.pid} didn't stop in time, killing it")
+            try:
+                os.kill(worker.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in list(self._workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            del self._workers[pid]
+
+    def _export_metrics(self) -> None:
+        if not self.metrics_dir:
+            return
+        states = {"ready": 0, "starting": 0, "stopping": 0}
+        for worker in self._workers.values():
+            states["stopping" if worker.stopping else "ready" if worker.ready else "starting"] += 1
+        gauges = [("prefork_workers", "Worker processes by state.", ("state",), {(s,): n for s, n in states.items()})]
+        try:
+            metrics.export(self.metrics_dir, gauges)
+        except OSError as e:
+            print(f"ERROR: can't export metrics: {e}")
@@ -0,0 +1,50 @@
+import cProfile
+import os
+import re
+import time
+from typing import Any, Callable, Tuple
+
+from config import Config
+
+PROFILE_HEADER = "x-profile"
+
+
+def requested(headers: dict) -> bool:
+    """
+    Tell if a request has to be profiled: every request with PROFILE_REQUESTS=all, only those with
+    'X-Profile: 1' header with PROFILE_REQUESTS=header, none by default.
+
+    :param headers: lowercase names
+    :return:
+    """
+
+    mode = Config.PROFILE_REQUESTS
+    if mode == "off":
+        return False
+    return mode == "all" or (mode == "header" and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"))
+
+
+def profile(func: Callable[[], Any], name: str, directory: str | None = None) -> Tuple[Any, str]:
+    """
+    Call `func` under cProfile and save the stats, readable with pstats or snakeviz.
+
+    Only the calling thread is profiled.
+
+    :param func:
+    :param name: part of the file name, e.g. method and route
+    :param directory: defaults to PROFILE_DIR
+    :return: result of `func` and path of the saved stats
+    """
+
+    directory = directory or Config.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = re.sub(r"[^\w-]+", "_", name).strip("_")  # e.g. 'GET /resources/{id}' -> 'GET_resources_id'
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{name}.prof")
+
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func)
+    finally:
+        profiler.dump_stats(path)
+    print(f"INFO: profile saved to {path}")
+    return result, path
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable, Tuple
+
+from config import Config
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    body: bytes
+    headers: dict
+    etag: str  # versions of the tables the response was read from
+    tables: Tuple[str, ...]
+    stored_at: float
+    encoded: dict = field(default_factory=dict)  # compressed bodies by encoding, filled on first use
+
+
+class ResponseCache:
+    """
+    Serialized GET responses by normalized path and query, least recently used are dropped past `max_bytes`.
+
+    An entry is served only while its ETag is current, so writes of any process make it stale as soon as
+    table versions are re-read; writes of this process also drop entries of the written table at once.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 60.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # key -> CachedResponse, least recently used first
+        self._size = 0
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(path: str, url_params: dict) -> tuple:
+        # same query params in any order share an entry
+        return path.rstrip("/"), tuple(sorted((name, tuple(values)) for name, values in url_params.items()))
+
+    def get(self, key: tuple, etag: str) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.etag != etag or time.monotonic() - entry.stored_at >= self.ttl):
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, entry: CachedResponse) -> None:
+        if len(entry.body) > self.max_bytes // 4:  # a single response must not flush the whole cache
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body)
+
+    def invalidate(self, table_names: Iterable[str]) -> None:
+        """
+        Drop responses read from any of the tables, call after writes.
+        """
+
+        table_names = set(table_names)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if table_names.intersection(entry.tables)]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def bypassed(self) -> None:
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests else None,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def get_response_cache() -> ResponseCache | None:
+    """
+    Return the cache shared by the whole process, None if it is disabled.
+
+    :return:
+    """
+
+    global _cache
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(max_bytes=Config.RESPONSE_CACHE_MAX_BYTES, ttl=Config.RESPONSE_CACHE_TTL)
+    return _cache
@@ -0,0 +1,98 @@
+import gzip
+import zlib
+from http import HTTPStatus
+from typing import Iterator
+
+# content types worth compressing; event streams are sent as is, every event has to reach the client at once
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    """
+    Tell if 'Accept-Encoding' allows gzip, e.g. 'gzip, deflate' or 'br;q=1.0, gzip;q=0.8'.
+
+    An explicit gzip entry takes precedence over '*', so '*, gzip;q=0' refuses it.
+    """
+
+    if not accept_encoding:
+        return False
+
+    explicit = wildcard = None  # quality values
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if coding not in ("gzip", "x-gzip", "*"):
+            continue
+        quality = 1.0
+        param = params.strip().replace(" ", "")
+        if param.startswith("q="):
+            try:
+                quality = float(param[2:])
+            except ValueError:
+                quality = 0.0
+        if coding == "*":
+            wildcard = quality
+        else:
+            explicit = quality if explicit is None else max(explicit, quality)
+
+    quality = explicit if explicit is not None else wildcard
+    return quality is not None and quality > 0
+
+
+def gzip_stream(chunks: Iterator[bytes], level: int) -> Iterator[bytes]:
+    """
+    Compress chunks as they come, memory doesn't grow with the body size.
+
+    :param chunks: source body, closed with this generator
+    :param level: 1 (fastest) - 9 (smallest)
+    :return:
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    try:
+        for chunk in chunks:
+            if data := compressor.compress(chunk):
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()  # release db cursor and connection held by the stream
+
+
+def compress(response, accept_encoding: str | None, level: int = 6, min_size: int = 1024):
+    """
+    Gzip the response body if the client accepts it and it is worth it.
+
+    Bodies of known size are compressed only from `min_size` bytes, streamed bodies always.
+    Compressed bodies are memoized in `response.encoded`, shared with the cached response if any.
+
+    :param response: dispatch.Response
+    :param accept_encoding: request header
+    :param level: 1 (fastest) - 9 (smallest)
+    :param min_size: bytes
+    :return: the same response
+    """
+
+    if response.status in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED) or "Content-Encoding" in response.headers:
+        return response
+    if response.headers.get("Content-Type") not in COMPRESSIBLE_TYPES:
+        return response
+
+    response.headers["Vary"] = "Accept-Encoding"  # caches must keep both variants
+    if not accepts_gzip(accept_encoding):
+        return response
+
+    if response.streaming:
+        response.body = gzip_stream(response.body, level)
+    elif len(response.body) < min_size:
+        return response
+    elif response.encoded is not None and "gzip" in response.encoded:
+        response.body = response.encoded["gzip"]
+    else:
+        response.body = gzip.compress(response.body, compresslevel=level, mtime=0)
+        if response.encoded is not None:
+            response.encoded["gzip"] = response.body
+
+    response.headers["Content-Encoding"] = "gzip"
+    return response
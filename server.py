@@ -0,0 +1,397 @@
+import queue
+import selectors
+import signal
+import socket
+import threading
+import time
+from http.server import HTTPServer
+from typing import Callable
+
+REJECT_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 19\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b'"server overloaded"'
+)
+
+
+class _StreamClient:
+    def __init__(self, sock: socket.socket, stream, chunked: bool):
+        self.sock = sock
+        self.stream = stream
+        self.chunked = chunked
+        self.buffer = bytearray()  # not yet sent
+        self.ending = False  # the stream ended, closed once the buffer is sent
+        self.mask = selectors.EVENT_READ
+
+
+class StreamWriter:
+    """
+    One thread writing never ending responses of every client, e.g. change streams, over non-blocking sockets,
+    so that a subscribed client doesn't hold a worker.
+
+    A stream has `read()` returning data to write or None at the end, `on_ready(wake)`, `wait_until()` telling
+    when to read without a wakeup, and `close()`, see `events.EventStream`.
+    """
+
+    def __init__(self, max_buffer: int = 1024 * 1024):
+        """
+        :param max_buffer: bytes not taken by a client to drop it
+        """
+
+        self.max_buffer = max_buffer
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._lock = threading.Lock()
+        self._added: list = []  # registered by the writer thread
+        self._ready: set = set()  # woken up, have data to read
+        self._clients: set = set()  # owned by the writer thread
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+
+        # counters
+        self.streams = 0
+        self.finished = 0
+        self.dropped = 0
+
+    def add(self, sock: socket.socket, stream, chunked: bool) -> None:
+        """
+        Write `stream` to `sock` until it ends, then close both. Headers have to be sent already.
+
+        :param sock: connected socket, owned by the writer from now on
+        :param stream:
+        :param chunked: frame data with chunked transfer encoding
+        :return:
+        """
+
+        client = _StreamClient(sock, stream, chunked)
+        sock.setblocking(False)
+        with self._lock:
+            self._added.append(client)
+            self.streams += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stream-writer", daemon=True)
+                self._thread.start()
+        stream.on_ready(lambda: self._mark_ready(client))
+        self._wake()
+
+    def _mark_ready(self, client: _StreamClient) -> None:
+        with self._lock:
+            self._ready.add(client)
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            self._wakeup_w.send(b"\0")
+        except BlockingIOError:
+            pass  # already woken up
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                added, self._added = self._added, []
+                ready, self._ready = self._ready, set()
+            for client in added:
+                self._selector.register(client.sock, client.mask, client)
+                self._clients.add(client)
+                ready.add(client)  # the start of the stream is pending
+
+            now = time.monotonic()
+            ready.update(client for client in self._clients if client.stream.wait_until() <= now)
+            for client in ready:
+                if client in self._clients:
+                    self._pull(client)
+
+            with self._lock:
+                if self._stopped and not self._clients and not self._added:
+                    return
+            deadline = min((client.stream.wait_until() for client in self._clients), default=None)
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            for key, mask in self._selector.select(timeout):
+                client = key.data
+                if client is None:
+                    try:
+                        while self._wakeup_r.recv(512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self._receive(client)
+                if mask & selectors.EVENT_WRITE and client in self._clients:
+                    self._flush(client)
+
+    def _receive(self, client: _StreamClient) -> None:
+        # clients of a stream send nothing, readable means they closed the connection
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client, dropped=False)
+
+    def _pull(self, client: _StreamClient) -> None:
+        data = client.stream.read()
+        if data is None:
+            client.ending = True
+            if client.chunked:
+                client.buffer += b"0\r\n\r\n"
+        elif data and client.chunked:
+            client.buffer += f"{len(data):x}\r\n".encode() + data + b"\r\n"
+        elif data:
+            client.buffer += data
+
+        if len(client.buffer) > self.max_buffer:
+            print("WARNING: stream client doesn't read, dropping it")
+            self._close(client, dropped=True)
+        else:
+            self._flush(client)
+
+    def _flush(self, client: _StreamClient) -> None:
+        try:
+            while client.buffer:
+                sent = client.sock.send(client.buffer)
+                del client.buffer[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(client, dropped=False)
+            return
+
+        if client.ending and not client.buffer:
+            self._close(client, dropped=False)
+            return
+        mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.buffer else 0)
+        if mask != client.mask:
+            client.mask = mask
+            self._selector.modify(client.sock, mask, client)
+
+    def _close(self, client: _StreamClient, dropped: bool) -> None:
+        self._clients.discard(client)
+        self._selector.unregister(client.sock)
+        client.sock.close()
+        client.stream.close()
+        with self._lock:
+            self.streams -= 1
+            self.finished += 1
+            self.dropped += dropped
+
+    def close(self, timeout: float | None = None) -> bool:
+        """
+        Wait for streams to end, e.g. once their subscriptions are closed, and stop the thread.
+
+        :param timeout: seconds to wait
+        :return: True if every stream ended in time
+        """
+
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._wake()
+        if thread is not None:
+            thread.join(timeout)
+        return thread is None or not thread.is_alive()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "streams": self.streams,
+                "finished": self.finished,
+                "dropped": self.dropped,
+            }
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server handling connections with a fixed number of worker threads.
+
+    Accepted connections wait in a bounded queue; when it is full, new connections get 503 right away
+    instead of piling up. Never ending responses are handed over to a `StreamWriter` and free their worker.
+    """
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        workers: int = 8,
+        queue_size: int = 64,
+        backlog: int = 128,
+        reuse_port: bool = False,
+    ):
+        """
+        :param reuse_port: bind with SO_REUSEPORT, the kernel then spreads connections over processes bound to the port
+        """
+
+        self.request_queue_size = backlog  # listen() backlog of not yet accepted connections
+        self.allow_reuse_port = reuse_port
+        super().__init__(server_address, handler_class)
+
+        self.workers = workers
+        self.stream_writer = StreamWriter()
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._handed_over: set = set()  # connections owned by the stream writer
+
+        # counters
+        self.handled = 0
+        self.rejected = 0
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"http-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address) -> None:
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            try:
+                request.sendall(REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self) -> None:
+        while True:
+            item = self._requests.get()
+            if item is None:  # stop signal
+                return
+
+            request, client_address = item
+            with self._lock:
+                self._busy += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._lock:
+                    handed_over = request in self._handed_over
+                    self._handed_over.discard(request)
+                if not handed_over:
+                    self.shutdown_request(request)
+                with self._lock:
+                    self._busy -= 1
+                    self.handled += 1
+
+    def hand_over(self, request, stream, chunked: bool) -> None:
+        """
+        Let the stream writer write the rest of a response and close the connection, call from a handler
+        that has sent the headers and returns right after.
+
+        :param request: socket of the connection
+        :param stream: see `StreamWriter`
+        :param chunked: frame data with chunked transfer encoding
+        :return:
+        """
+
+        with self._lock:
+            self._handed_over.add(request)
+        self.stream_writer.add(request, stream, chunked)
+
+    def has_waiting(self) -> bool:
+        """
+        Return True if accepted connections are waiting for a free worker.
+        """
+
+        return not self._requests.empty()
+
+    def accept_pending(self) -> int:
+        """
+        Accept connections left in the listen() backlog and close the listening socket.
+
+        Connections still in the backlog of a closed socket are reset, with SO_REUSEPORT every process has its own
+        backlog and the others would not take them over (unless net.ipv4.tcp_migrate_req is set).
+
+        :return: number of accepted connections
+        """
+
+        accepted = 0
+        self.socket.setblocking(False)
+        while True:
+            try:
+                request, client_address = self.get_request()
+            except OSError:  # BlockingIOError once the backlog is empty
+                break
+            request.setblocking(True)
+            self.process_request(request, client_address)
+            accepted += 1
+        self.socket.close()
+        return accepted
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """
+        Let workers finish pending, queued and in-flight requests, then stop them and wait for handed over streams.
+        Call after `serve_forever` returned.
+
+        :param timeout: seconds to wait for workers
+        :return: True if every worker stopped in time
+        """
+
+        self.accept_pending()
+        for _ in self._threads:
+            self._requests.put(None)  # queued connections are handled before stop signals
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        streams_ended = self.stream_writer.close(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return streams_ended and not any(thread.is_alive() for thread in self._threads)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "queued": self._requests.qsize(),
+                "queue_size": self._requests.maxsize,
+                "handled": self.handled,
+                "rejected": self.rejected,
+                "streams": self.stream_writer.stats(),
+            }
+
+
+def serve(
+    server: PooledHTTPServer, shutdown_timeout: float | None = None, on_stop: Callable[[], None] | None = None
+) -> None:
+    """
+    Serve until SIGINT or SIGTERM, then stop accepting connections and drain in-flight requests.
+
+    :param server:
+    :param shutdown_timeout: seconds to wait for in-flight requests
+    :param on_stop: called before draining, e.g. to end streamed responses
+    :return:
+    """
+
+    def stop(signum, frame):
+        print(f"INFO: got signal {signum}, shutting down")
+        # shutdown() waits for serve_forever() running in this very thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    host, port = server.server_address[:2]
+    print(f"INFO: serving on {host}:{port} with {server.workers} workers")
+    try:
+        server.serve_forever()
+    finally:
+        if on_stop:
+            on_stop()
+        if not server.drain(shutdown_timeout):
+            print("WARNING: in-flight requests were not finished in time")
+        server.server_close()
+        print("INFO: server stopped")
@@ -0,0 +1,23 @@
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import exceptions
+from controllers import ResourceController
+
+
+def make_controller(path: str) -> ResourceController:
+    url = urlparse(path)
+    return ResourceController(url=url, url_params=parse_qs(url.query))
+
+
+@pytest.mark.parametrize("value", ["-1", "1.5", "abc", "²", "½"])
+def test_min_exceeding_rejects_non_decimal(value):
+    # invalid values are rejected before the database is touched
+    with pytest.raises(exceptions.BadRequest):
+        make_controller(f"/resources?min_exceeding={value}").retrieve()
+
+
+def test_speeding_rejects_unknown_value():
+    with pytest.raises(exceptions.BadRequest):
+        make_controller("/resources?speeding=maybe").retrieve()
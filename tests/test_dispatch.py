@@ -0,0 +1,66 @@
+from http import HTTPStatus
+
+import pytest
+
+import dispatch
+from dispatch import Request, Response, etag_matches
+
+ETAG = 'W/"3-7"'
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    # the tag stays current, responses are served without db
+    served = []
+
+    def respond(request, controller, etag):
+        served.append(request.path)
+        status = HTTPStatus.NOT_FOUND if request.path.endswith("/404") else HTTPStatus.OK
+        return Response(status=status, body=b"{}", headers={"ETag": etag})
+
+    monkeypatch.setattr(dispatch, "get_etag", lambda request: ETAG)
+    monkeypatch.setattr(dispatch, "respond_get_cached", respond)
+    return served
+
+
+def get(path: str, if_none_match: str | None = None) -> Response:
+    request = Request("GET", path, headers={"if-none-match": if_none_match} if if_none_match else {})
+    return dispatch.handle_get(request, dispatch.get_controller(request))
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        (None, False),
+        ("", False),
+        ("*", True),
+        (ETAG, True),
+        ('"3-7"', True),
+        ('W/"1-1", W/"3-7"', True),
+        ('W/"3-8"', False),
+    ],
+)
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches(if_none_match, ETAG) is expected
+
+
+def test_list_is_not_modified_without_reading_it(responses):
+    response = get("/resources", ETAG)
+    assert response.status == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == ETAG
+    assert responses == []
+
+
+def test_changed_list_is_served(responses):
+    assert get("/resources", 'W/"3-6"').status == HTTPStatus.OK
+
+
+def test_existing_object_is_not_modified(responses):
+    assert get("/resources/1", ETAG).status == HTTPStatus.NOT_MODIFIED
+    assert responses == ["/resources/1"]
+
+
+def test_missing_object_is_never_not_modified(responses):
+    # a current table tag doesn't tell that an object is still there, e.g. for '*'
+    assert get("/resources/404", ETAG).status == HTTPStatus.NOT_FOUND
+    assert get("/resource_types/404", "*").status == HTTPStatus.NOT_FOUND
@@ -0,0 +1,22 @@
+import pytest
+
+from db.models import speed_exceeding
+
+
+@pytest.mark.parametrize(
+    "current_speed, max_speed, expected",
+    [
+        (60, 50, 20),
+        (51, 50, 2),
+        (101, 50, 102),
+        (100, 30, 233),  # rounded down like integer division in db
+        (50, 50, 0),
+        (10, 50, 0),
+        (0, 50, 0),
+        (None, 50, 0),
+        (10, 0, 0),
+        (10, None, 0),
+    ],
+)
+def test_speed_exceeding(current_speed, max_speed, expected):
+    assert speed_exceeding(current_speed, max_speed) == expected
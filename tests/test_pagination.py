@@ -0,0 +1,126 @@
+import base64
+import datetime
+import json
+
+import pytest
+
+import exceptions
+from db.pagination import Page, decode_cursor, encode_cursor, last_key, paginate_rows, parse_page
+
+COLUMNS = ("id", "name", "current_speed", "created_at")
+CREATED_AT = datetime.datetime(2023, 10, 5, 12, 30)
+ROWS = [
+    (1, "L1", 30, CREATED_AT),
+    (2, "E2", 50, CREATED_AT + datetime.timedelta(minutes=2)),
+    (3, "R3", 30, CREATED_AT + datetime.timedelta(minutes=1)),
+    (4, "T4", 10, CREATED_AT + datetime.timedelta(minutes=1)),
+    (5, "G5", 50, CREATED_AT),
+]
+
+
+def forge(*items) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(items)).encode()).decode().rstrip("=")
+
+
+def page_of(**params) -> Page:
+    return parse_page("resource", {name: [value] for name, value in params.items()}, None, 100)
+
+
+def all_pages(order: str, limit: int) -> list:
+    # follow next cursors the way a client does
+    ids, after = [], None
+    while True:
+        page = page_of(order=order, limit=str(limit), **({"after": after} if after else {}))
+        rows = paginate_rows(ROWS, COLUMNS, page)
+        ids.extend(row[0] for row in rows)
+        page.set_next_cursor(len(rows), last_key(rows, COLUMNS, page))
+        if page.next_cursor is None:
+            return ids
+        after = page.next_cursor
+
+
+@pytest.mark.parametrize(
+    "order, value, obj_id",
+    [
+        ("id", 7, 7),
+        ("-name", "R3", 3),
+        ("current_speed", -(2**31), 4),
+        ("-created_at", CREATED_AT, 5),
+        ("created_at", CREATED_AT.replace(microsecond=123), 1),
+    ],
+)
+def test_cursor_round_trip(order, value, obj_id):
+    page = page_of(order=order)
+    assert decode_cursor(page, encode_cursor(page, value, obj_id)) == (value, obj_id)
+
+
+def test_cursor_has_no_padding():
+    assert "=" not in encode_cursor(page_of(), 1, 1)
+
+
+def test_cursor_of_other_order_is_rejected():
+    cursor = encode_cursor(page_of(order="name"), "R3", 3)
+    with pytest.raises(exceptions.BadRequest, match="order=name"):
+        decode_cursor(page_of(order="-name"), cursor)
+
+
+@pytest.mark.parametrize(
+    "order, cursor",
+    [
+        ("id", "not a cursor"),
+        ("id", forge("id", 1)),
+        ("id", forge("id", "1", 1)),
+        ("id", forge("id", 1, True)),
+        ("id", forge("id", 1, 1.5)),
+        ("id", forge("id", 1, 2**31)),
+        ("current_speed", forge("current_speed", None, 1)),
+        ("name", forge("name", 1, 1)),
+        ("name", forge("name", "a\x00", 1)),
+        ("created_at", forge("created_at", "yesterday", 1)),
+        ("created_at", forge("created_at", "2023-10-05T12:30:00+03:00", 1)),
+    ],
+)
+def test_forged_cursor_is_rejected(order, cursor):
+    with pytest.raises(exceptions.BadRequest, match="wrong after"):
+        decode_cursor(page_of(order=order), cursor)
+
+
+@pytest.mark.parametrize("order", ["speed", "--name", "-", "-id;"])
+def test_wrong_order_is_rejected(order):
+    with pytest.raises(exceptions.BadRequest, match="wrong order"):
+        page_of(order=order)
+
+
+@pytest.mark.parametrize("limit", ["0", "-1", "ten", "²"])
+def test_wrong_limit_is_rejected(limit):
+    with pytest.raises(exceptions.BadRequest, match="wrong limit"):
+        page_of(limit=limit)
+
+
+def test_limit_is_capped():
+    assert parse_page("resource", {"limit": ["1000"]}, 20, 100).limit == 100
+    assert parse_page("resource", {}, 20, 100).limit == 20
+
+
+def test_paginate_rows_orders_with_id_tie_break():
+    page = page_of(order="-current_speed")
+    assert [row[0] for row in paginate_rows(ROWS, COLUMNS, page)] == [5, 2, 3, 1, 4]
+
+
+@pytest.mark.parametrize("order", ["id", "-id", "name", "-name", "current_speed", "-current_speed", "created_at"])
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_pages_cover_every_row_once(order, limit):
+    expected = [row[0] for row in paginate_rows(ROWS, COLUMNS, page_of(order=order))]
+    assert all_pages(order, limit) == expected
+
+
+def test_last_page_has_no_cursor():
+    page = page_of(limit="5")
+    rows = paginate_rows(ROWS, COLUMNS, page)
+    page.set_next_cursor(len(rows), last_key(rows, COLUMNS, page))
+    assert page.next_cursor is not None  # a full page, there may be more
+
+    page = page_of(limit="6")
+    rows = paginate_rows(ROWS, COLUMNS, page)
+    page.set_next_cursor(len(rows), last_key(rows, COLUMNS, page))
+    assert page.next_cursor is None
@@ -0,0 +1,138 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import psycopg2.extensions
+import pytest
+
+import exceptions
+from db.pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = SimpleNamespace(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(ConnectionPool):
+    # never connects, idle connections always look alive
+    def _open(self):
+        connection = FakeConnection()
+        with self._cond:
+            self._created += 1
+            self._opened_at[id(connection)] = time.monotonic()
+        return connection
+
+    @staticmethod
+    def _has_input(connection) -> bool:
+        return False
+
+
+def make_pool(**kwargs) -> FakePool:
+    kwargs.setdefault("validate_idle", None)
+    return FakePool(**kwargs)
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        ConnectionPool(min_size=3, max_size=2)
+
+
+def test_checkout_reuses_idle_connection():
+    pool = make_pool(min_size=1, max_size=2)
+    first = pool.getconn()
+    assert pool.stats()["in_use"] == 1
+    pool.putconn(first)
+    assert pool.getconn() is first
+
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 1
+    assert stats["idle"] == 0
+    assert stats["size"] == 1
+
+
+def test_broken_connection_is_discarded():
+    pool = make_pool(min_size=0, max_size=2)
+    connection = pool.getconn()
+    pool.putconn(connection, broken=True)
+
+    stats = pool.stats()
+    assert connection.closed
+    assert stats["size"] == 0
+    assert stats["in_use"] == 0
+    assert stats["discarded"] == 1
+
+
+def test_open_transaction_is_rolled_back():
+    pool = make_pool(min_size=0, max_size=1)
+    connection = pool.getconn()
+    connection.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(connection)
+
+    assert pool.getconn() is connection
+    assert pool.stats()["discarded"] == 0
+
+
+def test_expired_connection_is_recycled():
+    pool = make_pool(min_size=0, max_size=1, max_lifetime=0.01)
+    old = pool.getconn()
+    pool.putconn(old)
+    time.sleep(0.02)
+
+    new = pool.getconn()
+    assert new is not old
+    assert old.closed
+    stats = pool.stats()
+    assert stats["created"] == 2
+    assert stats["discarded"] == 1
+    assert stats["size"] == 1
+
+
+def test_exhausted_pool_times_out():
+    pool = make_pool(min_size=0, max_size=1, timeout=0.05)
+    pool.getconn()
+    with pytest.raises(exceptions.ServiceUnavailable):
+        pool.getconn()
+
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waiting"] == 0
+    assert stats["in_use"] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool = make_pool(min_size=0, max_size=1, timeout=5)
+    connection = pool.getconn()
+    received = []
+    waiter = threading.Thread(target=lambda: received.append(pool.getconn()))
+    waiter.start()
+    while pool.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    pool.putconn(connection)
+    waiter.join()
+
+    assert received == [connection]
+    stats = pool.stats()
+    assert stats["waits"] == 1
+    assert stats["wait_time_max"] > 0
+    assert stats["created"] == 1
+
+
+def test_closeall_closes_idle_connections():
+    pool = make_pool(min_size=2, max_size=2)
+    connection = pool.getconn()
+    pool.closeall()
+
+    stats = pool.stats()
+    assert stats["idle"] == 0
+    assert stats["size"] == 1  # the checked out one
+    assert not connection.closed
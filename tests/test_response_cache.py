@@ -0,0 +1,72 @@
+import time
+
+from response_cache import CachedResponse, ResponseCache
+
+
+def entry(body: bytes = b"x" * 10, etag: str = 'W/"1"', tables=("resource",)) -> CachedResponse:
+    return CachedResponse(200, body, {}, etag, tables, time.monotonic())
+
+
+def test_key_ignores_param_order_and_trailing_slash():
+    key = ResponseCache.key
+    assert key("/resources/", {"a": ["1"], "b": ["2"]}) == key("/resources", {"b": ["2"], "a": ["1"]})
+    assert key("/resources", {"a": ["1", "2"]}) != key("/resources", {"a": ["2", "1"]})
+
+
+def test_hit_needs_current_etag():
+    cache = ResponseCache()
+    cache.put("k", entry(etag='W/"1"'))
+    assert cache.get("k", 'W/"1"') is not None
+    assert cache.get("k", 'W/"2"') is None
+    assert cache.get("k", 'W/"1"') is None  # stale entry is dropped
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["size_bytes"]) == (1, 2, 0, 0)
+
+
+def test_entry_expires_after_ttl():
+    cache = ResponseCache(ttl=0.01)
+    cache.put("k", entry())
+    time.sleep(0.02)
+    assert cache.get("k", 'W/"1"') is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(max_bytes=100)
+    for key in ("a", "b", "c"):
+        cache.put(key, entry(b"x" * 25))
+    cache.get("a", 'W/"1"')  # 'b' is the least recently used now
+    cache.put("d", entry(b"x" * 25))
+    cache.put("e", entry(b"x" * 25))
+
+    assert cache.get("b", 'W/"1"') is None
+    assert all(cache.get(key, 'W/"1"') is not None for key in ("a", "c", "d", "e"))
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["size_bytes"] == 100
+
+
+def test_replacing_entry_keeps_size():
+    cache = ResponseCache()
+    cache.put("k", entry(b"x" * 10))
+    cache.put("k", entry(b"x" * 30))
+    assert cache.stats()["size_bytes"] == 30
+    assert cache.stats()["entries"] == 1
+
+
+def test_large_response_is_not_cached():
+    cache = ResponseCache(max_bytes=100)
+    cache.put("k", entry(b"x" * 26))
+    assert cache.get("k", 'W/"1"') is None
+
+
+def test_invalidate_drops_entries_of_written_tables():
+    cache = ResponseCache()
+    cache.put("resources", entry(tables=("resource", "resource_type")))
+    cache.put("types", entry(tables=("resource_type",)))
+    cache.invalidate(["resource"])
+
+    assert cache.get("resources", 'W/"1"') is None
+    assert cache.get("types", 'W/"1"') is not None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,78 @@
+import gzip
+from http import HTTPStatus
+
+import pytest
+
+from dispatch import Response
+from response_compression import accepts_gzip, compress
+
+BODY = b'{"name": "R1"}' * 100
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, False),
+        ("", False),
+        ("gzip", True),
+        ("GZIP", True),
+        ("x-gzip", True),
+        ("gzip, deflate", True),
+        ("br;q=1.0, gzip;q=0.8", True),
+        ("gzip ; q = 0.5", True),
+        ("deflate, br", False),
+        ("gzip;q=0", False),
+        ("gzip;q=0.0", False),
+        ("gzip;q=wrong", False),
+        ("*", True),
+        ("*;q=0.5", True),
+        ("*;q=0", False),
+        ("*, gzip;q=0", False),  # explicit entry takes precedence
+        ("gzip;q=0, *", False),
+        ("*;q=0, gzip", True),
+        ("gzip;q=0, x-gzip;q=0.3", True),
+    ],
+)
+def test_accepts_gzip(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) is expected
+
+
+def test_body_is_compressed_and_memoized():
+    encoded = {}
+    response = compress(Response(status=HTTPStatus.OK, body=BODY, encoded=encoded), "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == BODY
+    assert encoded == {"gzip": response.body}
+
+    again = compress(Response(status=HTTPStatus.OK, body=BODY, encoded=encoded), "gzip")
+    assert again.body is response.body
+
+
+@pytest.mark.parametrize(
+    "response, accept_encoding",
+    [
+        (Response(status=HTTPStatus.OK, body=BODY), "gzip;q=0"),
+        (Response(status=HTTPStatus.OK, body=b"{}"), "gzip"),  # too small to be worth it
+        (Response(status=HTTPStatus.OK, body=BODY, headers={"Content-Type": "text/plain"}), "gzip"),
+        (Response(status=HTTPStatus.NOT_MODIFIED), "gzip"),
+    ],
+)
+def test_body_is_left_as_is(response, accept_encoding):
+    body = response.body
+    assert compress(response, accept_encoding).body is body
+    assert "Content-Encoding" not in response.headers
+
+
+def test_stream_is_compressed_and_closed():
+    closed = []
+
+    def chunks():
+        try:
+            yield from (BODY[:100], BODY[100:])
+        finally:
+            closed.append(True)
+
+    response = compress(Response(status=HTTPStatus.OK, body=chunks()), "gzip")
+    assert gzip.decompress(b"".join(response.body)) == BODY
+    assert closed == [True]
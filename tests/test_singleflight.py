@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+CALLERS = 5
+
+
+def run_concurrently(flight: SingleFlight, key, func) -> list:
+    # the leader runs `func` until every other caller has joined the flight
+    results = []
+
+    def call():
+        try:
+            results.append(flight.do(key, func))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def wait_for_callers(flight: SingleFlight) -> None:
+    while flight.coalesced < CALLERS - 1:
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    runs = []
+
+    def func():
+        runs.append(1)
+        wait_for_callers(flight)
+        return object()
+
+    results = run_concurrently(flight, "k", func)
+    assert len(runs) == 1
+    assert len(set(map(id, results))) == 1
+    assert flight.stats() == {"in_flight": 0, "executed": 1, "coalesced": 4, "coalesced_rate": 0.8}
+
+
+def test_exception_is_raised_to_every_caller():
+    flight = SingleFlight()
+
+    def func():
+        wait_for_callers(flight)
+        raise ValueError("failed")
+
+    results = run_concurrently(flight, "k", func)
+    assert len(results) == CALLERS
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_sequential_calls_run_again():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flight.do("k", lambda: {}["missing"])
+    assert flight.do("k", lambda: 3) == 3
+    assert flight.stats()["executed"] == 4
+
+
+def test_other_keys_are_not_shared():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: flight.do("b", lambda: "b") + "a") == "ba"
+    assert flight.coalesced == 0
@@ -1,10 +1,9 @@
-import dataclasses
-import json
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-from db.db_adapter import DBAdapter
-from db.models import Resource, ResourceType
+from db.db_adapter import get_adapter
+from db.models import Resource, ResourceType, ResourceWithType, speed_exceeding
+from json_backend import dumps
 
 
 class BaseView(ABC):
@@ -12,45 +11,127 @@ class BaseView(ABC):
     def serialize(self):
         pass
 
+    @abstractmethod
+    def to_dict(self, obj) -> dict:
+        pass
+
+    def stream(self, stream_format: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Serialize objects one by one, as a json array or as newline delimited json.
+
+        :param stream_format: 'json' or 'ndjson'
+        :param chunk_size: min bytes per yielded chunk, except the last one
+        :return:
+        """
+
+        ndjson = stream_format == "ndjson"
+        chunk = bytearray(b"" if ndjson else b"[")
+        separator = b""
+
+        for obj in self.objs:
+            item = dumps(self.to_dict(obj))
+            if ndjson:
+                chunk += item + b"\n"
+            else:
+                chunk += separator + item
+                separator = b","
+
+            if len(chunk) >= chunk_size:
+                yield bytes(chunk)
+                chunk.clear()
+
+        if not ndjson:
+            chunk += b"]"
+        if chunk:
+            yield bytes(chunk)
+
 
 class ResourceTypeView(BaseView):
     def __init__(self, objs: ResourceType | List[ResourceType]):
         self.objs = objs
 
-    def serialize(self) -> str:
-        json_list = [dataclasses.asdict(obj) for obj in self.objs]
+    def to_dict(self, obj: ResourceType) -> dict:
+        # attributes are read directly, dataclasses.asdict deep-copies every object
+        return {"id": obj.id, "name": obj.name, "max_speed": obj.max_speed, "created_at": obj.created_at}
+
+    def serialize(self) -> bytes:
+        json_list = [self.to_dict(obj) for obj in self.objs]
 
         if len(json_list) == 1:  # single instance
             json_list = json_list[0]
 
-        json_string = json.dumps(json_list)
-        return json_string
+        return dumps(json_list)
 
 
 class ResourceView(BaseView):
-    def __init__(self, objs: List[Resource]):
+    def __init__(self, objs: List[Resource] | List[ResourceWithType] | Iterable[ResourceWithType]):
         self.objs = objs
+        self.resource_types: Dict[int, Tuple[str, int]] = {}
+
+    def get_resource_types(self) -> Dict[int, Tuple[str, int]]:
+        """
+        Return name and max_speed by resource_type id for objects retrieved without them, in a single query.
+
+        :return:
+        """
+
+        type_ids = {obj.resource_type_id for obj in self.objs if not isinstance(obj, ResourceWithType)}
+        if not type_ids:
+            return {}
+
+        adapter = get_adapter()
+        resource_types = adapter.retrieve_resource_types_by_id(tuple(type_ids))
+        return {type_id: (res_type.name, res_type.max_speed) for type_id, res_type in resource_types.items()}
+
+    def to_dict(self, obj: Resource | ResourceWithType) -> dict:
+        if isinstance(obj, ResourceWithType):  # speed_exceeding is calculated by db
+            type_name = obj.resource_type_name
+            exceeding = obj.speed_exceeding or 0
+        else:
+            type_name, max_speed = self.resource_types.get(obj.resource_type_id, (None, None))
+            exceeding = speed_exceeding(obj.current_speed, max_speed)
+
+        # 'resource_type.name' instead of 'resource_type_id'
+        return {
+            "id": obj.id,
+            "name": obj.name,
+            "current_speed": obj.current_speed,
+            "created_at": obj.created_at,
+            "speed_exceeding": exceeding,
+            "resource_type": type_name,
+        }
+
+    def serialize(self) -> bytes:
+        self.resource_types = self.get_resource_types()
+
+        json_list = [self.to_dict(obj) for obj in self.objs]
 
-    def serialize(self) -> str:
-        adapter = DBAdapter()
+        if len(json_list) == 1:  # single instance
+            json_list = json_list[0]
 
-        json_list = []
-        for obj in self.objs:
-            data = dataclasses.asdict(obj)
-            res_type = adapter.retrieve(ResourceType, "resource_type", obj.resource_type_id, None)[0]
-            max_speed = res_type.max_speed
-            data["speed_exceeding"] = (
-                int((obj.current_speed / max_speed - 1) * 100) if obj.current_speed > max_speed else 0
-            )
+        return dumps(json_list)
 
-            # replace 'resource_type_id' with 'resource_type.name'
-            data.pop("resource_type_id")
-            data["resource_type"] = res_type.name
 
-            json_list.append(data)
+class EventStreamView:
+    """
+    Server-sent events, ids are resume tokens for 'Last-Event-ID'.
+    """
 
-        if len(json_list) == 1:  # single instance
-            json_list = json_list[0]
+    heartbeat = b": keep-alive\n\n"  # a comment, sent without events to detect closed connections
+
+    def __init__(self, events: list):
+        self.events = events
+
+    @staticmethod
+    def preamble(retry_ms: int = 3000) -> bytes:
+        """
+        :param retry_ms: reconnection delay for clients
+        :return: start of the stream
+        """
+
+        return f"retry: {retry_ms}\n\n".encode()
 
-        json_string = json.dumps(json_list)
-        return json_string
+    def serialize(self) -> bytes:
+        return "".join(
+            f"id: {event.token}\nevent: {event.name}\ndata: {event.data}\n\n" for event in self.events
+        ).encode()